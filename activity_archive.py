@@ -0,0 +1,461 @@
+import os
+import re
+import csv
+import gzip
+import glob
+import logging
+import argparse
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+from models import db, EmailActivity, EmailLog
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: without it archives are written as gzip-compressed CSV
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'archive'))
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 180))
+
+# Archived tables and the timestamp that decides a row's age and month
+ARCHIVE_TABLES = {
+    EmailActivity.__tablename__: (EmailActivity.__table__, 'created_at'),
+    EmailLog.__tablename__: (EmailLog.__table__, 'sent_at'),
+}
+PARTITIONED_TABLE = EmailActivity.__tablename__
+PARTITION_NAME = re.compile(rf'^{PARTITIONED_TABLE}_(\d{{4}})_(\d{{2}})$')
+FILE_NAME = re.compile(r'^(\d+)-(\d+)\.(csv\.gz|parquet)$')
+
+
+def month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(value):
+    return (month_start(value) + timedelta(days=32)).replace(day=1)
+
+
+# ---------------------------------------------------------------------------
+# Monthly partitions (Postgres)
+# ---------------------------------------------------------------------------
+
+def is_partitioned(connection, table_name=PARTITIONED_TABLE):
+    if connection.dialect.name != 'postgresql':
+        return False
+    relkind = connection.execute(
+        sa.text("SELECT relkind FROM pg_class WHERE relname = :name AND relnamespace = current_schema()::regnamespace"),
+        {'name': table_name}
+    ).scalar()
+    return relkind == 'p'
+
+
+def list_partitions(connection, table_name=PARTITIONED_TABLE):
+    """{month_start: partition_name} for the monthly partitions of table_name"""
+    names = connection.execute(sa.text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :name"
+    ), {'name': table_name}).scalars()
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def default_partition(connection, table_name=PARTITIONED_TABLE):
+    return connection.execute(sa.text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :name AND pg_get_expr(child.relpartbound, child.oid) = 'DEFAULT'"
+    ), {'name': table_name}).scalar()
+
+
+def create_partition(connection, month, table_name=PARTITIONED_TABLE):
+    """
+    Create the partition for month. Postgres refuses while rows of that month sit in the
+    default partition, so those are moved over with the default detached meanwhile.
+    """
+    name = f"{table_name}_{month:%Y_%m}"
+    bounds = f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')"
+    time_column = ARCHIVE_TABLES[table_name][1]
+    in_month = f"{time_column} >= '{month:%Y-%m-%d}' AND {time_column} < '{next_month(month):%Y-%m-%d}'"
+    default = default_partition(connection, table_name)
+    if default and connection.execute(sa.text(f'SELECT 1 FROM "{default}" WHERE {in_month} LIMIT 1')).first():
+        connection.execute(sa.text(f'ALTER TABLE "{table_name}" DETACH PARTITION "{default}"'))
+        connection.execute(sa.text(f'CREATE TABLE "{name}" PARTITION OF "{table_name}" {bounds}'))
+        moved = connection.execute(sa.text(
+            f'WITH moved AS (DELETE FROM "{default}" WHERE {in_month} RETURNING *) '
+            f'INSERT INTO "{name}" SELECT * FROM moved'
+        )).rowcount
+        connection.execute(sa.text(f'ALTER TABLE "{table_name}" ATTACH PARTITION "{default}" DEFAULT'))
+        logger.info("Moved %s row(s) from %s into %s", moved, default, name)
+    else:
+        connection.execute(sa.text(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table_name}" {bounds}'))
+    return name
+
+
+def ensure_partitions(months_ahead=3):
+    """Create the monthly partitions for this month and the next `months_ahead`; no-op unless partitioned"""
+    with db.engine.begin() as connection:
+        if not is_partitioned(connection):
+            return []
+        existing = list_partitions(connection)
+        month = month_start(datetime.utcnow())
+        created = []
+        for _ in range(months_ahead + 1):
+            if month not in existing:
+                created.append(create_partition(connection, month))
+            month = next_month(month)
+    for name in created:
+        logger.info("Created partition %s", name)
+    return created
+
+
+def partition_activity_table(months_ahead=3):
+    """
+    One-off Postgres migration: turn emailAuto into a table partitioned by month on created_at.
+    Rows are copied into the new table inside one transaction; stop the sender while it runs.
+    """
+    table = PARTITIONED_TABLE
+    old = f"{table}_unpartitioned"
+    with db.engine.begin() as connection:
+        if connection.dialect.name != 'postgresql':
+            raise RuntimeError("Monthly partitions need Postgres")
+        if is_partitioned(connection):
+            logger.info("%s is already partitioned", table)
+            return
+        sequence = connection.execute(sa.text("SELECT pg_get_serial_sequence(:table, 'id')"),
+                                      {'table': f'"{table}"'}).scalar()
+        connection.execute(sa.text(f'ALTER TABLE "{table}" RENAME TO "{old}"'))
+        connection.execute(sa.text(f'UPDATE "{old}" SET created_at = now() AT TIME ZONE \'utc\' WHERE created_at IS NULL'))
+        connection.execute(sa.text(
+            f'CREATE TABLE "{table}" (LIKE "{old}" INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)'
+        ))
+        # The partition key has to be part of the primary key
+        connection.execute(sa.text(f'ALTER TABLE "{table}" ALTER COLUMN created_at SET NOT NULL'))
+        connection.execute(sa.text(f'ALTER TABLE "{table}" ADD PRIMARY KEY (id, created_at)'))
+        connection.execute(sa.text(f'CREATE INDEX "ix_{table}_created_at" ON "{table}" (created_at)'))
+        if sequence:
+            connection.execute(sa.text(f'ALTER SEQUENCE {sequence} OWNED BY "{table}".id'))
+
+        oldest = connection.execute(sa.text(f'SELECT min(created_at) FROM "{old}"')).scalar()
+        month = month_start(oldest or datetime.utcnow())
+        last = month_start(datetime.utcnow())
+        for _ in range(months_ahead):
+            last = next_month(last)
+        while month <= last:
+            create_partition(connection, month)
+            month = next_month(month)
+        # Catches rows outside the prepared months until ensure_partitions catches up
+        connection.execute(sa.text(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT'))
+
+        connection.execute(sa.text(f'INSERT INTO "{table}" SELECT * FROM "{old}"'))
+        copied = connection.execute(sa.text(f'SELECT count(*) FROM "{table}"')).scalar()
+        original = connection.execute(sa.text(f'SELECT count(*) FROM "{old}"')).scalar()
+        if copied != original:
+            raise RuntimeError(f"Copied {copied} of {original} rows; rolled back")
+        connection.execute(sa.text(f'DROP TABLE "{old}"'))
+    logger.info("Partitioned %s by month (%s rows)", table, copied)
+
+
+# ---------------------------------------------------------------------------
+# Archive files
+# ---------------------------------------------------------------------------
+
+def _serialise(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _converters(table):
+    converters = {}
+    for column in table.columns:
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = str
+        if python_type is datetime:
+            converters[column.name] = datetime.fromisoformat
+        elif python_type in (int, float):
+            converters[column.name] = python_type
+        else:
+            converters[column.name] = str
+    return converters
+
+
+class ArchiveWriter:
+    """
+    Writes archived rows as one file per chunk and month:
+    <dir>/<table>/<YYYY-MM>/<first_id>-<last_id>.csv.gz (or .parquet).
+    Files are written as .tmp and only published once the rows are gone from
+    the database, so an interrupted run never leaves rows in both places.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, file_format='csv'):
+        if file_format == 'parquet' and pyarrow is None:
+            raise RuntimeError("Parquet archives need pyarrow (pip install pyarrow); use csv instead")
+        self.directory = directory
+        self.file_format = file_format
+        self.extension = 'parquet' if file_format == 'parquet' else 'csv.gz'
+        self.pending = []
+
+    def write_chunk(self, table_name, columns, time_column, rows):
+        """Stage one chunk of rows (tuples in `columns` order); returns the staged paths"""
+        time_index = columns.index(time_column)
+        id_index = columns.index('id')
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(f"{row[time_index]:%Y-%m}", []).append(row)
+        staged = []
+        for month, month_rows in by_month.items():
+            folder = os.path.join(self.directory, table_name, month)
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"{month_rows[0][id_index]}-{month_rows[-1][id_index]}.{self.extension}")
+            self._write(path + '.tmp', columns, month_rows)
+            staged.append(path)
+        self.pending.extend(staged)
+        return staged
+
+    def _write(self, path, columns, rows):
+        if self.file_format == 'parquet':
+            data = {column: [row[i] for row in rows] for i, column in enumerate(columns)}
+            pq.write_table(pyarrow.table(data), path, compression='zstd')
+            return
+        with gzip.open(path, 'wt', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow([_serialise(value) for value in row])
+            f.flush()
+            os.fsync(f.fileno())
+
+    def publish(self):
+        """Make staged files visible; call after the rows were deleted and committed"""
+        for path in self.pending:
+            os.replace(path + '.tmp', path)
+        self.pending = []
+
+    def discard(self):
+        for path in self.pending:
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+        self.pending = []
+
+
+def recover_staged_files(directory=ARCHIVE_DIR):
+    """
+    Resolve .tmp files left by an interrupted run: if the chunk's first row is
+    still in the database the delete never committed, so drop the file;
+    otherwise the rows are only in the file, so publish it.
+    """
+    for table_name, (table, _) in ARCHIVE_TABLES.items():
+        for path in glob.glob(os.path.join(directory, table_name, '*', '*.tmp')):
+            match = FILE_NAME.match(os.path.basename(path)[:-len('.tmp')])
+            if not match:
+                continue
+            still_hot = db.session.execute(
+                sa.select(table.c.id).where(table.c.id == int(match.group(1)))
+            ).first() is not None
+            if still_hot:
+                os.remove(path)
+                logger.info("Dropped unfinished archive file %s", path)
+            else:
+                os.replace(path, path[:-len('.tmp')])
+                logger.info("Published archive file %s", path[:-len('.tmp')])
+
+
+def _select_chunk(source, columns, time_column, cutoff, last_id, chunk_size):
+    return db.session.execute(
+        sa.select(*[source.c[column] for column in columns])
+        .where(source.c[time_column] < cutoff, source.c.id > last_id)
+        .order_by(source.c.id)
+        .limit(chunk_size)
+    ).all()
+
+
+def archive_table(table_name, cutoff, writer, chunk_size=10000):
+    """Move rows older than cutoff from table_name into the archive, chunk by chunk. Returns rows archived."""
+    table, time_column = ARCHIVE_TABLES[table_name]
+    columns = [column.name for column in table.columns]
+    archived = 0
+
+    # Whole monthly partitions past the cutoff are exported and dropped instead of deleted row by row
+    if table_name == PARTITIONED_TABLE and is_partitioned(db.session.connection()):
+        for month, name in sorted(list_partitions(db.session.connection()).items()):
+            if next_month(month) > cutoff:
+                continue
+            partition = sa.table(name, *[sa.column(column) for column in columns])
+            last_id = 0
+            while True:
+                rows = _select_chunk(partition, columns, time_column, cutoff, last_id, chunk_size)
+                if not rows:
+                    break
+                writer.write_chunk(table_name, columns, time_column, rows)
+                last_id = rows[-1][0]
+                archived += len(rows)
+            db.session.execute(sa.text(f'DROP TABLE "{name}"'))
+            db.session.commit()
+            writer.publish()
+            logger.info("Archived and dropped partition %s", name)
+
+    last_id = 0
+    while True:
+        rows = _select_chunk(table, columns, time_column, cutoff, last_id, chunk_size)
+        if not rows:
+            break
+        writer.write_chunk(table_name, columns, time_column, rows)
+        try:
+            db.session.execute(
+                table.delete().where(table.c.id >= rows[0][0], table.c.id <= rows[-1][0],
+                                     table.c[time_column] < cutoff)
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            writer.discard()
+            raise
+        writer.publish()
+        last_id = rows[-1][0]
+        archived += len(rows)
+        logger.info("Archived %s through id %s (%s rows)", table_name, last_id, archived)
+    return archived
+
+
+def run_archive(older_than_days=ARCHIVE_AFTER_DAYS, directory=ARCHIVE_DIR, file_format='csv', chunk_size=10000):
+    """Archive every table in ARCHIVE_TABLES; returns {table: rows archived}"""
+    ensure_partitions()
+    recover_staged_files(directory)
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    writer = ArchiveWriter(directory, file_format)
+    return {name: archive_table(name, cutoff, writer, chunk_size) for name in ARCHIVE_TABLES}
+
+
+# ---------------------------------------------------------------------------
+# Reading hot and archived rows together
+# ---------------------------------------------------------------------------
+
+def _read_file(path, converters, filters):
+    """Rows of one archive file matching filters, a list of (column, op, value) with op '==', '>=' or '<'"""
+    if path.endswith('.parquet'):
+        if pyarrow is None:
+            raise RuntimeError(f"Reading {path} needs pyarrow")
+        # Pushed down to the reader, which skips row groups by their statistics; a file is one chunk at most
+        yield from pq.read_table(path, filters=filters or None).to_pylist()
+        return
+    with gzip.open(path, 'rt', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            row = {key: converters[key](value) if value != '' else None for key, value in row.items()}
+            if all(_matches(row[column], op, value) for column, op, value in filters):
+                yield row
+
+
+def _matches(actual, op, value):
+    if op == '==':
+        return actual == value
+    if actual is None:
+        return False
+    return actual >= value if op == '>=' else actual < value
+
+
+def read_archive(table_name, start=None, end=None, directory=ARCHIVE_DIR, equals=None):
+    """Archived rows of table_name with start <= time < end and the `equals` column values, streamed file by file"""
+    table, time_column = ARCHIVE_TABLES[table_name]
+    converters = _converters(table)
+    filters = [(column, '==', value) for column, value in (equals or {}).items()]
+    if start:
+        filters.append((time_column, '>=', start))
+    if end:
+        filters.append((time_column, '<', end))
+    for folder in sorted(glob.glob(os.path.join(directory, table_name, '*'))):
+        month = datetime.strptime(os.path.basename(folder), '%Y-%m')
+        if (start and next_month(month) <= start) or (end and month >= end):
+            continue
+        files = [name for name in os.listdir(folder) if FILE_NAME.match(name)]
+        for name in sorted(files, key=lambda name: int(FILE_NAME.match(name).group(1))):
+            yield from _read_file(os.path.join(folder, name), converters, filters)
+
+
+def read_hot(table_name, start=None, end=None, chunk_size=5000, equals=None):
+    """Rows still in the database, read in id-ordered chunks"""
+    table, time_column = ARCHIVE_TABLES[table_name]
+    last_id = 0
+    while True:
+        query = sa.select(table).where(table.c.id > last_id,
+                                       *[table.c[column] == value for column, value in (equals or {}).items()])
+        if start:
+            query = query.where(table.c[time_column] >= start)
+        if end:
+            query = query.where(table.c[time_column] < end)
+        rows = db.session.execute(query.order_by(table.c.id).limit(chunk_size)).mappings().all()
+        if not rows:
+            return
+        for row in rows:
+            yield dict(row)
+        last_id = rows[-1]['id']
+
+
+def read_history(table_name=PARTITIONED_TABLE, start=None, end=None, directory=ARCHIVE_DIR, **equals):
+    """
+    Archived then hot rows of table_name between start and end, e.g. for an audit of
+    everything sent to one address: read_history(start=..., email_to='a@b.com').
+    Each row carries 'source' ('archive' or 'hot'). Memory use is bounded by one file or chunk.
+    """
+    table, _ = ARCHIVE_TABLES[table_name]
+    unknown = set(equals) - set(table.c.keys())
+    if unknown:
+        raise ValueError(f"{table_name} has no column(s) {', '.join(sorted(unknown))}")
+    for source, rows in (('archive', read_archive(table_name, start, end, directory, equals)),
+                         ('hot', read_hot(table_name, start, end, equals=equals))):
+        for row in rows:
+            row['source'] = source
+            yield row
+
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Activity retention: partitions, archive and audit reads')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    partition_parser = subcommands.add_parser('partition', help='Partition emailAuto by month (Postgres, one-off)')
+    partition_parser.add_argument('--months-ahead', type=int, default=3)
+    subcommands.add_parser('ensure-partitions', help='Create upcoming monthly partitions')
+    archive_parser = subcommands.add_parser('archive', help='Move old rows to compressed files')
+    archive_parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS)
+    archive_parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    archive_parser.add_argument('--chunk-size', type=int, default=10000)
+    archive_parser.add_argument('--dir', default=ARCHIVE_DIR)
+    query_parser = subcommands.add_parser('query', help='Print hot and archived rows as CSV')
+    query_parser.add_argument('--table', choices=sorted(ARCHIVE_TABLES), default=PARTITIONED_TABLE)
+    query_parser.add_argument('--start', type=datetime.fromisoformat)
+    query_parser.add_argument('--end', type=datetime.fromisoformat)
+    query_parser.add_argument('--email-to', help='Only rows sent to this address (emailAuto)')
+    query_parser.add_argument('--dir', default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.command == 'partition':
+            partition_activity_table(args.months_ahead)
+        elif args.command == 'ensure-partitions':
+            ensure_partitions()
+        elif args.command == 'archive':
+            result = run_archive(args.older_than_days, args.dir, args.format, args.chunk_size)
+            logger.info("Archive finished: %s", result)
+        else:
+            table, _ = ARCHIVE_TABLES[args.table]
+            columns = [column.name for column in table.columns] + ['source']
+            writer = csv.writer(sys.stdout)
+            writer.writerow(columns)
+            filters = {'email_to': args.email_to} if args.email_to else {}
+            for row in read_history(args.table, args.start, args.end, args.dir, **filters):
+                writer.writerow([_serialise(row.get(column)) for column in columns])
@@ -0,0 +1,254 @@
+import logging
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, case, insert
+from models import db, EmailActivity, ActivityRollup
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+DIMENSIONS = ('status', 'sender', 'domain')
+KEY_COLUMNS = ['period', 'bucket', 'status', 'sender', 'domain']
+
+
+def bucket_start(value, period):
+    if period == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def activity_status(response_time):
+    # EmailActivity has no status column: failed sends are logged without a response time
+    return 'sent' if response_time is not None else 'failed'
+
+
+def recipient_domain(email_to):
+    return (email_to or '').rsplit('@', 1)[-1].strip().lower()[:120]
+
+
+class RollupBatch:
+    """Accumulates activity into rollup increments, one entry per bucket key"""
+
+    def __init__(self):
+        self.increments = {}
+
+    def add(self, created_at, email_from, email_to, response_time):
+        created_at = created_at or datetime.utcnow()
+        status = activity_status(response_time)
+        sender = (email_from or '')[:120]
+        domain = recipient_domain(email_to)
+        for period in PERIODS:
+            key = (period, bucket_start(created_at, period), status, sender, domain)
+            entry = self.increments.get(key)
+            if entry is None:
+                entry = self.increments[key] = {'count': 0, 'response_time_sum': 0.0,
+                                                'response_time_count': 0, 'response_time_max': None}
+            entry['count'] += 1
+            if response_time is not None:
+                entry['response_time_sum'] += response_time
+                entry['response_time_count'] += 1
+                if entry['response_time_max'] is None or response_time > entry['response_time_max']:
+                    entry['response_time_max'] = response_time
+
+    def rows(self):
+        return [dict(zip(KEY_COLUMNS, key), **values) for key, values in self.increments.items()]
+
+    def apply(self, connection):
+        """Add the increments to the rollup table on `connection` (inside the caller's transaction)"""
+        rows = self.rows()
+        if rows:
+            upsert_increments(connection, rows)
+        self.increments = {}
+        return len(rows)
+
+
+def upsert_increments(connection, rows):
+    table = ActivityRollup.__table__
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(rows)
+        excluded = stmt.excluded
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=KEY_COLUMNS,
+            set_={
+                'count': table.c.count + excluded.count,
+                'response_time_sum': table.c.response_time_sum + excluded.response_time_sum,
+                'response_time_count': table.c.response_time_count + excluded.response_time_count,
+                'response_time_max': case(
+                    (table.c.response_time_max.is_(None), excluded.response_time_max),
+                    (excluded.response_time_max > table.c.response_time_max, excluded.response_time_max),
+                    else_=table.c.response_time_max
+                ),
+            }
+        ))
+        return
+
+    # Other databases: update the existing bucket, insert it when there is none yet
+    for row in rows:
+        updated = connection.execute(
+            table.update()
+            .where(*[table.c[column] == row[column] for column in KEY_COLUMNS])
+            .values(
+                count=table.c.count + row['count'],
+                response_time_sum=table.c.response_time_sum + row['response_time_sum'],
+                response_time_count=table.c.response_time_count + row['response_time_count'],
+                response_time_max=case(
+                    (table.c.response_time_max.is_(None), row['response_time_max']),
+                    (table.c.response_time_max < row['response_time_max'], row['response_time_max']),
+                    else_=table.c.response_time_max
+                ) if row['response_time_max'] is not None else table.c.response_time_max
+            )
+        ).rowcount
+        if not updated:
+            connection.execute(insert(table).values(**row))
+
+
+@event.listens_for(EmailActivity, 'after_insert')
+def rollup_new_activity(mapper, connection, target):
+    """Keep the rollups current for every activity added through the ORM, in the same transaction"""
+    batch = RollupBatch()
+    batch.add(target.created_at, target.email_from, target.email_to, target.response_time)
+    batch.apply(connection)
+
+
+def backfill(chunk_size=50000, since=None):
+    """
+    Rebuild the rollups from EmailActivity, reading it in id order in chunks.
+    With `since`, only buckets from that day on are rebuilt. Activity logged
+    while the backfill runs is counted by the live listener as usual.
+    Returns the number of activities read.
+    """
+    since = bucket_start(since, 'day') if since else None
+    deleted = ActivityRollup.query
+    if since:
+        deleted = deleted.filter(ActivityRollup.bucket >= since)
+    deleted.delete(synchronize_session=False)
+    # Rows above this id were inserted after the delete and are already counted by the listener
+    max_id = db.session.query(func.max(EmailActivity.id)).scalar() or 0
+    db.session.commit()
+
+    columns = (EmailActivity.id, EmailActivity.created_at, EmailActivity.email_from,
+               EmailActivity.email_to, EmailActivity.response_time)
+    last_id = 0
+    read = 0
+    while last_id < max_id:
+        query = db.session.query(*columns).filter(EmailActivity.id > last_id, EmailActivity.id <= max_id)
+        if since:
+            query = query.filter(EmailActivity.created_at >= since)
+        rows = query.order_by(EmailActivity.id).limit(chunk_size).all()
+        if not rows:
+            break
+        batch = RollupBatch()
+        for _, created_at, email_from, email_to, response_time in rows:
+            batch.add(created_at, email_from, email_to, response_time)
+        batch.apply(db.session.connection())
+        db.session.commit()
+        last_id = rows[-1][0]
+        read += len(rows)
+        logger.info("Backfilled rollups through activity %s (%s rows)", last_id, read)
+    return read
+
+
+def _aggregates():
+    total = func.sum(ActivityRollup.count)
+    failed = func.sum(case((ActivityRollup.status == 'failed', ActivityRollup.count), else_=0))
+    return [
+        total.label('total'),
+        failed.label('failed'),
+        func.sum(ActivityRollup.response_time_sum).label('response_time_sum'),
+        func.sum(ActivityRollup.response_time_count).label('response_time_count'),
+        func.max(ActivityRollup.response_time_max).label('response_time_max'),
+    ]
+
+
+def _point(row):
+    total = row.total or 0
+    failed = row.failed or 0
+    return {
+        'total': total,
+        'sent': total - failed,
+        'failed': failed,
+        'failure_rate': round(failed / total, 4) if total else 0.0,
+        'avg_response_time': round(row.response_time_sum / row.response_time_count, 3) if row.response_time_count else None,
+        'max_response_time': row.response_time_max,
+    }
+
+
+def _filtered(query, period, start, end, filters):
+    query = query.filter(ActivityRollup.period == period, ActivityRollup.bucket >= start, ActivityRollup.bucket < end)
+    for dimension, value in filters.items():
+        if value is not None:
+            query = query.filter(getattr(ActivityRollup, dimension) == value)
+    return query
+
+
+def timeseries(period='hour', start=None, end=None, group_by=None, **filters):
+    """
+    Totals per bucket between start and end, read from the rollups only.
+    Without group_by, empty buckets are filled with zeros so charts get one point per bucket;
+    with group_by ('status', 'sender' or 'domain') each point also carries that dimension.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period: {period}")
+    if group_by is not None and group_by not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension: {group_by}")
+    end = end or datetime.utcnow()
+    start = bucket_start(start or end - PERIODS[period] * 24, period)
+
+    columns = [ActivityRollup.bucket] + ([getattr(ActivityRollup, group_by)] if group_by else [])
+    query = _filtered(db.session.query(*columns, *_aggregates()), period, start, end, filters)
+    rows = query.group_by(*columns).order_by(*columns).all()
+
+    if group_by:
+        return [dict(bucket=row.bucket.isoformat(), **{group_by: row[1]}, **_point(row)) for row in rows]
+
+    points = {row.bucket: _point(row) for row in rows}
+    series = []
+    bucket = start
+    while bucket < end:
+        point = points.get(bucket) or {'total': 0, 'sent': 0, 'failed': 0, 'failure_rate': 0.0,
+                                       'avg_response_time': None, 'max_response_time': None}
+        series.append(dict(bucket=bucket.isoformat(), **point))
+        bucket += PERIODS[period]
+    return series
+
+
+def breakdown(by='domain', start=None, end=None, order='total', limit=20, **filters):
+    """Top `limit` senders/domains/statuses over a window, from the daily rollups"""
+    if by not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension: {by}")
+    end = end or datetime.utcnow()
+    start = bucket_start(start or end - timedelta(days=30), 'day')
+    dimension = getattr(ActivityRollup, by)
+    aggregates = _aggregates()
+    ordering = {
+        'total': aggregates[0],
+        'failed': aggregates[1],
+        'avg_response_time': aggregates[2] / func.nullif(aggregates[3], 0),
+    }
+    if order not in ordering:
+        raise ValueError(f"Unknown order: {order}")
+    query = _filtered(db.session.query(dimension, *aggregates), 'day', start, end, filters)
+    rows = query.group_by(dimension).order_by(ordering[order].desc()).limit(limit).all()
+    return [dict(**{by: row[0]}, **_point(row)) for row in rows]
+
+
+if __name__ == '__main__':
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Activity rollup maintenance')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subcommands.add_parser('backfill', help='Rebuild rollups from raw activity')
+    backfill_parser.add_argument('--since', type=datetime.fromisoformat, default=None,
+                                 help='Only rebuild buckets from this date (YYYY-MM-DD) on')
+    backfill_parser.add_argument('--chunk-size', type=int, default=50000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        read = backfill(chunk_size=args.chunk_size, since=args.since)
+        logger.info("Backfill finished: %s activities rolled up", read)
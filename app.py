@@ -1,72 +1,119 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, Blueprint, current_app, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context
 from models import db, EmailCampaign, EmailActivity, SystemStats, EmailTemplate, ScenarioTraining
-from automated_email_system import EmailAutomation
-from scenario_analyzer import ScenarioAnalyzer
+from template_renderer import build_template_values
+from services import get_services
+from automation_runner import AutomationRunner, request_state, get_control, runner_alive
+import activity_rollup
+import data_export
+import campaign_generation
+import db_engine
+import send_scheduler
+import token_usage
+from log_pipeline import configure_logging
+from suppression import REASON_LABELS
 from config import Config
 import threading
 import os
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import sys
 import argparse
-import pandas as pd
+import json
 import tempfile
+import uuid
 from werkzeug.utils import secure_filename
 
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-app.config.from_object(Config)
-app.secret_key = app.config['FLASK_SECRET_KEY']
+# Heavy modules (pandas, openai, google.genai) are imported where they are used
+main = Blueprint('main', __name__)
 
-# Enable Flask debug mode
-app.debug = True
-
-db.init_app(app)
-
-# Global variable to store the automation thread
-automation_thread = None
-email_automation = None
-
-def run_automation():
-    global email_automation
+def create_app(config_object=Config, warm_up=None):
+    """Application factory used by WSGI servers and the helper scripts"""
+    configure_logging()
+    
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    app.secret_key = app.config['FLASK_SECRET_KEY']
+    for key, value in db_engine.engine_config(app.config.get('SQLALCHEMY_DATABASE_URI')).items():
+        app.config.setdefault(key, value)
+    # Before db.init_app: teardown functions run in reverse, so usage is written after the session closes
+    app.teardown_appcontext(token_usage.flush_on_teardown)
+    db.init_app(app)
     with app.app_context():
-        email_automation = EmailAutomation()
-        email_automation.run_automation(check_interval=300)
+        db_engine.instrument(db.engines)
+    app.register_blueprint(main)
+    
+    # Optionally build clients and compile templates before the first request
+    if warm_up is None:
+        warm_up = os.getenv('WARM_UP') == '1'
+    if warm_up:
+        get_services().warm_up(app)
+    return app
 
-@app.route('/')
+@main.route('/')
+@db_engine.replica_reads()
 def index():
     logger.debug("Accessing index route")
     try:
         stats = SystemStats.query.first()
-        logger.debug(f"Retrieved stats: {stats}")
+        logger.debug("Retrieved stats: %s", stats)
         recent_activities = EmailActivity.query.order_by(EmailActivity.created_at.desc()).limit(10).all()
-        logger.debug(f"Retrieved {len(recent_activities)} recent activities")
+        logger.debug("Retrieved %s recent activities", len(recent_activities))
         campaigns = EmailCampaign.query.order_by(EmailCampaign.created_at.desc()).limit(5).all()
-        logger.debug(f"Retrieved {len(campaigns)} campaigns")
+        logger.debug("Retrieved %s campaigns", len(campaigns))
         return render_template('index.html', stats=stats, activities=recent_activities, campaigns=campaigns)
     except Exception as e:
-        logger.error(f"Error in index route: {str(e)}")
+        logger.error("Error in index route: %s", e)
         return f"An error occurred: {str(e)}", 500
 
-@app.route('/templates')
+def parse_template_variables(text):
+    """Template variables typed into a form, one name=value (or name: value) per line"""
+    variables = {}
+    for line in text.splitlines():
+        name, separator, value = line.partition('=') if '=' in line else line.partition(':')
+        if separator and name.strip():
+            variables[name.strip()] = value.strip()
+    return variables
+
+def build_template_campaign(template, values, email, subject=None):
+    """Build a template-only campaign, returning (campaign, missing_variables)"""
+    compiled = get_services().template_catalog.get(template)
+    missing = compiled.missing_variables(values)
+    if missing:
+        return None, missing
+    campaign = EmailCampaign(
+        company_name=values.get('company_name', ''),
+        email=email,
+        subject=(subject or compiled.render_subject(values) or template.name)[:200],
+        target_person=values.get('person_name', ''),
+        industry=values.get('industry') or None,
+        context=values.get('context', ''),
+        template_id=template.id,
+        render_mode='template',
+        template_variables=values,
+        # Rendered now from the template as validated; empty enrichment slots stay as {placeholders}
+        # for the sender to fill, so editing the template later does not change this campaign
+        generated_content=compiled.render(values)
+    )
+    return campaign, []
+
+@main.route('/templates')
 def templates():
     """View all email templates"""
     try:
         templates = EmailTemplate.query.order_by(EmailTemplate.created_at.desc()).all()
         return render_template('templates.html', templates=templates)
     except Exception as e:
-        logger.error(f"Error in templates route: {str(e)}")
+        logger.error("Error in templates route: %s", e)
         return f"An error occurred: {str(e)}", 500
 
-@app.route('/add_template', methods=['GET', 'POST'])
+@main.route('/add_template', methods=['GET', 'POST'])
 def add_template():
     """Add a new email template"""
     if request.method == 'POST':
@@ -78,13 +125,13 @@ def add_template():
             )
             db.session.add(template)
             db.session.commit()
-            return redirect(url_for('templates'))
+            return redirect(url_for('main.templates'))
         except Exception as e:
-            logger.error(f"Error adding template: {str(e)}")
+            logger.error("Error adding template: %s", e)
             return f"An error occurred: {str(e)}", 500
     return render_template('add_template.html')
 
-@app.route('/edit_template/<int:template_id>', methods=['GET', 'POST'])
+@main.route('/edit_template/<int:template_id>', methods=['GET', 'POST'])
 def edit_template(template_id):
     """Edit an existing email template"""
     template = EmailTemplate.query.get_or_404(template_id)
@@ -96,26 +143,27 @@ def edit_template(template_id):
             template.template_content = request.form['template_content']
             template.updated_at = datetime.utcnow()
             db.session.commit()
-            return redirect(url_for('templates'))
+            return redirect(url_for('main.templates'))
         except Exception as e:
-            logger.error(f"Error updating template: {str(e)}")
+            logger.error("Error updating template: %s", e)
             return f"An error occurred: {str(e)}", 500
     
     return render_template('add_template.html', template=template)
 
-@app.route('/delete_template/<int:template_id>')
+@main.route('/delete_template/<int:template_id>')
 def delete_template(template_id):
     """Delete an email template"""
     try:
         template = EmailTemplate.query.get_or_404(template_id)
         db.session.delete(template)
         db.session.commit()
-        return redirect(url_for('templates'))
+        return redirect(url_for('main.templates'))
     except Exception as e:
-        logger.error(f"Error deleting template: {str(e)}")
+        logger.error("Error deleting template: %s", e)
         return f"An error occurred: {str(e)}", 500
 
-@app.route('/campaigns')
+@main.route('/campaigns')
+@db_engine.replica_reads()
 def campaigns():
     logger.debug("Accessing campaigns route")
     try:
@@ -123,52 +171,82 @@ def campaigns():
         templates = EmailTemplate.query.all()
         return render_template('campaigns.html', campaigns=campaigns, templates=templates)
     except Exception as e:
-        logger.error(f"Error in campaigns route: {str(e)}")
+        logger.error("Error in campaigns route: %s", e)
         return f"An error occurred: {str(e)}", 500
 
-@app.route('/add_campaign', methods=['GET', 'POST'])
+@main.route('/add_campaign', methods=['GET', 'POST'])
 def add_campaign():
-    logger.debug(f"Accessing add_campaign route with method {request.method}")
+    logger.debug("Accessing add_campaign route with method %s", request.method)
     if request.method == 'POST':
         try:
-            logger.debug(f"Form data received: {request.form}")
+            logger.debug("Form data received: %s", request.form)
             company_name = request.form.get('company_name', '')
             email = request.form.get('email', '')
             target_person = request.form.get('target_person', '')
             context = request.form.get('context', '')
-            email_automation = EmailAutomation()
-            ai_subject = email_automation.genai_client.models.generate_content(
-                model='models/gemini-1.5-pro',
-                contents=f"Generate a concise, professional subject line for a B2B outreach email based on this context. The subject line should be only 2 or 3 words, no more: {context}"
-            ).text.strip()
-            ai_subject = ai_subject[:200]  # Truncate to 200 characters
-            # Use AI to generate the full email body
-            ai_body = email_automation.generate_company_email(
-                company_name=company_name,
-                company_info=context,
-                target_person=target_person,
-                recipient_email=email
-            )
+            priority = send_scheduler.parse_priority(request.form.get('priority'))
+            # Checked before any rendering or AI call
+            reason = get_services().suppression_index.refresh().check(email, contacted=True)
+            if reason:
+                flash(f'Not adding a campaign for {email}: the address {REASON_LABELS[reason]}.', 'warning')
+                return redirect(url_for('main.add_campaign'))
+            if request.form.get('template_only'):
+                template = db.session.get(EmailTemplate, request.form.get('template_id', type=int) or 0)
+                if not template:
+                    flash('Select a template for a template-only campaign.', 'danger')
+                    return redirect(url_for('main.add_campaign'))
+                values = build_template_values(
+                    company_name=company_name,
+                    target_person=target_person,
+                    email=email,
+                    context=context,
+                    industry=request.form.get('industry', ''),
+                    extra=parse_template_variables(request.form.get('template_variables', ''))
+                )
+                campaign, missing = build_template_campaign(template, values, email, request.form.get('subject'))
+                if missing:
+                    flash(f'Template "{template.name}" has unfilled variables: {", ".join(missing)}', 'danger')
+                    return redirect(url_for('main.add_campaign'))
+                campaign.priority = priority
+                db.session.add(campaign)
+                db.session.commit()
+                logger.info("Added template-only campaign for %s", campaign.company_name)
+                return redirect(url_for('main.campaigns'))
+            # Subject and body are generated in the background and streamed to the campaigns page
             campaign = EmailCampaign(
                 company_name=company_name,
                 email=email,
-                subject=ai_subject,
+                subject='',
                 target_person=target_person,
                 context=context,
-                generated_content=ai_body
+                industry=request.form.get('industry') or None,
+                status='generating',
+                priority=priority
             )
-            logger.debug(f"Created campaign object: {campaign}")
             db.session.add(campaign)
             db.session.commit()
-            logger.info(f"Successfully added campaign for {campaign.company_name}")
-            return redirect(url_for('campaigns'))
+            get_services().generation_worker.submit(campaign.id)
+            logger.info("Added campaign %s for %s, generating", campaign.id, campaign.company_name)
+            return redirect(url_for('main.campaigns'))
         except Exception as e:
-            logger.error(f"Error adding campaign: {str(e)}")
+            logger.error("Error adding campaign: %s", e)
             db.session.rollback()
             return f"An error occurred: {str(e)}", 500
-    return render_template('add_campaign.html')
+    return render_template('add_campaign.html', templates=EmailTemplate.query.all())
 
-@app.route('/delete_campaign/<int:campaign_id>', methods=['POST'])
+@main.route('/campaigns/<int:campaign_id>/stream')
+def campaign_stream(campaign_id):
+    """Server-sent events with a generating campaign's subject and body as the model writes them"""
+    feed = get_services().generation_worker.feed(campaign_id)
+    # Generated by another web process (or already finished): follow the saved row instead
+    events = feed.follow() if feed else campaign_generation.follow_campaign(campaign_id)
+    return Response(
+        stream_with_context(campaign_generation.server_sent_events(events)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@main.route('/delete_campaign/<int:campaign_id>', methods=['POST'])
 def delete_campaign(campaign_id):
     """Delete an email campaign"""
     try:
@@ -176,101 +254,165 @@ def delete_campaign(campaign_id):
         db.session.delete(campaign)
         db.session.commit()
         flash('Campaign deleted successfully!', 'success')
-        return redirect(url_for('campaigns'))
+        return redirect(url_for('main.campaigns'))
     except Exception as e:
-        logger.error(f"Error deleting campaign: {str(e)}")
+        logger.error("Error deleting campaign: %s", e)
         flash(f'Error deleting campaign: {str(e)}', 'error')
         return f"An error occurred: {str(e)}", 500
 
-@app.route('/activities')
+@main.route('/activities')
+@db_engine.replica_reads()
 def activities():
     logger.debug("Accessing activities route")
     try:
         activities = EmailActivity.query.order_by(EmailActivity.created_at.desc()).all()
         return render_template('activities.html', activities=activities)
     except Exception as e:
-        logger.error(f"Error in activities route: {str(e)}")
+        logger.error("Error in activities route: %s", e)
         return f"An error occurred: {str(e)}", 500
 
-@app.route('/start')
+@main.route('/start')
 def start_automation():
+    """Ask the automation runner (automation_runner.py) to start sending"""
     logger.debug("Starting automation")
-    global automation_thread, email_automation
-    
-    # First make sure any existing automation is stopped
-    if automation_thread and automation_thread.is_alive():
-        logger.warning("Existing automation thread is still running, stopping it first")
-        if email_automation:
-            email_automation.stop_flag = True
-        automation_thread.join(timeout=5)
-    
-    # Create new automation instance and thread
-    email_automation = EmailAutomation()
-    automation_thread = threading.Thread(target=run_automation)
-    automation_thread.daemon = True
-    automation_thread.start()
-    
-    stats = SystemStats.query.first()
-    if not stats:
-        stats = SystemStats()
-        db.session.add(stats)
-    stats.status = 'running'
-    stats.last_check = datetime.utcnow()
-    db.session.commit()
-    
-    logger.info("Automation system started successfully")
-    return redirect(url_for('index'))
+    try:
+        request_state('running')
+        logger.info("Requested automation start")
+    except Exception as e:
+        logger.error("Error starting automation: %s", e)
+        db.session.rollback()
+    return redirect(url_for('main.index'))
 
-@app.route('/stop')
+@main.route('/stop')
 def stop_automation():
+    """Ask the automation runner to stop after the current email"""
     logger.debug("Stopping automation")
-    global automation_thread, email_automation
-    
     try:
-        if email_automation:
-            logger.info("Setting stop flag...")
-            email_automation.stop_flag = True
-        
-        if automation_thread and automation_thread.is_alive():
-            logger.info("Waiting for automation thread to finish...")
-            automation_thread.join(timeout=10)
-            
-            if automation_thread.is_alive():
-                logger.warning("Thread did not stop gracefully, forcing stop...")
-                # Reset the thread
-                automation_thread = None
-        
-        # Reset the automation
-        email_automation = None
-        
-        # Update database status
-        with app.app_context():
-            stats = SystemStats.query.first()
-            if stats:
-                stats.status = 'stopped'
-                stats.last_check = datetime.utcnow()
-                db.session.commit()
-                logger.info("Updated system status to stopped")
+        request_state('stopped')
+        logger.info("Requested automation stop")
     except Exception as e:
-        logger.error(f"Error stopping automation: {str(e)}")
-    
-    return redirect(url_for('index'))
+        logger.error("Error stopping automation: %s", e)
+        db.session.rollback()
+    return redirect(url_for('main.index'))
 
-@app.route('/api/stats')
+@main.route('/api/stats')
 def get_stats():
     logger.debug("Accessing API stats route")
-    stats = SystemStats.query.first()
+    with db_engine.replica_reads():
+        stats = SystemStats.query.first()
+    # Runner state comes from the primary: it must be current, and get_control() may create the row
     if stats:
+        control = get_control()
         return jsonify({
             'total_emails_processed': stats.total_emails_processed,
             'total_responses_sent': stats.total_responses_sent,
             'avg_response_time': stats.avg_response_time,
             'status': stats.status,
-            'last_check': stats.last_check.isoformat() if stats.last_check else None
+            'last_check': stats.last_check.isoformat() if stats.last_check else None,
+            'desired_state': control.desired_state,
+            'runner_alive': runner_alive(control, lease_seconds=60),
+            'runner_heartbeat': control.heartbeat_at.isoformat() if control.heartbeat_at else None
         })
     return jsonify({})
 
-@app.route('/train', methods=['GET', 'POST'])
+@main.route('/api/db_stats')
+def db_stats():
+    """Connection checkout wait, query latency and pool usage per database engine"""
+    return jsonify({'success': True, 'engines': db_engine.stats()})
+
+@main.route('/api/llm_usage')
+@db_engine.replica_reads()
+def llm_usage():
+    """LLM tokens and estimated cost (?group_by=call_site,model&since=&until=&import_job=), plus tokens per prompt section"""
+    try:
+        filters = {
+            'since': datetime.fromisoformat(request.args['since']) if request.args.get('since') else None,
+            'until': datetime.fromisoformat(request.args['until']) if request.args.get('until') else None,
+            'import_job': request.args.get('import_job'),
+            'campaign_id': request.args.get('campaign_id', type=int),
+        }
+        group_by = tuple(request.args.get('group_by', 'call_site').split(','))
+        return jsonify({
+            'success': True,
+            'totals': token_usage.totals(group_by, **filters),
+            'sections': token_usage.section_totals(**filters),
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@main.route('/api/forecast')
+def queue_forecast():
+    """When the pending campaigns will have been sent: simulated drain time, live ETA and sends per hour"""
+    # The automation runner computes and stores the forecast; the web tier only reads it
+    from drain_forecast import latest_forecast
+    latest = latest_forecast()
+    if latest is None:
+        return jsonify({'success': True, 'status': 'computing'}), 202
+    return jsonify(dict(latest, success=True, status='ready', hourly_sends=latest['hourly_sends'][:48]))
+
+def analytics_window(default_period):
+    """Period and [start, end) from ?period=&start=&end=&hours= (or &days=) query parameters"""
+    period = request.args.get('period', default_period)
+    end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow()
+    if request.args.get('start'):
+        start = datetime.fromisoformat(request.args['start'])
+    elif request.args.get('hours'):
+        start = end - timedelta(hours=int(request.args['hours']))
+    else:
+        start = end - timedelta(days=int(request.args.get('days', 1 if period == 'hour' else 30)))
+    return period, start, end
+
+@main.route('/api/analytics/timeseries')
+@db_engine.replica_reads()
+def analytics_timeseries():
+    """Sends, failures and response times per hour or day, served from the activity rollups"""
+    try:
+        period, start, end = analytics_window('hour')
+        series = activity_rollup.timeseries(
+            period, start, end,
+            group_by=request.args.get('group_by'),
+            **{dimension: request.args.get(dimension) for dimension in activity_rollup.DIMENSIONS}
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'period': period, 'series': series})
+
+@main.route('/api/analytics/breakdown')
+@db_engine.replica_reads()
+def analytics_breakdown():
+    """Top senders, domains or statuses over a window, e.g. slowest domains with ?by=domain&order=avg_response_time"""
+    try:
+        _, start, end = analytics_window('day')
+        rows = activity_rollup.breakdown(
+            by=request.args.get('by', 'domain'),
+            start=start, end=end,
+            order=request.args.get('order', 'total'),
+            limit=min(int(request.args.get('limit', 20)), 500),
+            **{dimension: request.args.get(dimension) for dimension in activity_rollup.DIMENSIONS}
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'rows': rows})
+
+@main.route('/export/<kind>.<file_format>')
+def export_data(kind, file_format):
+    """Stream campaigns or activities as CSV or Parquet, filtered by ?start=&end=&status=&company="""
+    try:
+        pieces = data_export.export(
+            kind, file_format,
+            include_content=request.args.get('include_content') == '1',
+            **data_export.parse_filters(request.args)
+        )
+    except (ValueError, RuntimeError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    filename = f"{kind}-{datetime.utcnow():%Y%m%d-%H%M%S}.{file_format}"
+    return Response(
+        stream_with_context(db_engine.on_replica(pieces)),
+        mimetype=data_export.FORMATS[file_format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@main.route('/train', methods=['GET', 'POST'])
 def train_scenario():
     """Train the AI with new scenarios"""
     if request.method == 'POST':
@@ -283,66 +425,69 @@ def train_scenario():
             }
             
             # Initialize scenario analyzer
+            from scenario_analyzer import ScenarioAnalyzer
             analyzer = ScenarioAnalyzer()
             
-            # Analyze scenario
-            analysis = analyzer.analyze_scenario(
+            # Analyze scenario, reusing a stored near-identical one when available
+            result = analyzer.analyze_with_strategy(
                 scenario_data['input_text'],
                 scenario_data['additional_context']
             )
             
-            if analysis:
-                # Generate response strategy
-                strategy = analyzer.generate_response_strategy(analysis)
+            if result:
+                analysis = result['analysis']
                 
                 # Save training data
-                training = ScenarioTraining(
-                    scenario_type=analysis['scenario_type'],
-                    input_text=scenario_data['input_text'],
-                    analysis=analysis,
-                    response_strategy=strategy,
-                    success_metrics={},  # Will be updated after email campaign
-                    learning_insights={}  # Will be updated with feedback
-                )
-                
-                db.session.add(training)
-                db.session.commit()
+                training = analyzer.save_training_data({
+                    'type': analysis.get('scenario_type') or scenario_data['scenario_type'] or 'unknown',
+                    'input': scenario_data['input_text'],
+                    'analysis': analysis,
+                    'strategy': result['strategy'],
+                    'metrics': {},  # Will be updated after email campaign
+                    'insights': {}  # Will be updated with feedback
+                })
+                if not training:
+                    flash('Error saving scenario', 'error')
+                    return render_template('train_scenario.html')
                 
                 flash('Scenario analyzed and saved successfully!', 'success')
-                return redirect(url_for('view_scenarios'))
+                return redirect(url_for('main.view_scenarios'))
             else:
                 flash('Error analyzing scenario', 'error')
                 
         except Exception as e:
-            logger.error(f"Error in scenario training: {str(e)}")
+            logger.error("Error in scenario training: %s", e)
             flash('Error processing scenario', 'error')
             
     return render_template('train_scenario.html')
 
-@app.route('/scenarios')
+@main.route('/scenarios')
+@db_engine.replica_reads()
 def view_scenarios():
     """View all training scenarios"""
     scenarios = ScenarioTraining.query.order_by(ScenarioTraining.created_at.desc()).all()
     return render_template('scenarios.html', scenarios=scenarios)
 
-@app.route('/analyze_scenario', methods=['POST'])
+@main.route('/analyze_scenario', methods=['POST'])
 def analyze_new_scenario():
     """Analyze a new scenario and return recommended approach"""
     try:
         data = request.get_json()
+        from scenario_analyzer import ScenarioAnalyzer
         analyzer = ScenarioAnalyzer()
         
-        analysis = analyzer.analyze_scenario(
+        result = analyzer.analyze_with_strategy(
             data['input_text'],
             data.get('additional_context')
         )
         
-        if analysis:
-            strategy = analyzer.generate_response_strategy(analysis)
+        if result:
             return jsonify({
                 'success': True,
-                'analysis': analysis,
-                'strategy': strategy
+                'analysis': result['analysis'],
+                'strategy': result['strategy'],
+                'reused_from': result['reused_from'],
+                'similarity': result['similarity']
             })
         else:
             return jsonify({
@@ -351,13 +496,49 @@ def analyze_new_scenario():
             }), 400
             
     except Exception as e:
-        logger.error(f"Error analyzing scenario: {str(e)}")
+        logger.error("Error analyzing scenario: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-@app.route('/upload_cab', methods=['GET', 'POST'])
+@main.route('/analyze_scenarios/batch', methods=['POST'])
+def analyze_scenario_batch():
+    """Analyze many scenarios concurrently, streaming one NDJSON line per finished item"""
+    data = request.get_json(silent=True) or {}
+    inputs = data.get('inputs')
+    if not isinstance(inputs, list) or not inputs:
+        return jsonify({
+            'success': False,
+            'error': 'inputs must be a non-empty list'
+        }), 400
+    
+    max_concurrency = data.get('max_concurrency')
+    save = data.get('save', True)
+    # Optional token budget: {"budget_usd": 2.5, "budget_action": "stop" | "downgrade"}
+    try:
+        budget = token_usage.Budget(max_cost_usd=data.get('budget_usd'), on_exceed=data.get('budget_action') or 'stop')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    job_id = f"scenarios-{uuid.uuid4().hex[:12]}"
+    
+    def generate():
+        from scenario_analyzer import ScenarioAnalyzer
+        analyzer = ScenarioAnalyzer()
+        try:
+            with token_usage.track(import_job=job_id, budget=budget):
+                for result in analyzer.analyze_batch(inputs, max_concurrency=max_concurrency, save=save):
+                    yield json.dumps(result, default=str) + '\n'
+        except Exception as e:
+            logger.error("Error in batch scenario analysis: %s", e)
+            yield json.dumps({'success': False, 'error': str(e)}) + '\n'
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # Usage of this batch: /api/llm_usage?import_job=<id>
+    response.headers['X-Import-Job'] = job_id
+    return response
+
+@main.route('/upload_cab', methods=['GET', 'POST'])
 def upload_cab():
     ALLOWED_EXTENSIONS = {'.cab', '.csv', '.xlsx', '.xls'}
     if request.method == 'POST':
@@ -367,73 +548,153 @@ def upload_cab():
             ext = os.path.splitext(filename)[1].lower()
             if ext not in ALLOWED_EXTENSIONS:
                 flash('Only .cab, .csv, .xlsx, and .xls files are allowed.', 'danger')
-                return redirect(url_for('upload_cab'))
+                return redirect(url_for('main.upload_cab'))
             # Save to a temp file for pandas
+            import pandas as pd
             with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
                 file.save(tmp.name)
                 tmp_path = tmp.name
             try:
                 # Try reading as Excel or CSV
                 if ext in ['.xlsx', '.xls']:
-                    df = pd.read_excel(tmp_path)
+                    df = pd.read_excel(tmp_path, dtype=str)
                 elif ext == '.csv' or ext == '.cab':
-                    df = pd.read_csv(tmp_path)
+                    df = pd.read_csv(tmp_path, dtype=str)
                 else:
                     flash('Unsupported file type.', 'danger')
-                    return redirect(url_for('upload_cab'))
+                    return redirect(url_for('main.upload_cab'))
                 required_cols = {'company name', 'email', 'name'}
                 df.columns = [c.strip().lower() for c in df.columns]
                 if not required_cols.issubset(set(df.columns)):
                     flash(f'File must contain columns: {required_cols}', 'danger')
-                    return redirect(url_for('upload_cab'))
-                email_automation = EmailAutomation()
+                    return redirect(url_for('main.upload_cab'))
+                template = None
+                if request.form.get('template_only'):
+                    template = db.session.get(EmailTemplate, request.form.get('template_id', type=int) or 0)
+                    if not template:
+                        flash('Select a template for a template-only import.', 'danger')
+                        return redirect(url_for('main.upload_cab'))
+                else:
+                    email_automation = get_services().email_automation
+                    from automated_email_system import load_templates
+                    templates = load_templates()
+                budget = token_usage.Budget(
+                    max_cost_usd=request.form.get('budget_usd', type=float),
+                    on_exceed=request.form.get('budget_action') or 'stop'
+                )
+                # Drop suppressed, already-contacted and repeated addresses before any AI work
+                reasons = get_services().suppression_index.refresh().screen(df['email'].fillna(''))
+                suppressed = pd.Series(reasons, index=df.index).dropna()
+                df = df.drop(suppressed.index)
                 created = 0
-                for _, row in df.iterrows():
-                    company_name = row.get('company name', '')
-                    email = row.get('email', '')
-                    target_person = row.get('name', '')
-                    context = row.get('context', '') if 'context' in row else ''
-                    # Generate subject with AI
-                    ai_subject = email_automation.genai_client.models.generate_content(
-                        model='models/gemini-1.5-pro',
-                        contents=f"Generate a concise, professional subject line for a B2B outreach email based on this context. The subject line should be only 2 or 3 words, no more: {context}"
-                    ).text.strip()[:200]
-                    # Generate body with AI
-                    ai_body = email_automation.generate_company_email(
-                        company_name=company_name,
-                        company_info=context,
-                        target_person=target_person,
-                        recipient_email=email
-                    )
-                    campaign = EmailCampaign(
-                        company_name=company_name,
-                        email=email,
-                        subject=ai_subject,
-                        target_person=target_person,
-                        context=context,
-                        generated_content=ai_body
-                    )
-                    db.session.add(campaign)
-                    created += 1
+                skipped = []
+                job_id = f"cab-{uuid.uuid4().hex[:12]}"
+                # The import is one send queue, sharing the send rate fairly with manual campaigns and other imports
+                queue = send_scheduler.import_queue(job_id)
+                priority = send_scheduler.parse_priority(request.form.get('priority'))
+                stopped = None
+                with token_usage.track(import_job=job_id, budget=budget):
+                    for index, row in df.iterrows():
+                        company_name = row.get('company name', '')
+                        email = row.get('email', '')
+                        target_person = row.get('name', '')
+                        context = row.get('context', '') if 'context' in row else ''
+                        if template:
+                            # Render locally; unfilled variables are reported now rather than at send time
+                            extra = {k: ('' if pd.isna(v) else str(v)) for k, v in row.items()}
+                            values = build_template_values(
+                                company_name=extra.get('company name', ''),
+                                target_person=extra.get('name', ''),
+                                email=extra.get('email', ''),
+                                context=extra.get('context', ''),
+                                industry=extra.get('industry', ''),
+                                extra=extra
+                            )
+                            campaign, missing = build_template_campaign(template, values, values['email'], extra.get('subject'))
+                            if missing:
+                                skipped.append(f"row {index + 2}: {', '.join(missing)}")
+                                continue
+                            campaign.queue, campaign.priority = queue, priority
+                            db.session.add(campaign)
+                            created += 1
+                            continue
+                        try:
+                            # Generate subject and body with AI
+                            ai_subject = email_automation.generate_subject(context)
+                            ai_body = email_automation.generate_company_email(
+                                company_name=company_name,
+                                company_info=context,
+                                target_person=target_person,
+                                recipient_email=email,
+                                templates=templates
+                            )
+                        except token_usage.BudgetExceeded as e:
+                            stopped = f"Stopped at row {index + 2}: {e}"
+                            break
+                        campaign = EmailCampaign(
+                            company_name=company_name,
+                            email=email,
+                            subject=ai_subject,
+                            target_person=target_person,
+                            context=context,
+                            generated_content=ai_body,
+                            queue=queue,
+                            priority=priority
+                        )
+                        db.session.add(campaign)
+                        created += 1
                 db.session.commit()
                 flash(f'Successfully created {created} campaign(s) from CAB file!', 'success')
+                usage = budget.summary()
+                if usage['calls']:
+                    flash(f"AI usage ({job_id}): {usage['calls']} calls, "
+                          f"{usage['input_tokens'] + usage['output_tokens']} tokens, about ${usage['cost_usd']:.2f}"
+                          + (f", {usage['downgraded_calls']} on the cheaper model" if usage['downgraded_calls'] else ''),
+                          'info')
+                if stopped:
+                    flash(f'Budget reached; the remaining rows were not imported. {stopped}', 'warning')
+                if skipped:
+                    flash(f'Skipped {len(skipped)} row(s) with unfilled template variables: {"; ".join(skipped[:20])}', 'warning')
+                if len(suppressed):
+                    counts = suppressed.value_counts()
+                    flash(f'Skipped {len(suppressed)} suppressed or duplicate address(es) '
+                          f'({", ".join(f"{count} {reason}" for reason, count in counts.items())})', 'warning')
             except Exception as e:
                 db.session.rollback()
                 flash(f'Error processing file: {str(e)}', 'danger')
             finally:
                 os.remove(tmp_path)
-            return redirect(url_for('upload_cab'))
+            return redirect(url_for('main.upload_cab'))
         else:
             flash('No file uploaded.', 'danger')
-    return render_template('upload_cab.html')
+    return render_template('upload_cab.html', templates=EmailTemplate.query.all())
+
+_app = None
+
+
+def __getattr__(name):
+    # `app` for the helper scripts (add_template.py, reset_db.py, ...) and `flask run`, built on first
+    # access so importing create_app (wsgi.py, automation_runner.py) does not build a second app
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
+    app = create_app()
     parser = argparse.ArgumentParser()
     parser.add_argument('--port', type=int, default=None, help='Port to run the Flask app on')
+    parser.add_argument('--debug', action='store_true', help='Enable the Flask debugger (no reloader)')
+    parser.add_argument('--with-runner', action='store_true', help='Also run the automation runner in this process (development only)')
     args = parser.parse_args()
     port = args.port or int(os.getenv('PORT', 8080))
     with app.app_context():
         db.create_all()
         logger.info("Creating database tables")
+    if args.with_runner:
+        threading.Thread(target=AutomationRunner(app).run, name='automation-runner', daemon=True).start()
     logger.info("Starting Flask application")
-    app.run(host='0.0.0.0', port=port, debug=True) 
\ No newline at end of file
+    # The reloader forks a second process and breaks under nohup; production uses wsgi.py instead
+    app.run(host='0.0.0.0', port=port, debug=args.debug, use_reloader=False) 
\ No newline at end of file
@@ -0,0 +1,453 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import logging
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from models import db, EmailCampaign, EmailActivity, SystemStats
+from services import get_services, rss_mb
+import send_journal
+import send_scheduler
+import token_usage
+from log_pipeline import log_context
+import activity_rollup  # noqa: F401  (keeps activity rollups current as activity is logged)
+
+try:
+    import aiosmtplib
+except ImportError:  # Optional: without it SMTP sessions run on a thread pool
+    aiosmtplib = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRateLimiter:
+    """
+    EmailAutomation's rate limits for asyncio: a sliding hourly cap plus random spacing between sends.
+    Waiting senders are let through in the order of their `order` keys (send_scheduler order), and
+    only urgent senders may use the last `urgent_reserve` sends of the hour.
+    """
+
+    def __init__(self, emails_per_hour, min_delay, max_delay, urgent_reserve=0):
+        self.emails_per_hour = emails_per_hour
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.urgent_reserve = min(urgent_reserve, max(emails_per_hour - 1, 0))
+        self.sent = deque()
+        self.next_send_at = 0.0
+        self.waiting = []  # heap of (order, sequence, event)
+        self.sequence = itertools.count()
+        self.head = None
+
+    def _wait(self, now, urgent):
+        while self.sent and self.sent[0] <= now - 3600:
+            self.sent.popleft()
+        wait = self.next_send_at - now
+        cap = self.emails_per_hour if urgent else self.emails_per_hour - self.urgent_reserve
+        if len(self.sent) >= cap:
+            wait = max(wait, self.sent[len(self.sent) - cap] + 3600 - now)
+        return wait
+
+    def _wake_head(self):
+        # Only the head of the queue (and a head it displaced) wakes up, however many senders wait
+        if self.head is not None:
+            self.head[2].set()
+        if self.waiting:
+            self.waiting[0][2].set()
+
+    async def acquire(self, order=(), urgent=False):
+        # The loop's clock (monotonic), so drain_forecast can run the limiter on a virtual one
+        loop = asyncio.get_running_loop()
+        ticket = (order, next(self.sequence), asyncio.Event())
+        heapq.heappush(self.waiting, ticket)
+        self._wake_head()
+        try:
+            while True:
+                wait = None
+                if self.waiting[0] is ticket:
+                    self.head = ticket
+                    wait = self._wait(loop.time(), urgent)
+                    if wait <= 0:
+                        break
+                elif self.head is ticket:
+                    self.head = None
+                ticket[2].clear()
+                try:
+                    await asyncio.wait_for(ticket[2].wait(), wait)
+                except TimeoutError:
+                    pass
+        except BaseException:
+            self.waiting.remove(ticket)
+            heapq.heapify(self.waiting)
+            if self.head is ticket:
+                self.head = None
+            self._wake_head()
+            raise
+        heapq.heappop(self.waiting)
+        self.head = None
+        now = loop.time()
+        self.sent.append(now)
+        self.next_send_at = now + random.uniform(self.min_delay, self.max_delay)
+        self._wake_head()
+
+
+class AsyncSMTPPool:
+    """Reusable aiosmtplib sessions, at most `size` open at once"""
+
+    def __init__(self, host, port, username, password, size=10, starttls=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+
+    async def _connect(self):
+        client = aiosmtplib.SMTP(
+            hostname=self.host,
+            port=self.port,
+            username=self.username or None,
+            password=self.password or None,
+            start_tls=self.starttls
+        )
+        try:
+            # Connects, then STARTTLS and login when configured
+            await client.connect()
+        except Exception:
+            client.close()
+            raise
+        return client
+
+    @asynccontextmanager
+    async def connection(self):
+        """Yield a logged-in session; it is returned to the pool unless the block raised"""
+        async with self.slots:
+            client = self.idle.pop() if self.idle else await self._connect()
+            try:
+                yield client
+            except BaseException:
+                client.close()
+                raise
+            self.idle.append(client)
+
+    async def close(self):
+        while self.idle:
+            client = self.idle.pop()
+            try:
+                await client.quit()
+            except Exception:
+                client.close()
+
+
+class AsyncOutboundEngine:
+    """
+    Asyncio alternative to EmailAutomation.run_automation.
+
+    Generation runs as concurrent async LLM calls, SMTP sessions run on
+    aiosmtplib (or a thread pool without it) and database work is offloaded
+    to a small dedicated thread pool. Setting stop_flag (as the automation
+    runner does on /stop) cancels pending generations; emails already handed
+    to SMTP are allowed to finish and be recorded.
+    """
+
+    def __init__(self, app, automation=None, generation_concurrency=None, smtp_concurrency=None, db_concurrency=None):
+        from automated_email_system import EmailAutomation
+        self.app = app
+        self.automation = automation or EmailAutomation()
+        self.generation_concurrency = generation_concurrency or int(os.getenv('ASYNC_GENERATION_CONCURRENCY', 200))
+        self.smtp_concurrency = smtp_concurrency or int(os.getenv('ASYNC_SMTP_CONCURRENCY', 10))
+        if db_concurrency is None:
+            # SQLite allows a single writer, so more threads would only contend for the lock
+            sqlite = app.config.get('SQLALCHEMY_DATABASE_URI', '').startswith('sqlite')
+            db_concurrency = 1 if sqlite else int(os.getenv('ASYNC_DB_CONCURRENCY', 4))
+        self.db_concurrency = db_concurrency
+        # Pending campaigns are loaded and run this many at a time
+        self.batch_size = int(os.getenv('ASYNC_BATCH_SIZE', 1000))
+
+        self._stop_flag = False
+        self._loop = None
+        self._main_task = None
+        self._deliveries = set()
+
+    @property
+    def stop_flag(self):
+        return self._stop_flag
+
+    @stop_flag.setter
+    def stop_flag(self, value):
+        # Called from the runner's watcher thread: cancel the event loop's work promptly
+        self._stop_flag = value
+        if value and self._loop and self._main_task and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._main_task.cancel)
+
+    def run_automation(self, check_interval=300):
+        """Blocking entry point with the same signature as EmailAutomation.run_automation"""
+        asyncio.run(self.run(check_interval))
+
+    async def run(self, check_interval=300):
+        logger.info("Starting async B2B outreach automation system...")
+        await self.start()
+        try:
+            while not self._stop_flag:
+                processed = await self.process_pending()
+                logger.info("Processed %s campaigns; RSS %.1f MB", processed, rss_mb())
+                await asyncio.sleep(min(check_interval, 300))
+        except asyncio.CancelledError:
+            logger.info("Stop requested, cancelling pending generations...")
+        finally:
+            await self.shutdown()
+            logger.info("Async email automation system stopped")
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._main_task = asyncio.current_task()
+        self.generation_slots = asyncio.Semaphore(self.generation_concurrency)
+        self.rate_limiter = AsyncRateLimiter(
+            self.automation.emails_per_hour, self.automation.min_delay, self.automation.max_delay,
+            send_scheduler.urgent_reserve()
+        )
+        self.db_executor = ThreadPoolExecutor(max_workers=self.db_concurrency, thread_name_prefix='outbound-db')
+        self.offload_executor = ThreadPoolExecutor(max_workers=self.smtp_concurrency, thread_name_prefix='outbound-io')
+        if aiosmtplib:
+            self.smtp = AsyncSMTPPool(
+                self.automation.smtp_server,
+                self.automation.smtp_port,
+                self.automation.email,
+                self.automation.password,
+                size=self.smtp_concurrency,
+                starttls=os.getenv('SMTP_STARTTLS', '1') == '1'
+            )
+        else:
+            self.smtp = None
+        if self._stop_flag:
+            self._main_task.cancel()
+
+    async def shutdown(self):
+        # Deliveries already on the wire must be recorded, or they would be sent again
+        if self._deliveries:
+            logger.info("Waiting for %s in-flight deliveries...", len(self._deliveries))
+            await asyncio.wait(self._deliveries, timeout=120)
+        if self.smtp:
+            await self.smtp.close()
+        self.db_executor.shutdown(wait=True)
+        self.offload_executor.shutdown(wait=False, cancel_futures=True)
+        self._stop_flag = True
+
+    def _in_app_context(self, fn, *args):
+        with self.app.app_context():
+            return fn(*args)
+
+    def _in_executor(self, executor, fn, *args):
+        # run_in_executor does not carry context variables (log_context fields) over to the thread
+        context = contextvars.copy_context()
+        return self._loop.run_in_executor(executor, partial(context.run, self._in_app_context, fn, *args))
+
+    async def db(self, fn, *args):
+        """Run blocking database work on the database thread pool"""
+        return await self._in_executor(self.db_executor, fn, *args)
+
+    async def offload(self, fn, *args):
+        """Run other blocking work (sync SDK calls, smtplib) off the event loop"""
+        return await self._in_executor(self.offload_executor, fn, *args)
+
+    def lookahead(self):
+        # At most an hour of sends is read ahead, so a campaign added meanwhile waits at most about that long
+        return min(self.batch_size, max(self.automation.emails_per_hour, 1))
+
+    def _load_pending(self, exclude):
+        from automated_email_system import load_pending_batch, load_templates
+        send_scheduler.backfill()
+        campaigns = load_pending_batch(self.lookahead(), exclude)
+        # Bounced and opted-out addresses never reach generation
+        index = get_services().suppression_index.refresh(recipients=False)
+        suppressed = {campaign.id for campaign in campaigns if index.check(campaign.email)}
+        if suppressed:
+            logger.info("Skipping %s suppressed campaigns", len(suppressed))
+            EmailCampaign.query.filter(EmailCampaign.id.in_(list(suppressed))).update(
+                {'status': 'suppressed'}, synchronize_session=False
+            )
+            db.session.commit()
+        return campaigns, suppressed, load_templates()
+
+    async def process_pending(self):
+        """
+        Process pending campaigns in send_scheduler order, a bounded batch at a time with the
+        batch's campaigns running concurrently; returns the number picked up
+        """
+        total = 0
+        previous = set()
+        stuck = set()
+        while not self._stop_flag:
+            campaigns, suppressed, templates = await self.db(self._load_pending, stuck)
+            if not campaigns:
+                break
+            # Campaigns of the last batch that are still pending (an error left them untouched) wait for the next pass
+            repeated = {campaign.id for campaign in campaigns} & previous
+            stuck |= repeated
+            previous = {campaign.id for campaign in campaigns}
+            campaigns = [campaign for campaign in campaigns if campaign.id not in suppressed | repeated]
+            logger.info("Processing batch of %s pending campaigns", len(campaigns))
+            total += len(campaigns)
+            if not campaigns:
+                continue
+            if not all([self.automation.email, self.automation.password, self.automation.smtp_server]):
+                logger.error("Missing email configuration. Check EMAIL_ADDRESS, EMAIL_PASSWORD, and SMTP_SERVER in .env")
+                await self.db(self._mark_failed, [campaign.id for campaign in campaigns])
+                continue
+            async with asyncio.TaskGroup() as group:
+                for campaign in campaigns:
+                    group.create_task(self.handle(campaign, templates))
+        return total
+
+    async def handle(self, campaign, templates):
+        # Each task has its own context, so the field stays on this campaign's records
+        with log_context(campaign_id=campaign.id):
+            try:
+                await self._handle(campaign, templates)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Escaping the TaskGroup would cancel the rest of the batch and end run()
+                logger.exception("Error processing campaign %s: %s", campaign.id, e)
+                try:
+                    await self.db(self._mark_failed, [campaign.id])
+                except Exception as e:
+                    logger.error("Could not mark campaign %s as failed: %s", campaign.id, e)
+
+    async def _handle(self, campaign, templates):
+        try:
+            content = await self.generate(campaign, templates)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Error generating email content for campaign %s: %s", campaign.id, e)
+            content = None
+        if not content:
+            await self.db(self._mark_failed, [campaign.id])
+            return
+
+        # Generations finish out of order; the limiter lets sends through in send order
+        await self.rate_limiter.acquire(
+            (-(campaign.priority or 0), campaign.sched_key or 0.0, campaign.id),
+            urgent=(campaign.priority or 0) >= send_scheduler.URGENT
+        )
+        delivery = asyncio.ensure_future(self.deliver(campaign, content))
+        self._deliveries.add(delivery)
+        delivery.add_done_callback(self._deliveries.discard)
+        # Cancelling this task must not abort a send that has started
+        await asyncio.shield(delivery)
+
+    async def generate(self, campaign, templates):
+        if campaign.render_mode == 'template':
+            return await self.offload(self.automation.render_campaign_content, campaign)
+        from automated_email_system import GEMINI_MODEL, stored_content
+        # The body generated when the campaign was added is what the operator saw; send that one
+        body = await self.db(stored_content, campaign)
+        if body:
+            return body
+        prompt = self.automation.outreach_prompt(
+            campaign.company_name, campaign.context, campaign.target_person,
+            contract_type=campaign.context, templates=templates
+        )
+        model = token_usage.model_for('outreach', prompt.text, GEMINI_MODEL)
+        client = self.automation.genai_client
+        cache = get_services().prompt_cache
+        # Registering a prefix is a blocking SDK call; later lookups are a dict read
+        name = await self.offload(cache.name_for, client, model, prompt)
+        cached = False
+        async with self.generation_slots:
+            start = time.monotonic()
+            response = None
+            if name:
+                try:
+                    response = await client.aio.models.generate_content(
+                        model=model, contents=prompt.suffix, config={'cached_content': name}
+                    )
+                    cached = True
+                except Exception as e:
+                    logger.warning("Call on cached prompt prefix failed, retrying with the full prompt: %s", e)
+                    cache.invalidate(client, model, prompt)
+            if response is None:
+                response = await client.aio.models.generate_content(model=model, contents=prompt.text)
+            latency = time.monotonic() - start
+        # Buffered only; written when a database call's app context ends
+        token_usage.record('outreach', model, prompt.text, response, sections=prompt.sections,
+                           cached_prefix=prompt.prefix if cached else None, latency=latency,
+                           cache_skipped=cache.skip_reason(model, prompt))
+        return response.text.strip()
+
+    def _send_pooled(self, msg, attempt):
+        with get_services().smtp_pool.connection() as server:
+            attempt['on_wire'] = True
+            server.send_message(msg)
+
+    async def deliver(self, campaign, content):
+        message_id = send_journal.message_id_for(campaign, self.automation.email)
+        if not await self.db(self._claim, campaign, message_id):
+            return
+        start_time = time.time()
+        error = None
+        # Set once a session is established: a refused connection or login never reached the server's queue
+        attempt = {'on_wire': False}
+        try:
+            msg = self.automation.build_message(campaign.email, campaign.subject, content, message_id=message_id)
+            if self.smtp:
+                async with self.smtp.connection() as client:
+                    attempt['on_wire'] = True
+                    await client.send_message(msg)
+            else:
+                await self._in_executor(self.offload_executor, self._send_pooled, msg, attempt)
+            response_time = time.time() - start_time
+            logger.info("Successfully sent email to %s at %s", campaign.email, campaign.company_name)
+        except Exception as e:
+            logger.error("Error sending email to %s: %s", campaign.email, e)
+            response_time = None
+            error = e
+        try:
+            await self.db(self._record_delivery, campaign, response_time, message_id, error, attempt['on_wire'])
+        except Exception as e:
+            # The claim is committed and the email may be out: marking the campaign 'failed' here
+            # would hide it from send_journal.recover() and invite a resend. It stays 'sending'.
+            logger.error("Could not record the outcome of %s for campaign %s, leaving it claimed for recovery: %s",
+                         message_id, campaign.id, e)
+
+    def _claim(self, campaign, message_id):
+        claimed = send_journal.claim(campaign.id, campaign.email, message_id)
+        db.session.commit()
+        return claimed
+
+    def _mark_failed(self, campaign_ids):
+        EmailCampaign.query.filter(EmailCampaign.id.in_(campaign_ids)).update(
+            {'status': 'failed'}, synchronize_session=False
+        )
+        db.session.commit()
+
+    def _record_delivery(self, campaign, response_time, message_id, error=None, on_wire=True):
+        """Journal entry, campaign status, activity and stats for one email in a single transaction"""
+        sent = response_time is not None
+        if sent:
+            send_journal.confirm(message_id)
+        else:
+            send_journal.record_failure(message_id, error, on_wire=on_wire)
+        db.session.add(EmailActivity(
+            email_from=self.automation.email,
+            email_to=campaign.email,
+            subject=campaign.subject,
+            response_time=response_time,
+            company_name=campaign.company_name
+        ))
+        if sent:
+            # Same running average as EmailAutomation.update_stats, applied atomically
+            SystemStats.query.update({
+                'total_responses_sent': SystemStats.total_responses_sent + 1,
+                'avg_response_time': db.func.coalesce((SystemStats.avg_response_time + response_time) / 2, response_time),
+                'last_check': datetime.utcnow()
+            }, synchronize_session=False)
+        db.session.commit()
@@ -1,34 +1,85 @@
 import os
 import time
 from datetime import datetime, timedelta
-import pandas as pd
-import smtplib
-import openai
-import google.genai as genai
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from imap_tools import MailBox, AND
 from dotenv import load_dotenv
 import logging
 import json
 from models import db, EmailActivity, SystemStats, EmailCampaign, EmailTemplate
+import activity_rollup  # noqa: F401  (keeps activity rollups current as activity is logged)
 import random
 import re
+from types import SimpleNamespace
 from email.mime.application import MIMEApplication
+from email.utils import make_msgid
 from sqlalchemy import exists
+from services import get_services, rss_mb
+import send_journal
+import send_scheduler
+import token_usage
+from prompt_builder import OutreachPrompt, outreach_prompt
+from template_renderer import fill_slots, unfilled_slots
+from log_pipeline import log_context
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Logging is configured by the entry point (app.py, scripts), not on import
 logger = logging.getLogger(__name__)
+# Full prompt/response dumps, sampled (log_pipeline.DEFAULT_SAMPLE_RATES) when DEBUG is on
+prompt_log = logging.getLogger(f"{__name__}.prompts")
+
+# Attachments live next to this module, so sending works from any working directory
+CAPABILITIES_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Enspyre capabilities.pdf')
+LOGO_JPG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'enspyre_logo.jpg')
 
 # Load environment variables
 load_dotenv()
 
-# Configure OpenAI (keep for now, or remove if fully switching)
-openai.api_key = os.getenv('OPENAI_API_KEY')
+GEMINI_MODEL = 'models/gemini-1.5-pro'
+SUBJECT_PROMPT = ("Generate a concise, professional subject line for a B2B outreach email based on this context. "
+                  "The subject line should be only 2 or 3 words, no more: {context}")
+
+# Columns the sender needs; generated_content and other large columns stay in the database
+PENDING_COLUMNS = (
+    EmailCampaign.id, EmailCampaign.email, EmailCampaign.subject, EmailCampaign.company_name,
+    EmailCampaign.target_person, EmailCampaign.context, EmailCampaign.template_id,
+    EmailCampaign.render_mode, EmailCampaign.template_variables, EmailCampaign.created_at,
+    EmailCampaign.priority, EmailCampaign.sched_key, EmailCampaign.content_hash, EmailCampaign.inline_content,
+)
+
+
+def load_pending_batch(limit=100, exclude=(), min_priority=None):
+    """
+    The next `limit` pending campaigns in send order (send_scheduler.SEND_ORDER), as plain objects
+    outside the session; `exclude` skips ids, `min_priority` leaves out lower priorities
+    """
+    query = db.session.query(*PENDING_COLUMNS).filter(EmailCampaign.status == 'pending')
+    if exclude:
+        query = query.filter(EmailCampaign.id.notin_(list(exclude)))
+    if min_priority is not None:
+        query = query.filter(EmailCampaign.priority >= min_priority)
+    rows = query.order_by(*send_scheduler.SEND_ORDER).limit(limit).all()
+    return [SimpleNamespace(**row._asdict()) for row in rows]
+
+
+def stored_content(campaign):
+    """The body saved with a campaign from load_pending_batch, or None"""
+    if campaign.content_hash:
+        import content_store
+        return content_store.get(campaign.content_hash)
+    return campaign.inline_content
+
+
+def load_templates():
+    """Templates as plain objects, for prompts built outside the session"""
+    return [
+        SimpleNamespace(name=t.name, description=t.description, template_content=t.template_content)
+        for t in db.session.query(EmailTemplate.name, EmailTemplate.description, EmailTemplate.template_content)
+    ]
 
-# Configure Google Generative AI
-# genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+
+def set_campaign_status(campaign_id, status):
+    EmailCampaign.query.filter_by(id=campaign_id).update({'status': status}, synchronize_session=False)
+    db.session.commit()
 
 class EmailAutomation:
     def __init__(self):
@@ -40,13 +91,13 @@ class EmailAutomation:
         self.imap_server = os.getenv('IMAP_SERVER', 'imap.gmail.com')
         
         # THIS IS THE CRITICAL DEBUGGING LINE:
-        logger.debug(f"Email address used: {self.email}")
-        logger.debug(f"Password length: {len(self.password)} if self.password else 'N/A'")
+        logger.debug("Email address used: %s", self.email)
+        logger.debug("Password length: %s", len(self.password) if self.password else 'N/A')
         if self.password:
-            logger.debug(f"Password starts with: {self.password[:5]} (DO NOT print the full password. Just check its presence and a few chars)")
+            logger.debug("Password starts with: %s (DO NOT print the full password. Just check its presence and a few chars)", self.password[:5])
         
-        # Initialize Google Generative AI Client
-        self.genai_client = genai.Client(api_key=os.getenv('GOOGLE_API_KEY'), http_options=genai.types.HttpOptions(api_version='v1'))
+        # Long-lived clients (Google Generative AI, SMTP pool, template catalog) are shared per process
+        self.services = get_services()
         
         # Rate limiting settings
         self.emails_per_hour = int(os.getenv('EMAILS_PER_HOUR', 20))  # Default 20 emails per hour
@@ -55,12 +106,8 @@ class EmailAutomation:
         
         self.stop_flag = False
         
-        # Initialize or get system stats
-        self.stats = SystemStats.query.first()
-        if not self.stats:
-            self.stats = SystemStats()
-            db.session.add(self.stats)
-            db.session.commit()
+        # Pending campaigns are read and processed this many at a time, each batch in a fresh session
+        self.batch_size = int(os.getenv('AUTOMATION_BATCH_SIZE', 100))
         
         # Track sent emails for rate limiting
         self.sent_timestamps = []
@@ -71,6 +118,14 @@ class EmailAutomation:
         self.sender_email = os.getenv('SENDER_EMAIL', 'your@email.com')
         self.website_url = os.getenv('SENDER_WEBSITE', 'https://yourcompany.com')
     
+    @property
+    def genai_client(self):
+        return self.services.genai_client
+
+    @property
+    def template_catalog(self):
+        return self.services.template_catalog
+
     def check_rate_limit(self):
         """Check if we're within rate limits"""
         now = datetime.now()
@@ -80,98 +135,237 @@ class EmailAutomation:
         
         return len(self.sent_timestamps) < self.emails_per_hour
 
-    def generate_company_email(self, company_name, company_info, target_person="", recipient_email=None, contract_type=None):
+    def build_outreach_prompt(self, company_name, company_info, target_person="", contract_type=None, templates=None):
+        """Build the template selection and outreach prompt as one string"""
+        return self.outreach_prompt(company_name, company_info, target_person, contract_type, templates).text
+
+    def outreach_prompt(self, company_name, company_info, target_person="", contract_type=None, templates=None):
+        """The outreach prompt (a prompt_builder.OutreachPrompt), shared by the threaded and async senders"""
+        # Fetch all templates from the database unless the caller already loaded them
+        if templates is None:
+            templates = EmailTemplate.query.all()
+        return outreach_prompt(company_name, company_info, target_person, contract_type, templates)
+
+    def generate_outreach(self, prompt, model):
+        """
+        generate_content for an OutreachPrompt: only the suffix when the provider holds the prefix
+        in a context cache, else the whole prompt. Returns (response, used_cache).
+        """
+        cache = self.services.prompt_cache
+        name = cache.name_for(self.genai_client, model, prompt)
+        if name:
+            try:
+                return self.genai_client.models.generate_content(
+                    model=model, contents=prompt.suffix, config={'cached_content': name}
+                ), True
+            except Exception as e:
+                logger.warning("Call on cached prompt prefix failed, retrying with the full prompt: %s", e)
+                cache.invalidate(self.genai_client, model, prompt)
+        return self.genai_client.models.generate_content(model=model, contents=prompt.text), False
+
+    def generate_company_email(self, company_name, company_info, target_person="", recipient_email=None, contract_type=None,
+                               templates=None):
         try:
             # Do NOT overwrite company_name here; use the provided value as the recipient
-            # Fetch all templates from the database
-            templates = EmailTemplate.query.all()
-            template_choices = "\n\n".join([
-                f"Template {i+1}:\nName: {t.name}\nDescription: {t.description}\nContent:\n{t.template_content}" for i, t in enumerate(templates)
-            ])
-            ai_template_prompt = f"""
-You are an expert B2B outreach email writer. You are writing an email FROM Enspyre Management Services TO {{company_name}} (recipient: {{target_person or 'the recipient'}}).
+            prompt = self.outreach_prompt(company_name, company_info, target_person, contract_type, templates)
+            prompt_log.debug("AI template selection and outreach prompt: %s", prompt.text)
+            model = token_usage.model_for('outreach', prompt.text, GEMINI_MODEL)
+            start = time.monotonic()
+            response, cached = self.generate_outreach(prompt, model)
+            token_usage.record('outreach', model, prompt.text, response, sections=prompt.sections,
+                               cached_prefix=prompt.prefix if cached else None, latency=time.monotonic() - start,
+                               cache_skipped=self.services.prompt_cache.skip_reason(model, prompt))
+            email_response = response.text.strip()
+            prompt_log.debug("AI outreach email response: %s", email_response)
+            return email_response
+        except token_usage.BudgetExceeded:
+            raise
+        except Exception as e:
+            logger.error("Error generating email content: %s", e)
+            logger.exception("Full traceback for email generation:")
+            return None
+
+    def generate_subject(self, context):
+        prompt = SUBJECT_PROMPT.format(context=context)
+        model = token_usage.model_for('subject', prompt, GEMINI_MODEL)
+        response = self.genai_client.models.generate_content(model=model, contents=prompt)
+        token_usage.record('subject', model, prompt, response)
+        return response.text.strip()[:200]
 
-Given the following contract/context, select the most appropriate template from the list below and adapt it to generate ONLY the main body of the email. Adapt the technical details and bullet points to match the context. Use HTML <ul><li>...</li></ul> for bullet points, and include only 3 to 5 concise, high-impact bullets. Always include a line at the end of the email mentioning the attached capabilities statement (e.g., 'I've attached our capabilities statement for your review.'). Do NOT include any signature, closing, sender name, title, company, logo, website, or placeholders for these. The signature will be added automatically.
+    def stream_content(self, prompt, call_site='stream'):
+        """Yield the model's text for `prompt` (a string or an OutreachPrompt) chunk by chunk, as the provider produces it"""
+        outreach = isinstance(prompt, OutreachPrompt)
+        full_text = prompt.text if outreach else prompt
+        prompt_log.debug("Streaming prompt: %s", full_text)
+        model = token_usage.model_for(call_site, full_text, GEMINI_MODEL)
+        cache = self.services.prompt_cache
+        name = cache.name_for(self.genai_client, model, prompt) if outreach else None
+        chunk = None
+        text = []
+        for attempt in (name, None) if name else (None,):
+            try:
+                if attempt:
+                    chunks = self.genai_client.models.generate_content_stream(
+                        model=model, contents=prompt.suffix, config={'cached_content': attempt}
+                    )
+                else:
+                    chunks = self.genai_client.models.generate_content_stream(model=model, contents=full_text)
+                for chunk in chunks:
+                    if chunk.text:
+                        text.append(chunk.text)
+                        yield chunk.text
+                break
+            except Exception as e:
+                # Nothing was streamed yet: the cached prefix may be gone, so retry with the full prompt
+                if attempt is None or text:
+                    raise
+                logger.warning("Call on cached prompt prefix failed, retrying with the full prompt: %s", e)
+                cache.invalidate(self.genai_client, model, prompt)
+        # The last chunk carries the usage metadata of the whole stream
+        token_usage.record(call_site, model, full_text, chunk, output_text=''.join(text),
+                           sections=prompt.sections if outreach else None,
+                           cached_prefix=prompt.prefix if attempt else None,
+                           cache_skipped=cache.skip_reason(model, prompt) if outreach else None)
 
-Templates:
-{template_choices}
+    def enrich_template_slots(self, slots, company_name, company_info, target_person=""):
+        """Fill only the designated enrichment slots (e.g. custom_research) with a single AI call"""
+        if not slots:
+            return {}
+        try:
+            enrichment_prompt = f"""
+You are writing short personalised snippets for a B2B outreach email FROM Enspyre Management Services TO {company_name} (recipient: {target_person or 'the recipient'}).
 
 Context/Contract Details:
 {company_info}
 
-Variables:
-- recipient_name: {target_person or 'the recipient'}
-- contract_type: {contract_type or '(extract from context)'}
-- company_name: {company_name}
-- sender_company: Enspyre Management Services
-
-Instructions:
-- Write as Enspyre Management Services reaching out to {company_name}.
-- Select the best template for the context.
-- Adapt the technical bullet points to match the contract/context.
-- Use HTML <ul><li>...</li></ul> for bullet points, and include only 3 to 5 concise, high-impact bullets.
-- Always include a line at the end of the email mentioning the attached capabilities statement (e.g., 'I've attached our capabilities statement for your review.').
-- Fill in all variables.
-- Keep the message concise and professional.
-- Do NOT include any signature, closing, sender name, title, company, logo, website, or placeholders for these in your output.
-- Do NOT include a subject line in your output.
+Return ONLY a JSON object with these keys, each a single concise sentence: {', '.join(sorted(slots))}
 """
-            logger.debug(f"AI template selection and outreach prompt: {ai_template_prompt}")
-            email_response = self.genai_client.models.generate_content(
-                model='models/gemini-1.5-pro',
-                contents=ai_template_prompt
-            ).text.strip()
-            logger.debug(f"AI outreach email response: {email_response}")
-            return email_response
+            model = token_usage.model_for('enrichment', enrichment_prompt, GEMINI_MODEL)
+            response = self.genai_client.models.generate_content(
+                model=model,
+                contents=enrichment_prompt
+            )
+            token_usage.record('enrichment', model, enrichment_prompt, response)
+            response = response.text.strip()
+            # Strip markdown code fences if the model adds them
+            response = re.sub(r'^```(?:json)?\s*|\s*```$', '', response)
+            values = json.loads(response)
+            return {slot: str(values.get(slot, '')).strip() for slot in slots}
+        except token_usage.BudgetExceeded:
+            raise
         except Exception as e:
-            logger.error(f"Error generating email content: {str(e)}")
-            logger.exception("Full traceback for email generation:")
+            logger.error("Error enriching template slots %s: %s", sorted(slots), e)
+            return {}
+
+    def render_campaign_content(self, campaign):
+        """
+        The body of a template-only campaign: the one rendered and validated at import, with only
+        its empty enrichment slots filled by the AI. Campaigns imported before bodies were stored
+        are rendered from the current template.
+        """
+        body = stored_content(campaign)
+        values = dict(campaign.template_variables or {})
+        if body is not None:
+            pending_slots = unfilled_slots(body)
+            if pending_slots:
+                values.update(self.enrich_template_slots(
+                    pending_slots,
+                    company_name=campaign.company_name,
+                    company_info=campaign.context,
+                    target_person=campaign.target_person
+                ))
+                body = fill_slots(body, values)
+            missing = sorted(unfilled_slots(body))
+            if missing:
+                logger.error("Campaign %s has unfilled enrichment slots: %s", campaign.id, missing)
+                return None
+            return body
+
+        template = db.session.get(EmailTemplate, campaign.template_id) if campaign.template_id else None
+        if not template:
+            logger.error("Template-only campaign %s has no template", campaign.id)
+            return None
+        compiled = self.template_catalog.get(template)
+        pending_slots = {slot for slot in compiled.enrichment_slots if not values.get(slot)}
+        if pending_slots:
+            values.update(self.enrich_template_slots(
+                pending_slots,
+                company_name=campaign.company_name,
+                company_info=campaign.context,
+                target_person=campaign.target_person
+            ))
+        missing = compiled.missing_variables(values, include_enrichment=True)
+        if missing:
+            logger.error("Campaign %s has unfilled template variables: %s", campaign.id, missing)
             return None
+        return compiled.render(values)
 
-    def send_email(self, recipient, subject, message, company_name, message_type='campaign'):
-        """Send an email with rate limiting"""
-        try:
-            # Remove any leading subject line (case-insensitive, with or without colon, and any whitespace/newlines)
-            message = re.sub(r'(?i)^\s*subject\s*:?\s*.*\n+', '', message, count=1).lstrip()
+    def build_message(self, recipient, subject, message, message_id=None):
+        """Build the outgoing MIME message with signature, logo and capabilities statement"""
+        # Remove any leading subject line (case-insensitive, with or without colon, and any whitespace/newlines)
+        message = re.sub(r'(?i)^\s*subject\s*:?\s*.*\n+', '', message, count=1).lstrip()
+
+        # Convert the message to HTML and add the signature with the logo
+        html_signature = f'<br><br><span style="color:#000000;">Best regards,<br>Victor Gandara<br>AI Automation Intern<br>{self.phone_number}<br><a href="mailto:{self.sender_email}" style="color:#000000;">{self.sender_email}</a></span><br><img src="cid:enspyrelogo" style="max-width:300px;"><br><a href="https://www.enspyremanagementservices.com" style="color:#000000;">www.enspyremanagementservices.com</a>'
+        html_message = message.replace('\n', '<br>') + html_signature
+
+        msg = MIMEMultipart()
+        msg['From'] = self.email
+        msg['To'] = recipient
+        msg['Subject'] = subject
+        # Replies and bounces quote this id, which is how inbox_ingest.py finds the campaign
+        msg['Message-ID'] = message_id or self.new_message_id()
+        msg.attach(MIMEText(html_message, 'html'))
+
+        # Attach enspyre capabilities.pdf to every email (file contents are cached per process)
+        attachment = MIMEApplication(self.services.attachment(CAPABILITIES_PDF), _subtype='pdf')
+        attachment.add_header('Content-Disposition', 'attachment', filename='enspyre capabilities.pdf')
+        msg.attach(attachment)
 
+        # Attach the JPEG logo inline
+        from email.mime.image import MIMEImage
+        logo = MIMEImage(self.services.attachment(LOGO_JPG))
+        logo.add_header('Content-ID', '<enspyrelogo>')
+        logo.add_header('Content-Disposition', 'inline', filename='enspyre_logo.jpg')
+        msg.attach(logo)
+        return msg
+
+    def new_message_id(self):
+        return make_msgid(domain=(self.email or 'localhost').rsplit('@', 1)[-1])
+
+    def send_email(self, recipient, subject, message, company_name, message_type='campaign', message_id=None,
+                   campaign_id=None):
+        """
+        Send an email with rate limiting. With campaign_id the send goes through the journal:
+        claimed before SMTP, and the campaign status is settled as soon as the server answers.
+        """
+        on_wire = False
+        try:
             if not self.check_rate_limit():
                 logger.warning("Rate limit reached, skipping send")
                 return False
             
-            # Convert the message to HTML and add the signature with the logo
-            html_signature = f'<br><br><span style="color:#000000;">Best regards,<br>Victor Gandara<br>AI Automation Intern<br>{self.phone_number}<br><a href="mailto:{self.sender_email}" style="color:#000000;">{self.sender_email}</a></span><br><img src="cid:enspyrelogo" style="max-width:300px;"><br><a href="https://www.enspyremanagementservices.com" style="color:#000000;">www.enspyremanagementservices.com</a>'
-            html_message = message.replace('\n', '<br>') + html_signature
-
-            msg = MIMEMultipart()
-            msg['From'] = self.email
-            msg['To'] = recipient
-            msg['Subject'] = subject
-            msg.attach(MIMEText(html_message, 'html'))
-
-            # Attach enspyre capabilities.pdf to every email
-            with open('enspyre capabilities.pdf', 'rb') as f:
-                attachment = MIMEApplication(f.read(), _subtype='pdf')
-                attachment.add_header('Content-Disposition', 'attachment', filename='enspyre capabilities.pdf')
-                msg.attach(attachment)
-
-            # Attach the JPEG logo inline
-            from email.mime.image import MIMEImage
-            with open('enspyre_logo.jpg', 'rb') as img:
-                logo = MIMEImage(img.read())
-                logo.add_header('Content-ID', '<enspyrelogo>')
-                logo.add_header('Content-Disposition', 'inline', filename='enspyre_logo.jpg')
-                msg.attach(logo)
+            if campaign_id is not None:
+                claimed = send_journal.claim(campaign_id, recipient, message_id)
+                db.session.commit()
+                if not claimed:
+                    return False
+            
+            msg = self.build_message(recipient, subject, message, message_id=message_id)
             
             start_time = time.time()
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.email, self.password)
+            # Reuse a logged-in session from the pool instead of connecting for every email
+            with self.services.smtp_pool.connection() as server:
+                on_wire = True
                 server.send_message(msg)
             
             response_time = time.time() - start_time
+            if campaign_id is not None:
+                send_journal.confirm(message_id)
+                db.session.commit()
             self.sent_timestamps.append(datetime.now())
             
-            logger.info(f"Successfully sent email to {recipient} at {company_name}")
+            logger.info("Successfully sent email to %s at %s", recipient, company_name)
             
             # Log activity and update stats
             self.log_activity(
@@ -185,12 +379,16 @@ Instructions:
             
             # Random delay between emails
             delay = random.randint(self.min_delay, self.max_delay)
-            logger.info(f"Waiting {delay} seconds before next email...")
+            logger.info("Waiting %s seconds before next email...", delay)
             time.sleep(delay)
             
             return True
         except Exception as e:
-            logger.error(f"Error sending email to {recipient}: {str(e)}")
+            logger.error("Error sending email to %s: %s", recipient, e)
+            if campaign_id is not None:
+                db.session.rollback()
+                send_journal.record_failure(message_id, e, on_wire=on_wire)
+                db.session.commit()
             self.log_activity(
                 email_from=self.email,
                 email_to=recipient,
@@ -211,95 +409,146 @@ Instructions:
             )
             db.session.add(activity)
             db.session.commit()
-            logger.debug(f"Logged activity: to {company_name} ({email_to})")
+            logger.debug("Logged activity: to %s (%s)", company_name, email_to)
         except Exception as e:
-            logger.error(f"Error logging activity: {str(e)}")
+            logger.error("Error logging activity: %s", e)
 
     def update_stats(self, emails_processed=0, responses_sent=0, response_time=None):
-        """Update system statistics"""
+        """Update system statistics in the database (no stats object is kept in the session)"""
         try:
-            self.stats.total_emails_processed += emails_processed
-            self.stats.total_responses_sent += responses_sent
-            
+            now = datetime.utcnow()
+            values = {
+                'total_emails_processed': db.func.coalesce(SystemStats.total_emails_processed, 0) + emails_processed,
+                'total_responses_sent': db.func.coalesce(SystemStats.total_responses_sent, 0) + responses_sent,
+                'last_check': now,
+            }
             if response_time:
-                if self.stats.avg_response_time:
-                    self.stats.avg_response_time = (self.stats.avg_response_time + response_time) / 2
-                else:
-                    self.stats.avg_response_time = response_time
-            
-            self.stats.last_check = datetime.utcnow()
+                values['avg_response_time'] = db.func.coalesce((SystemStats.avg_response_time + response_time) / 2, response_time)
+            if not SystemStats.query.update(values, synchronize_session=False):
+                db.session.add(SystemStats(total_emails_processed=emails_processed, total_responses_sent=responses_sent,
+                                           avg_response_time=response_time, last_check=now))
             db.session.commit()
-            logger.debug(f"Updated stats: processed={emails_processed}, responses={responses_sent}")
+            logger.debug("Updated stats: processed=%s, responses=%s", emails_processed, responses_sent)
         except Exception as e:
-            logger.error(f"Error updating stats: {str(e)}")
+            db.session.rollback()
+            logger.error("Error updating stats: %s", e)
 
     def process_campaigns(self):
-        """Process email campaigns with rate limiting"""
+        """
+        Send pending campaigns one at a time in send_scheduler order; returns the number processed.
+        The next campaign is looked up (one index seek) before each send, so a campaign added
+        meanwhile with a higher priority or a fairer tag goes next. The session is closed every
+        batch_size campaigns, so nothing loaded or logged accumulates.
+        """
+        processed = 0
+        templates = None
+        previous_id = None
+        stuck = set()
         try:
-            # Get pending campaigns
-            campaigns = EmailCampaign.query.filter_by(status='pending').all()
-            logger.info(f"Found {len(campaigns)} pending campaigns")
-            
-            for campaign in campaigns:
-                if self.stop_flag:
-                    logger.info("Stopping campaign processing due to stop flag")
-                    return
-                
+            send_scheduler.backfill()
+            while not self.stop_flag:
                 if not self.check_rate_limit():
                     logger.warning("Rate limit reached, pausing campaign processing")
-                    return
-                
-                logger.info(f"Processing campaign for: {campaign.email} at {campaign.company_name}")
-                logger.debug(f"Campaign details: template_id={campaign.template_id}, subject={campaign.subject}")
-                
-                # Verify email configuration
-                if not all([self.email, self.password, self.smtp_server]):
-                    logger.error("Missing email configuration. Check EMAIL_ADDRESS, EMAIL_PASSWORD, and SMTP_SERVER in .env")
-                    campaign.status = 'failed'
-                    db.session.commit()
+                    return processed
+                min_priority = send_scheduler.min_priority_for(self.emails_per_hour - len(self.sent_timestamps))
+                campaigns = load_pending_batch(1, stuck, min_priority)
+                if not campaigns:
+                    if min_priority is not None:
+                        logger.info("Rest of this hour's send budget is reserved for urgent campaigns")
+                    break
+                campaign = campaigns[0]
+                if campaign.id == previous_id:
+                    # Still pending after being processed (e.g. an error left it untouched): skip it this pass
+                    stuck.add(campaign.id)
                     continue
-                
-                # Verify OpenAI configuration (or Google AI configuration)
-                if not (openai.api_key or os.getenv('GOOGLE_API_KEY')):
-                    logger.error("Missing AI API key. Check OPENAI_API_KEY or GOOGLE_API_KEY in .env")
-                    campaign.status = 'failed'
-                    db.session.commit()
-                    continue
-                
-                # Generate AI content
-                logger.info("Generating email content with AI...")
-                email_content = self.generate_company_email(
-                    company_name=campaign.company_name,
-                    company_info=campaign.context,
-                    target_person=campaign.target_person,
-                    recipient_email=campaign.email,
-                    contract_type=campaign.context  # Let AI infer contract type from context
-                )
-                
-                if email_content:
-                    logger.info("Successfully generated email content, attempting to send...")
-                    if self.send_email(
-                        recipient=campaign.email,
-                        subject=campaign.subject,
-                        message=email_content,
-                        company_name=campaign.company_name,
-                        message_type='campaign'
-                    ):
-                        campaign.status = 'sent'
-                        campaign.sent_at = datetime.utcnow()
-                        logger.info(f"Successfully sent email to {campaign.email}")
-                    else:
-                        campaign.status = 'failed'
-                        logger.error(f"Failed to send email to {campaign.email}")
-                    db.session.commit()
-                else:
-                    logger.error("Failed to generate email content")
-                    campaign.status = 'failed'
-                    db.session.commit()
-                    
+                previous_id = campaign.id
+                if templates is None:
+                    # Templates and new suppressions (e.g. fresh bounces) are read once per batch
+                    templates = load_templates()
+                    self.services.suppression_index.refresh(recipients=False)
+                with log_context(campaign_id=campaign.id):
+                    self.process_campaign(campaign, templates)
+                processed += 1
+                if processed % self.batch_size == 0:
+                    # A fresh session per batch: closing it expunges everything the batch loaded or added
+                    db.session.remove()
+                    token_usage.flush()
+                    templates = None
+            if self.stop_flag:
+                logger.info("Stopping campaign processing due to stop flag")
         except Exception as e:
-            logger.error(f"Error processing campaigns: {str(e)}")
+            logger.error("Error processing campaigns: %s", e)
             logger.exception("Full traceback:")
+        finally:
+            db.session.remove()
+            token_usage.flush()
+        return processed
+
+    def process_campaign(self, campaign, templates=None):
+        """Generate and send one pending campaign (a row from load_pending_batch)"""
+        logger.info("Processing campaign for: %s at %s", campaign.email, campaign.company_name)
+        logger.debug("Campaign details: template_id=%s, subject=%s", campaign.template_id, campaign.subject)
+        
+        # Bounced and opted-out addresses are skipped before any AI work
+        reason = self.services.suppression_index.check(campaign.email)
+        if reason:
+            logger.info("Skipping %s: suppressed (%s)", campaign.email, reason)
+            set_campaign_status(campaign.id, 'suppressed')
+            return
+        
+        # Verify email configuration
+        if not all([self.email, self.password, self.smtp_server]):
+            logger.error("Missing email configuration. Check EMAIL_ADDRESS, EMAIL_PASSWORD, and SMTP_SERVER in .env")
+            set_campaign_status(campaign.id, 'failed')
+            return
+        
+        # A body generated when the campaign was added (and shown to the operator) is sent as is
+        stored_body = stored_content(campaign) if campaign.render_mode != 'template' else None
+        
+        # Verify OpenAI configuration (or Google AI configuration); template-only campaigns may not need it
+        if (campaign.render_mode != 'template' and not stored_body
+                and not (os.getenv('OPENAI_API_KEY') or os.getenv('GOOGLE_API_KEY'))):
+            logger.error("Missing AI API key. Check OPENAI_API_KEY or GOOGLE_API_KEY in .env")
+            set_campaign_status(campaign.id, 'failed')
+            return
+        
+        if campaign.render_mode == 'template':
+            # Render locally from the stored template variables
+            logger.info("Rendering template-only campaign locally...")
+            email_content = self.render_campaign_content(campaign)
+        elif stored_body:
+            logger.info("Using the email content generated when the campaign was added")
+            email_content = stored_body
+        else:
+            # Generate AI content
+            logger.info("Generating email content with AI...")
+            email_content = self.generate_company_email(
+                company_name=campaign.company_name,
+                company_info=campaign.context,
+                target_person=campaign.target_person,
+                recipient_email=campaign.email,
+                contract_type=campaign.context,  # Let AI infer contract type from context
+                templates=templates
+            )
+        
+        if email_content:
+            logger.info("Successfully generated email content, attempting to send...")
+            # The journal moves the campaign to 'sending' before SMTP and settles it right after
+            if self.send_email(
+                recipient=campaign.email,
+                subject=campaign.subject,
+                message=email_content,
+                company_name=campaign.company_name,
+                message_type='campaign',
+                message_id=send_journal.message_id_for(campaign, self.email),
+                campaign_id=campaign.id
+            ):
+                logger.info("Successfully sent email to %s", campaign.email)
+            else:
+                logger.error("Failed to send email to %s", campaign.email)
+        else:
+            logger.error("Failed to generate email content")
+            set_campaign_status(campaign.id, 'failed')
 
     def run_automation(self, check_interval=300):
         """Run the email automation system with focus on campaigns"""
@@ -309,7 +558,8 @@ Instructions:
             while not self.stop_flag:
                 # Process campaigns with rate limiting
                 logger.info("Processing email campaigns...")
-                self.process_campaigns()
+                processed = self.process_campaigns()
+                logger.info("Processed %s campaigns; RSS %.1f MB", processed, rss_mb())
                 
                 # Check stop flag every second for more responsive stopping
                 for _ in range(min(check_interval, 300)):  # Max 5 minutes between checks
@@ -319,12 +569,12 @@ Instructions:
                     time.sleep(1)
                 
         except Exception as e:
-            logger.error(f"Error in automation loop: {str(e)}")
+            logger.error("Error in automation loop: %s", e)
         finally:
             logger.info("Email automation system stopped")
             self.stop_flag = True
 
 if __name__ == "__main__":
-    automation = EmailAutomation()
-    # You can provide a CSV file for outgoing emails
-    automation.run_automation(csv_file="emails.csv") 
\ No newline at end of file
+    # The sender runs under the automation runner, which handles app context and start/stop requests
+    from automation_runner import main
+    main()
@@ -0,0 +1,205 @@
+import os
+import uuid
+import signal
+import socket
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from models import db, AutomationControl, SystemStats
+import send_journal
+
+logger = logging.getLogger(__name__)
+
+CONTROL_ID = 1
+
+
+def get_control():
+    """The single control row, created on first use"""
+    control = db.session.get(AutomationControl, CONTROL_ID)
+    if control:
+        return control
+    try:
+        control = AutomationControl(id=CONTROL_ID, desired_state='stopped')
+        db.session.add(control)
+        db.session.commit()
+    except IntegrityError:
+        # Another process created it first
+        db.session.rollback()
+        control = db.session.get(AutomationControl, CONTROL_ID)
+    return control
+
+
+def request_state(desired_state):
+    """Ask the runner to start or stop; called by the /start and /stop routes"""
+    control = get_control()
+    control.desired_state = desired_state
+    control.requested_at = datetime.utcnow()
+
+    stats = SystemStats.query.first()
+    if not stats:
+        stats = SystemStats()
+        db.session.add(stats)
+    stats.status = 'starting' if desired_state == 'running' else 'stopping'
+    stats.last_check = datetime.utcnow()
+    db.session.commit()
+    return control
+
+
+def runner_alive(control, lease_seconds):
+    return bool(control.runner_id and control.heartbeat_at
+                and control.heartbeat_at > datetime.utcnow() - timedelta(seconds=lease_seconds))
+
+
+class AutomationRunner:
+    """
+    Owns EmailAutomation.run_automation in its own process (or, for local
+    development, a thread of the web process). Only the runner holding the
+    lease in AutomationControl sends, so several runners can be deployed
+    for failover without sending twice.
+    """
+
+    def __init__(self, app, check_interval=300, poll_interval=5, lease_seconds=60, engine=None):
+        self.app = app
+        self.engine = engine or os.getenv('AUTOMATION_ENGINE', 'threaded')
+        self.check_interval = check_interval
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.runner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.shutdown = threading.Event()
+        self.automation = None
+        self.holds_lease = False
+
+    def claim_lease(self):
+        """Take or renew the runner lease; returns True while this runner holds it"""
+        now = datetime.utcnow()
+        claimed = AutomationControl.query.filter(
+            AutomationControl.id == CONTROL_ID,
+            or_(
+                AutomationControl.runner_id.is_(None),
+                AutomationControl.runner_id == self.runner_id,
+                AutomationControl.heartbeat_at < now - timedelta(seconds=self.lease_seconds)
+            )
+        ).update({'runner_id': self.runner_id, 'heartbeat_at': now}, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def release_lease(self):
+        AutomationControl.query.filter_by(id=CONTROL_ID, runner_id=self.runner_id).update(
+            {'runner_id': None, 'heartbeat_at': None}, synchronize_session=False
+        )
+        db.session.commit()
+
+    def desired_state(self):
+        return db.session.query(AutomationControl.desired_state).filter_by(id=CONTROL_ID).scalar()
+
+    def set_status(self, status):
+        stats = SystemStats.query.first()
+        if not stats:
+            stats = SystemStats()
+            db.session.add(stats)
+        stats.status = status
+        stats.last_check = datetime.utcnow()
+        db.session.commit()
+
+    def watch(self):
+        """Renew the lease and turn a stop request into the automation's stop flag"""
+        with self.app.app_context():
+            while not self.shutdown.wait(self.poll_interval):
+                try:
+                    held = self.holds_lease = self.claim_lease()
+                    automation = self.automation
+                    if automation and (not held or self.desired_state() != 'running'):
+                        logger.info("Stop requested, setting stop flag...")
+                        automation.stop_flag = True
+                except Exception as e:
+                    logger.error("Error in runner watcher: %s", e)
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def forecast(self):
+        """Keep the dashboard's drain forecast current, once across runners: only the lease holder computes it"""
+        from drain_forecast import DrainForecaster
+        forecaster = DrainForecaster(self.app)
+        while not self.shutdown.wait(self.poll_interval):
+            if self.holds_lease:
+                forecaster.refresh_if_stale()
+
+    def build_automation(self):
+        """The sender for the configured engine: 'threaded' (EmailAutomation) or 'async'"""
+        if self.engine == 'async':
+            from async_outbound import AsyncOutboundEngine
+            return AsyncOutboundEngine(self.app)
+        from automated_email_system import EmailAutomation
+        return EmailAutomation()
+
+    def run(self):
+        """Wait for a start request, run the automation until stopped, repeat"""
+        watcher = threading.Thread(target=self.watch, name='automation-watcher', daemon=True)
+        watcher.start()
+        threading.Thread(target=self.forecast, name='drain-forecast', daemon=True).start()
+        logger.info("Automation runner %s started", self.runner_id)
+
+        with self.app.app_context():
+            get_control()
+            try:
+                while not self.shutdown.is_set():
+                    try:
+                        if self.desired_state() == 'running' and self.claim_lease():
+                            self.set_status('running')
+                            # Settle sends a previous runner left in doubt before anything new goes out
+                            send_journal.recover()
+                            self.automation = self.build_automation()
+                            self.automation.run_automation(check_interval=self.check_interval)
+                            self.automation = None
+                            self.set_status('stopped')
+                        elif self.desired_state() != 'running':
+                            # Acknowledge stop requests even when nothing was running
+                            stats = SystemStats.query.first()
+                            if stats and stats.status in ('stopping', 'running'):
+                                self.set_status('stopped')
+                    except Exception as e:
+                        logger.error("Error in automation runner: %s", e)
+                        db.session.rollback()
+                    finally:
+                        db.session.remove()
+                    self.shutdown.wait(self.poll_interval)
+            finally:
+                self.release_lease()
+                logger.info("Automation runner %s exited", self.runner_id)
+
+    def stop(self):
+        self.shutdown.set()
+        if self.automation:
+            self.automation.stop_flag = True
+
+
+def main():
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description='Run the email automation sender as its own process')
+    parser.add_argument('--check-interval', type=int, default=300, help='Seconds between campaign checks')
+    parser.add_argument('--poll-interval', type=int, default=5, help='Seconds between control record polls')
+    parser.add_argument('--start', action='store_true', help='Request the running state on startup')
+    parser.add_argument('--engine', choices=['threaded', 'async'], default=None,
+                        help='Sender implementation (default: AUTOMATION_ENGINE or threaded)')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        if args.start:
+            request_state('running')
+
+    runner = AutomationRunner(app, check_interval=args.check_interval, poll_interval=args.poll_interval,
+                              engine=args.engine)
+    signal.signal(signal.SIGTERM, lambda *_: runner.stop())
+    signal.signal(signal.SIGINT, lambda *_: runner.stop())
+    runner.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark moving campaign bodies into the content store.
+
+Fills a throwaway SQLite database with campaigns whose bodies are filled-in
+HTML templates: personalised greeting and company lines around shared
+boilerplate, plus a share of exact duplicates (--duplicate-share, e.g.
+template-only campaigns). Then times content_store.migrate() and VACUUM,
+and reports the database file size before and after, the compression
+ratio and the blob count. It also times a campaigns page load (every
+column the page reads) before and after.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_content_store [--campaigns 20000] [--body-size 6000] [--duplicate-share 0.3] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+PARAGRAPHS = [
+    "<p>We help companies in {industry} move their workloads to the cloud without downtime.</p>",
+    "<p>Our team has delivered more than 200 migrations for mid-sized firms across Europe.</p>",
+    "<p>Most clients cut their infrastructure costs by a third within the first year.</p>",
+    "<p>We handle assessment, planning, migration and the first months of operations.</p>",
+    "<p>Security reviews and compliance documentation are part of every engagement.</p>",
+]
+
+
+def body(i, size, rng):
+    industry = rng.choice(['logistics', 'retail', 'healthcare', 'finance'])
+    parts = [f"<p>Dear Person {i},</p>", f"<p>I noticed Company {i} has been expanding its {industry} operations.</p>"]
+    while sum(map(len, parts)) < size:
+        parts.append(rng.choice(PARAGRAPHS).format(industry=industry))
+    parts.append("<p>Best regards,<br>The Enspyre team</p>")
+    return ''.join(parts)
+
+
+def page_load(db, EmailCampaign):
+    start = time.perf_counter()
+    db.session.expunge_all()
+    EmailCampaign.query.order_by(EmailCampaign.created_at.desc()).all()
+    return round(time.perf_counter() - start, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--campaigns', type=int, default=20000)
+    parser.add_argument('--body-size', type=int, default=6000)
+    parser.add_argument('--duplicate-share', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as path:
+        database = os.path.join(path, 'content.db')
+        os.environ.setdefault('SMTP_PORT', '587')
+        os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+        os.environ['LOG_LEVEL'] = 'WARNING'
+        os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{database}"
+        from app import create_app
+        from models import db, EmailCampaign
+        import content_store
+
+        app = create_app()
+        report = {'campaigns': args.campaigns, 'body_size': args.body_size, 'duplicate_share': args.duplicate_share}
+        with app.app_context():
+            db.create_all()
+            shared = body('there', args.body_size, rng)
+            for start in range(0, args.campaigns, 5000):
+                db.session.execute(db.insert(EmailCampaign), [
+                    {'email': f"contact{i}@company{i}.example", 'subject': f"Partnership {i}",
+                     'company_name': f"Company {i}", 'status': 'sent',
+                     'inline_content': shared if rng.random() < args.duplicate_share else body(i, args.body_size, rng)}
+                    for i in range(start, min(start + 5000, args.campaigns))
+                ])
+                db.session.commit()
+            db.session.execute(db.text('VACUUM'))
+            report['database_mb_before'] = round(os.path.getsize(database) / 1024 / 1024, 1)
+            report['page_load_seconds_before'] = page_load(db, EmailCampaign)
+
+            start = time.perf_counter()
+            content_store.migrate()
+            report['migrate_seconds'] = round(time.perf_counter() - start, 2)
+            start = time.perf_counter()
+            db.session.execute(db.text('VACUUM'))
+            report['vacuum_seconds'] = round(time.perf_counter() - start, 2)
+            report['database_mb_after'] = round(os.path.getsize(database) / 1024 / 1024, 1)
+            report['page_load_seconds_after'] = page_load(db, EmailCampaign)
+            report.update(content_store.stats())
+            report['codec'] = content_store.default_codec()
+
+            sample = db.session.get(EmailCampaign, 1)
+            assert sample.generated_content and sample.generated_content.startswith('<p>Dear Person')
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
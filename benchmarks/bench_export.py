@@ -0,0 +1,76 @@
+"""
+Benchmark streaming exports: rows per second and peak memory.
+
+Fills a throwaway SQLite database with benchmarks.datagen, then consumes the
+CSV (and Parquet, with pyarrow) export generators. Throughput is timed
+without tracing; peak Python memory comes from a second, traced pass, and
+should stay flat as --rows grows.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_export [--rows 500000] [--json]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+
+def consume(pieces):
+    size = 0
+    for piece in pieces:
+        size += len(piece)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--kind', default='activities')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        os.environ.setdefault('SMTP_PORT', '587')
+        os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+        os.environ['LOG_LEVEL'] = 'WARNING'
+        os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(path, 'export.db')}"
+        from app import create_app
+        from models import db
+        import data_export
+        from benchmarks.datagen import generate
+
+        app = create_app()
+        report = {'rows': args.rows, 'kind': args.kind, 'formats': {}}
+        with app.app_context():
+            db.create_all()
+            generate(campaigns=args.rows if args.kind == 'campaigns' else 100,
+                     activities=args.rows if args.kind == 'activities' else 100, scenarios=0)
+            formats = ['csv'] + (['parquet'] if data_export.pyarrow else [])
+            for file_format in formats:
+                start = time.perf_counter()
+                size = consume(data_export.export(args.kind, file_format))
+                seconds = time.perf_counter() - start
+
+                tracemalloc.start()
+                consume(data_export.export(args.kind, file_format))
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                report['formats'][file_format] = {
+                    'seconds': round(seconds, 3),
+                    'rows_per_second': round(args.rows / seconds),
+                    'output_mb': round(size / 1024 / 1024, 1),
+                    'peak_memory_mb': round(peak / 1024 / 1024, 2),
+                }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for file_format, result in report['formats'].items():
+            print(f"{file_format}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark the queue drain forecast: how close it comes to a real drain, and what it costs.
+
+Accuracy: for each engine, a warm-up drain of --warmup campaigns through the
+real sender (fake Gemini client, local SMTP sink, throwaway SQLite database)
+leaves the latencies drain_forecast calibrates from. Then --campaigns
+campaigns are seeded, forecast, and drained for real, and the forecast drain
+time is compared with the measured one. The 'unthrottled' scenario runs
+without rate limits, so the drain is bound by the sender itself; the
+forecast leaves out per-campaign database work, which shows here. The
+'throttled' scenario puts --delay seconds between sends (MIN_DELAY_SECONDS =
+MAX_DELAY_SECONDS), the regime production runs in. A real hourly cap would
+take hours to check, but it runs on the virtual clock unchanged.
+
+Scale: wall time to forecast --scale-rows pending campaigns at production
+defaults (EMAILS_PER_HOUR=20, 60-180 s between sends).
+
+Usage (from the repository root):
+    python -m benchmarks.bench_forecast [--campaigns 200] [--throttled-campaigns 30] [--scale-rows 100000] [--json]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.bench_pipeline import RUNNERS
+from benchmarks.fakes import FakeGenAIClient, SMTPSink
+from benchmarks.harness import StageTimer, configure_env, seed_campaigns
+
+
+def accuracy(app, engine, campaigns, delay, args):
+    import drain_forecast
+    from models import EmailCampaign
+    from services import get_services
+
+    os.environ['MIN_DELAY_SECONDS'] = os.environ['MAX_DELAY_SECONDS'] = str(delay)
+    get_services().override(genai_client=FakeGenAIClient(args.latency, args.jitter, seed=args.seed))
+    with app.app_context():
+        seed_campaigns(args.warmup)
+    RUNNERS[engine](app, StageTimer())
+    with app.app_context():
+        seed_campaigns(campaigns)
+        # Each drain below starts a fresh sender whose rate limiter has seen no sends
+        forecast = drain_forecast.simulate(app, engine=engine, runs=args.runs, seed=args.seed, sent_ago=[])
+    start = time.perf_counter()
+    RUNNERS[engine](app, StageTimer())
+    actual = time.perf_counter() - start
+    get_services().close()
+    with app.app_context():
+        sent = EmailCampaign.query.filter_by(status='sent').count()
+    return {
+        'forecast_seconds': forecast['drain_seconds'],
+        'actual_seconds': round(actual, 1),
+        'error': round(forecast['drain_seconds'] / actual - 1, 3),
+        'forecast_sent': forecast['sent'],
+        'actual_sent': sent,
+        'forecast_wall_seconds': forecast['wall_seconds'],
+        'calibration': forecast['calibration'],
+    }
+
+
+def scale(app, engine, args):
+    import drain_forecast
+    from models import db, EmailCampaign
+
+    with app.app_context():
+        EmailCampaign.query.delete()
+        db.session.execute(db.insert(EmailCampaign), [
+            {'email': f"contact{i}@company{i % 500}.example", 'subject': 'Partnership', 'status': 'pending',
+             'company_name': f"Company {i % 500}", 'render_mode': 'template' if i % 4 == 0 else None}
+            for i in range(args.scale_rows)
+        ])
+        db.session.commit()
+        forecast = drain_forecast.simulate(app, engine=engine, emails_per_hour=20, min_delay=60, max_delay=180,
+                                           seed=args.seed)
+    return {
+        'pending': forecast['pending'],
+        'drain_days': round(forecast['drain_seconds'] / 86400, 1),
+        'complete': forecast['complete'],
+        'wall_seconds': forecast['wall_seconds'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--campaigns', type=int, default=200)
+    parser.add_argument('--throttled-campaigns', type=int, default=30)
+    parser.add_argument('--delay', type=int, default=1, help='Seconds between sends in the throttled scenario')
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--engines', default='threaded,async', help='Comma-separated: threaded, async')
+    parser.add_argument('--latency', type=float, default=0.05, help='Mean fake generation latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--runs', type=int, default=3, help='Simulations per forecast')
+    parser.add_argument('--scale-rows', type=int, default=100000, help='Pending campaigns for the scale run (0: skip)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    engines = args.engines.split(',')
+
+    report = {'latency': args.latency, 'accuracy': {}, 'scale': {}}
+    with tempfile.TemporaryDirectory() as path, SMTPSink() as sink:
+        configure_env(path, sink.port)
+        from app import create_app
+        from models import db
+
+        app = create_app()
+        with app.app_context():
+            db.create_all()
+        for engine in engines:
+            report['accuracy'][f"{engine}/unthrottled"] = accuracy(app, engine, args.campaigns, 0, args)
+            report['accuracy'][f"{engine}/throttled"] = accuracy(
+                app, engine, args.throttled_campaigns, args.delay, args
+            )
+        if args.scale_rows:
+            for engine in engines:
+                report['scale'][engine] = scale(app, engine, args)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for section in ('accuracy', 'scale'):
+            for engine, result in report[section].items():
+                print(f"{section:<9}{engine:<21} " + ' '.join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
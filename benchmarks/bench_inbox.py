@@ -0,0 +1,154 @@
+"""
+Benchmark and check inbox ingestion against a local IMAP stand-in.
+
+Seeds --campaigns sent campaigns in a throwaway SQLite database and fills the
+stand-in's INBOX with, per ten campaigns: three replies, one out-of-office
+auto-reply, one DSN bounce carrying the original headers, one DSN without
+them (matched by recipient), one delayed DSN and three without mail. Then
+runs InboxIngester.sync() through imap_tools and checks after each pass:
+
+  - first pass: replies and both kinds of bounces applied, auto-replies and
+    delayed DSNs ignored, bounced addresses (and only those) suppressed;
+  - second pass with no new mail: nothing fetched;
+  - third pass after new replies: only the new messages fetched;
+  - after a UIDVALIDITY reset: the folder is read again without changing
+    any outcome or adding suppressions.
+
+Any mismatch fails with an AssertionError.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_inbox [--campaigns 2000] [--batch-size 200] [--json]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.fakes import IMAPStandIn, bounce_message, reply_message
+
+
+def seed(count):
+    from models import db, EmailCampaign
+    db.session.execute(db.insert(EmailCampaign), [
+        {'email': f"Contact{i}@company{i}.example", 'subject': f"Partnership {i}", 'status': 'sent',
+         'message_id': f"<c{i}@sender.example>", 'sent_at': datetime(2026, 10, 1)}
+        for i in range(count)
+    ])
+    db.session.commit()
+
+
+def fill_inbox(imap, count):
+    """Deliver the mail for `count` campaigns; returns the expected final statuses by campaign index"""
+    expected = {}
+    for i in range(count):
+        message_id, email = f"<c{i}@sender.example>", f"contact{i}@company{i}.example"
+        kind = i % 10
+        if kind < 3:
+            imap.append(reply_message(message_id, sender=email))
+            expected[i] = 'replied'
+        elif kind == 3:
+            imap.append(reply_message(message_id, sender=email, auto_reply=True))
+        elif kind == 4:
+            imap.append(bounce_message(message_id, email))
+            expected[i] = 'bounced'
+        elif kind == 5:
+            imap.append(bounce_message(message_id, email, include_headers=False))
+            expected[i] = 'bounced'
+        elif kind == 6:
+            imap.append(bounce_message(message_id, email, status='4.4.1', action='delayed'))
+    return expected
+
+
+def outcomes():
+    from models import EmailCampaign, Suppression
+    statuses = {int(row.message_id[2:].split('@')[0]): row.status
+                for row in EmailCampaign.query.with_entities(EmailCampaign.message_id, EmailCampaign.status)}
+    suppressed = {row.value for row in Suppression.query.with_entities(Suppression.value)}
+    return statuses, suppressed
+
+
+def check(count, expected):
+    statuses, suppressed = outcomes()
+    wrong = {i: status for i, status in statuses.items() if status != expected.get(i, 'sent')}
+    assert not wrong, f"{len(wrong)} campaign(s) with an unexpected status, e.g. {list(wrong.items())[:5]}"
+    bounced = {f"contact{i}@company{i}.example" for i, status in expected.items() if status == 'bounced'}
+    assert suppressed == bounced, f"suppressed {len(suppressed)} address(es), expected the {len(bounced)} bounced"
+
+
+def timed_sync(ingester, imap, mailbox):
+    commands = len(imap.commands)
+    start = time.perf_counter()
+    totals = ingester.sync(mailbox)
+    seconds = time.perf_counter() - start
+    fetches = sum(1 for command in imap.commands[commands:] if command.upper().startswith('UID FETCH'))
+    return totals, fetches, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--campaigns', type=int, default=2000)
+    parser.add_argument('--new-replies', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    report = {'campaigns': args.campaigns}
+    with tempfile.TemporaryDirectory() as path, IMAPStandIn() as imap:
+        os.environ.setdefault('SMTP_PORT', '587')
+        os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+        os.environ['LOG_LEVEL'] = 'WARNING'
+        os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(path, 'inbox.db')}"
+        from app import create_app
+        from models import db
+        from inbox_ingest import InboxIngester
+
+        app = create_app()
+        with app.app_context():
+            db.create_all()
+            seed(args.campaigns)
+            expected = fill_inbox(imap, args.campaigns)
+            report['messages'] = len(imap.folders['INBOX']['messages'])
+            ingester = InboxIngester(host=imap.host, port=imap.port, username='outreach@example.com',
+                                     password='benchmark', ssl=False, folders=['INBOX'], batch_size=args.batch_size)
+
+            with ingester.connect() as mailbox:
+                totals, _, seconds = timed_sync(ingester, imap, mailbox)
+                assert totals['messages'] == report['messages'], totals
+                assert totals['replied'] == sum(1 for status in expected.values() if status == 'replied'), totals
+                assert totals['bounced'] == sum(1 for status in expected.values() if status == 'bounced'), totals
+                check(args.campaigns, expected)
+                report['first_pass'] = dict(totals, seconds=round(seconds, 3),
+                                            messages_per_second=round(totals['messages'] / seconds))
+
+                totals, fetches, seconds = timed_sync(ingester, imap, mailbox)
+                assert totals['messages'] == 0 and fetches == 0, (totals, fetches)
+                report['idle_pass_ms'] = round(seconds * 1000, 2)
+
+                # Replies to campaigns that so far had no mail
+                quiet = [i for i in range(args.campaigns) if i % 10 > 6][:args.new_replies]
+                for i in quiet:
+                    imap.append(reply_message(f"<c{i}@sender.example>", sender=f"contact{i}@company{i}.example"))
+                    expected[i] = 'replied'
+                totals, _, seconds = timed_sync(ingester, imap, mailbox)
+                assert totals['messages'] == len(quiet) and totals['replied'] == len(quiet), totals
+                check(args.campaigns, expected)
+                report['incremental_pass'] = dict(totals, seconds=round(seconds, 3))
+
+                imap.reset_uidvalidity()
+                totals, _, seconds = timed_sync(ingester, imap, mailbox)
+                assert totals['messages'] == len(imap.folders['INBOX']['messages']), totals
+                check(args.campaigns, expected)
+                report['uidvalidity_reset_pass'] = dict(totals, seconds=round(seconds, 3))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key}: {value}")
+        print("all checks passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark the cost of logging on the calling thread.
+
+Each iteration logs what the sender logs per campaign: two INFO lines plus the
+prompt and response dumps (--prompt-size characters each) at DEBUG. The
+scenarios are:
+
+- sync-fstring: the old setup. logging.basicConfig at DEBUG (the old default),
+  eager f-strings, and the file written on the calling thread.
+- sync-fstring-info: the same at INFO. The f-strings are still built.
+- queue-debug: log_pipeline at DEBUG with %-style arguments and the default
+  sampling of the dumps.
+- queue-debug-json: the same with LOG_FORMAT=json and a campaign_id context.
+- queue-info: log_pipeline at INFO, the production default, where the dumps
+  are skipped.
+
+The report gives microseconds per iteration on the caller and, for the queued
+scenarios, the time the writer needs afterwards to drain the queue.
+--write-latency-ms makes every write block for that long, like a busy disk, a
+terminal or a log shipper applying back-pressure. That is where writing on
+the caller's thread hurts.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_logging [--iterations 20000] [--prompt-size 4000] [--write-latency-ms 0.2] [--json]
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+import log_pipeline
+
+
+class SlowStream:
+    """File wrapper whose writes block for `latency` seconds"""
+
+    def __init__(self, f, latency):
+        self.f = f
+        self.latency = latency
+
+    def write(self, data):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def log_campaign(logger, prompt_log, i, prompt, response):
+    logger.info("Processing campaign for: %s at %s", f"contact{i}@company{i}.example", f"Company {i}")
+    prompt_log.debug("AI template selection and outreach prompt: %s", prompt)
+    prompt_log.debug("AI outreach email response: %s", response)
+    logger.info("Successfully sent email to %s", f"contact{i}@company{i}.example")
+
+
+def log_campaign_fstring(logger, prompt_log, i, prompt, response):
+    email = f"contact{i}@company{i}.example"
+    logger.info(f"Processing campaign for: {email} at Company {i}")
+    prompt_log.debug(f"AI template selection and outreach prompt: {prompt}")
+    prompt_log.debug(f"AI outreach email response: {response}")
+    logger.info(f"Successfully sent email to {email}")
+
+
+def run(scenario, iterations, prompt, response, path, latency):
+    logger = logging.getLogger('automated_email_system')
+    prompt_log = logging.getLogger('automated_email_system.prompts')
+    with open(path, 'w') as f:
+        output = SlowStream(f, latency)
+        if scenario.startswith('sync'):
+            for sampled in (logger, prompt_log):
+                sampled.filters.clear()
+            logging.basicConfig(level='INFO' if scenario.endswith('info') else 'DEBUG', stream=output, force=True)
+            call = log_campaign_fstring
+        else:
+            os.environ['LOG_FORMAT'] = 'json' if scenario == 'queue-debug-json' else 'text'
+            log_pipeline.configure_logging('INFO' if scenario == 'queue-info' else 'DEBUG', stream=output)
+            call = log_campaign
+
+        start = time.perf_counter()
+        if scenario == 'queue-debug-json':
+            for i in range(iterations):
+                with log_pipeline.log_context(campaign_id=i):
+                    call(logger, prompt_log, i, prompt, response)
+        else:
+            for i in range(iterations):
+                call(logger, prompt_log, i, prompt, response)
+        caller = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if scenario.startswith('sync'):
+            logging.getLogger().handlers[0].flush()
+        else:
+            log_pipeline.stop_logging()
+        drain = time.perf_counter() - start
+        for handler in logging.getLogger().handlers[:]:
+            logging.getLogger().removeHandler(handler)
+    return {
+        'caller_us_per_iteration': round(caller / iterations * 1e6, 2),
+        'drain_seconds': round(drain, 3),
+        'bytes_written': os.path.getsize(path),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--prompt-size', type=int, default=4000)
+    parser.add_argument('--write-latency-ms', type=float, default=0.0)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    # The queue must hold a whole run, or records are dropped rather than written
+    os.environ['LOG_QUEUE_SIZE'] = str(args.iterations * 4)
+    prompt = ('Company context and instructions. ' * (args.prompt_size // 34 + 1))[:args.prompt_size]
+    response = ('<p>Generated outreach paragraph.</p>' * (args.prompt_size // 36 + 1))[:args.prompt_size]
+
+    report = {'iterations': args.iterations, 'prompt_size': args.prompt_size,
+              'write_latency_ms': args.write_latency_ms, 'scenarios': {}}
+    with tempfile.TemporaryDirectory() as path:
+        for scenario in ('sync-fstring', 'sync-fstring-info', 'queue-debug', 'queue-debug-json', 'queue-info'):
+            report['scenarios'][scenario] = run(scenario, args.iterations, prompt, response,
+                                                os.path.join(path, f"{scenario}.log"), args.write_latency_ms / 1000)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for scenario, result in report['scenarios'].items():
+            print(f"{scenario:<18} caller={result['caller_us_per_iteration']}us/iteration "
+                  f"drain={result['drain_seconds']}s written={result['bytes_written'] // 1024}KB")
+
+
+if __name__ == '__main__':
+    main()
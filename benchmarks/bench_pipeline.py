@@ -0,0 +1,186 @@
+"""
+End-to-end throughput benchmark of the sender, fully offline.
+
+Runs the real process_campaigns -> generate_company_email -> send_email path
+(and/or the async engine) against a fake Gemini client, a local SMTP sink and
+a throwaway SQLite database seeded with N pending campaigns. Reports emails
+per second, p50/p95/p99 per stage and database commits per email.
+
+    python -m benchmarks.bench_pipeline --campaigns 200 --latency 0.2 --output results.json
+    python -m benchmarks.bench_pipeline --baseline results.json --tolerance 0.2
+
+With --baseline the run exits with status 1 if throughput, commits per email
+or stage p95 regress by more than the tolerance.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import FakeGenAIClient, SMTPSink
+from benchmarks.harness import (
+    CommitCounter, StageTimer, compare_with_baseline, configure_env, load_json, seed_campaigns, write_json
+)
+
+# Stages whose p95 is compared with the baseline, per engine
+P95_STAGES = ['smtp', 'build_message', 'record']
+
+
+def instrument_smtp(timer):
+    """Time SMTP transfers for both smtplib and aiosmtplib sessions; returns a function that undoes it"""
+    import smtplib
+    classes = [smtplib.SMTP]
+    try:
+        import aiosmtplib
+        classes.append(aiosmtplib.SMTP)
+    except ImportError:
+        pass
+    originals = [(cls, timer.wrap(cls, 'send_message', 'smtp')) for cls in classes]
+
+    def restore():
+        for cls, original in originals:
+            cls.send_message = original
+    return restore
+
+
+def run_threaded(app, timer):
+    from automated_email_system import EmailAutomation
+    with app.app_context():
+        automation = EmailAutomation()
+        timer.wrap(automation, 'generate_company_email', 'generate')
+        timer.wrap(automation, 'build_message')
+        timer.wrap(automation, 'send_email', 'deliver')
+        timer.wrap(automation, 'log_activity', 'record')
+        timer.wrap(automation, 'update_stats', 'record')
+        automation.process_campaigns()
+
+
+def run_async(app, timer):
+    from async_outbound import AsyncOutboundEngine
+
+    async def drain():
+        engine = AsyncOutboundEngine(app)
+        timer.wrap(engine, 'generate')
+        timer.wrap(engine.automation, 'build_message')
+        timer.wrap(engine, 'deliver')
+        timer.wrap(engine, '_record_delivery', 'record')
+        await engine.start()
+        try:
+            await engine.process_pending()
+        finally:
+            await engine.shutdown()
+
+    asyncio.run(drain())
+
+
+RUNNERS = {'threaded': run_threaded, 'async': run_async}
+
+
+def run_engine(app, engine, args, sink):
+    from models import db, EmailCampaign
+    from services import get_services
+
+    fake = FakeGenAIClient(args.latency, args.jitter, args.error_rate, seed=args.seed,
+                           distribution=args.distribution, slow_rate=args.slow_rate)
+    get_services().override(genai_client=fake)
+    with app.app_context():
+        seed_campaigns(args.campaigns)
+        commits = CommitCounter(db.engine)
+    timer = StageTimer()
+    restore_smtp = instrument_smtp(timer)
+    delivered_before = sink.messages
+
+    start = time.perf_counter()
+    try:
+        RUNNERS[engine](app, timer)
+    finally:
+        elapsed = time.perf_counter() - start
+        commits.close()
+        restore_smtp()
+        get_services().close()
+
+    with app.app_context():
+        sent = EmailCampaign.query.filter_by(status='sent').count()
+        failed = EmailCampaign.query.filter_by(status='failed').count()
+    return {
+        'seconds': round(elapsed, 3),
+        'sent': sent,
+        'failed': failed,
+        'delivered_to_sink': sink.messages - delivered_before,
+        'provider_errors': fake.latency.errors,
+        'emails_per_second': round(sent / elapsed, 3),
+        'db_commits': commits.commits,
+        'db_commits_per_email': round(commits.commits / max(sent, 1), 3),
+        'stages': timer.summary(),
+    }
+
+
+def baseline_checks(engines):
+    checks = []
+    for engine in engines:
+        checks += [
+            (f'engines.{engine}.emails_per_second', 'higher'),
+            (f'engines.{engine}.db_commits_per_email', 'lower'),
+        ]
+        checks += [(f'engines.{engine}.stages.{stage}.p95_ms', 'lower') for stage in P95_STAGES]
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end sender benchmark')
+    parser.add_argument('--campaigns', type=int, default=100)
+    parser.add_argument('--engines', default='threaded,async', help='Comma-separated: threaded, async')
+    parser.add_argument('--latency', type=float, default=0.2, help='Mean fake generation latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--distribution', choices=['fixed', 'normal', 'lognormal'], default='normal')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='Share of calls that take 10x longer')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of generation calls that fail')
+    parser.add_argument('--smtp-latency', type=float, default=0.0, help='Sink delay per message in seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--baseline', help='JSON report of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression')
+    parser.add_argument('--json', action='store_true', help='Print the JSON report')
+    args = parser.parse_args()
+    engines = args.engines.split(',')
+
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'json')},
+        'engines': {},
+    }
+    with tempfile.TemporaryDirectory() as path, SMTPSink(data_latency=args.smtp_latency) as sink:
+        configure_env(path, sink.port)
+        from app import create_app
+        from models import db
+
+        app = create_app()
+        with app.app_context():
+            db.create_all()
+        for engine in engines:
+            report['engines'][engine] = run_engine(app, engine, args, sink)
+
+    if args.output:
+        write_json(args.output, report)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for engine, result in report['engines'].items():
+            print(f"{engine}: {result['emails_per_second']} emails/s, {result['sent']} sent, "
+                  f"{result['failed']} failed, {result['db_commits_per_email']} commits/email")
+            for stage, stats in result['stages'].items():
+                print(f"  {stage:<14} n={stats['count']:<5} p50={stats['p50_ms']}ms "
+                      f"p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+
+    if args.baseline:
+        regressions = compare_with_baseline(report, load_json(args.baseline), baseline_checks(engines), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']} -> {regression['current']} "
+                  f"({regression['change']:+.0%})", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Benchmark outreach prompts: bytes sent, tokens, estimated cost and latency per call.
+
+Runs --calls outreach generations against the fake Gemini client, whose
+latency grows with the input tokens it has to read (--prefill-ms-per-1k).
+The scenarios are:
+
+- legacy: the old single-string prompt, with the contact's company in the
+  first line and the instructions stated twice.
+- compact: prompt_builder's prefix + suffix, sent whole (PROMPT_CACHE=off).
+- cached: the same, with the prefix registered once in the provider's context
+  cache and only the suffix sent on each call. The model's minimum cache size
+  is lifted (PROMPT_CACHE_MIN_TOKENS=0) to show what caching saves.
+- model_min: caching on, with the default model's own minimum. On
+  gemini-1.5-pro (32768 tokens) a catalog of this size is not cached at all:
+  caches_created stays 0 and every call counts in cache_skipped_calls.
+
+The report gives mean bytes sent, mean input tokens (with the cached share),
+mean estimated cost and latency percentiles per call.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_prompts [--calls 200] [--templates 6] [--template-size 1500] [--json]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from benchmarks.fakes import FakeGenAIClient
+from benchmarks.harness import percentile
+
+
+def legacy_prompt(company_name, company_info, target_person, contract_type, templates):
+    """The outreach prompt as built before prompt_builder"""
+    template_choices = "\n\n".join([
+        f"Template {i+1}:\nName: {t.name}\nDescription: {t.description}\nContent:\n{t.template_content}" for i, t in enumerate(templates)
+    ])
+    return f"""
+You are an expert B2B outreach email writer. You are writing an email FROM Enspyre Management Services TO {{company_name}} (recipient: {{target_person or 'the recipient'}}).
+
+Given the following contract/context, select the most appropriate template from the list below and adapt it to generate ONLY the main body of the email. Adapt the technical details and bullet points to match the context. Use HTML <ul><li>...</li></ul> for bullet points, and include only 3 to 5 concise, high-impact bullets. Always include a line at the end of the email mentioning the attached capabilities statement (e.g., 'I've attached our capabilities statement for your review.'). Do NOT include any signature, closing, sender name, title, company, logo, website, or placeholders for these. The signature will be added automatically.
+
+Templates:
+{template_choices}
+
+Context/Contract Details:
+{company_info}
+
+Variables:
+- recipient_name: {target_person or 'the recipient'}
+- contract_type: {contract_type or '(extract from context)'}
+- company_name: {company_name}
+- sender_company: Enspyre Management Services
+
+Instructions:
+- Write as Enspyre Management Services reaching out to {company_name}.
+- Select the best template for the context.
+- Adapt the technical bullet points to match the contract/context.
+- Use HTML <ul><li>...</li></ul> for bullet points, and include only 3 to 5 concise, high-impact bullets.
+- Always include a line at the end of the email mentioning the attached capabilities statement (e.g., 'I've attached our capabilities statement for your review.').
+- Fill in all variables.
+- Keep the message concise and professional.
+- Do NOT include any signature, closing, sender name, title, company, logo, website, or placeholders for these in your output.
+- Do NOT include a subject line in your output.
+"""
+
+
+def run(scenario, automation, client, templates, calls):
+    import token_usage
+    from automated_email_system import GEMINI_MODEL
+
+    latencies = []
+    with token_usage.track(import_job=scenario):
+        for i in range(calls):
+            args = (f"Company {i}", f"Cloud migration for {i} sites, incumbent contract expiring.", f"Person {i}",
+                    None, templates)
+            start = time.perf_counter()
+            if scenario == 'legacy':
+                prompt = legacy_prompt(*args)
+                response = client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
+                token_usage.record('outreach', GEMINI_MODEL, prompt, response)
+            else:
+                automation.generate_company_email(args[0], args[1], args[2], templates=templates)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--templates', type=int, default=6)
+    parser.add_argument('--template-size', type=int, default=1500, help='Characters per template')
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='Fixed provider latency per call')
+    parser.add_argument('--prefill-ms-per-1k', type=float, default=30.0, help='Added latency per 1000 uncached input tokens')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        os.environ.setdefault('SMTP_PORT', '587')
+        os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+        os.environ['LOG_LEVEL'] = 'WARNING'
+        os.environ['GOOGLE_API_KEY'] = 'benchmark-placeholder'
+        os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(path, 'prompts.db')}"
+        from app import create_app
+        from models import db
+        from services import get_services
+        import token_usage
+
+        app = create_app()
+        body = ('We deliver {service} for {company_name}: assessment, migration, operations and security reviews. '
+                * (args.template_size // 100 + 1))[:args.template_size]
+        templates = [SimpleNamespace(name=f"Template {i}", description=f"Outreach for service line {i}",
+                                     template_content=body) for i in range(args.templates)]
+        report = {'calls': args.calls, 'templates': args.templates, 'template_size': args.template_size,
+                  'scenarios': {}}
+        with app.app_context():
+            db.create_all()
+            for scenario in ('legacy', 'compact', 'cached', 'model_min'):
+                client = FakeGenAIClient(latency=args.latency_ms / 1000, jitter=0,
+                                         prefill_per_1k=args.prefill_ms_per_1k / 1000)
+                services = get_services()
+                os.environ['PROMPT_CACHE'] = 'on' if scenario in ('cached', 'model_min') else 'off'
+                os.environ['PROMPT_CACHE_MIN_TOKENS'] = '' if scenario == 'model_min' else '0'
+                services.override(genai_client=client, prompt_cache=None)
+                latencies = run(scenario, services.email_automation, client, templates, args.calls)
+                token_usage.flush()
+                usage = token_usage.totals(('import_job',), import_job=scenario)[0]
+                report['scenarios'][scenario] = {
+                    'bytes_sent_per_call': round(client.models.traffic['bytes_sent'] / args.calls),
+                    'input_tokens_per_call': round(usage['input_tokens'] / args.calls),
+                    'cached_tokens_per_call': round(usage['cached_tokens'] / args.calls),
+                    'cost_usd_per_1000_calls': round(usage['cost_usd'] / args.calls * 1000, 3),
+                    'latency_ms_p50': round(percentile(latencies, 50) * 1000, 1),
+                    'latency_ms_p95': round(percentile(latencies, 95) * 1000, 1),
+                    'caches_created': client.caches.created,
+                    'cache_skipped_calls': usage['cache_skipped_calls'],
+                }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for scenario, result in report['scenarios'].items():
+            print(f"{scenario:<8} " + ' '.join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
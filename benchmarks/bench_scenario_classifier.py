@@ -0,0 +1,102 @@
+"""
+Benchmark the local scenario classifier.
+
+Reports classifications per second and how many LLM classification calls
+the classifier would have avoided on the stored ScenarioTraining history,
+using the analyzer's real indicator table (built-in and learned phrases).
+Without history it runs on a small set of hand-labelled sample notices.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_scenario_classifier [--repeat 20] [--json]
+"""
+import argparse
+import json
+import time
+from collections import Counter
+
+from app import app
+from models import ScenarioTraining
+from scenario_analyzer import ScenarioAnalyzer
+
+
+# Labelled notices written independently of the indicator table, in the wording agencies and primes
+# actually use, so the avoided-call ratio is not inflated by samples built from the indicators
+SAMPLE_NOTICES = [
+    ('expiring_contract', "The current task order for help desk support ends 30 September; the agency intends to recompete the requirement."),
+    ('expiring_contract', "Period of performance for the existing network operations contract expires in Q3 FY25. Incumbent: Acme Federal."),
+    ('expiring_contract', "Follow-on to contract W91QUZ-20-C-0012. The incumbent has held the work since 2019."),
+    ('expiring_contract', "Bridge extension issued while the agency plans the replacement acquisition for its legacy HR system support."),
+    ('expiring_contract', "Option year 4 is the final option on the cloud hosting vehicle; market research for the successor effort is underway."),
+    ('new_solicitation', "Sources Sought: the Department seeks vendors able to modernize its case management platform. Responses due 5 May."),
+    ('new_solicitation', "Request for Proposal 70RTAC24R00000012 for zero trust architecture services, NAICS 541512."),
+    ('new_solicitation', "RFI: the agency is gathering information on AI-enabled document processing before drafting a requirement."),
+    ('new_solicitation', "Draft solicitation released for industry comment; questions are due within ten days of posting."),
+    ('new_solicitation', "Pre-solicitation notice for a single-award BPA covering data analytics support."),
+    ('partnership_opportunity', "Prime contractor seeking small business teaming partners with FedRAMP experience for an upcoming bid."),
+    ('partnership_opportunity', "We are looking for an 8(a) firm to subcontract the cybersecurity portion of a DHS effort."),
+    ('partnership_opportunity', "Mentor-protege arrangement sought with a firm holding a Top Secret facility clearance."),
+    ('partnership_opportunity', "Large integrator building a team for the CIO-SP4 recompete, interested in niche AI capabilities."),
+    ('partnership_opportunity', "Open to a JV with a HUBZone company for set-aside construction management work."),
+    ('capability_statement', "Please send your capability statement and relevant past performance for IT modernization."),
+    ('capability_statement', "The contracting officer asked for a summary of our certifications and differentiators before the industry day."),
+    ('capability_statement', "Small business office requests a one-page overview of company qualifications and NAICS codes."),
+    ('capability_statement', "Provide three references demonstrating experience with Salesforce implementations at civilian agencies."),
+    ('capability_statement', "Vendor outreach session: bring a brief describing core competencies and contract vehicles held."),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20, help='Passes over the history for the throughput measurement')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    with app.app_context():
+        analyzer = ScenarioAnalyzer()
+        # One unambiguous indicator must be enough to skip the LLM classification call
+        clear = analyzer.classify_scenario("Sources Sought: cloud migration support for a civilian agency.")
+        assert clear['scenario_type'] == 'new_solicitation' and clear['confidence'] >= analyzer.confidence_threshold, clear
+        # The real indicator table: built-in phrases plus those learned from feedback
+        history = [(row.scenario_type, row.input_text) for row in ScenarioTraining.query.all()]
+        source = 'ScenarioTraining'
+        if not history:
+            history = SAMPLE_NOTICES
+            source = 'sample notices'
+
+        results = [(expected, analyzer.classify_scenario(text)) for expected, text in history]
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for _, text in history:
+                analyzer.classify_scenario(text)
+        elapsed = time.perf_counter() - start
+
+    confident = [(expected, result) for expected, result in results
+                 if result['scenario_type'] and result['confidence'] >= analyzer.confidence_threshold]
+    agreed = sum(1 for expected, result in confident if result['scenario_type'] == expected)
+    matched = [(expected, result) for expected, result in results if result['scenario_type']]
+
+    report = {
+        'source': source,
+        'rows': len(history),
+        'confidence_threshold': analyzer.confidence_threshold,
+        'classifications_per_second': round(len(history) * args.repeat / elapsed, 1) if elapsed else None,
+        'llm_classifications_avoided': len(confident),
+        'avoided_ratio': round(len(confident) / len(history), 3) if history else 0.0,
+        'agreement_with_stored_type': round(agreed / len(confident), 3) if confident else None,
+        # Below the threshold these still go to the LLM; shown to help tune SCENARIO_CLASSIFIER_CONFIDENCE
+        'matched_any_indicator': len(matched),
+        'matched_agreement': round(sum(1 for expected, result in matched if result['scenario_type'] == expected)
+                                   / len(matched), 3) if matched else None,
+        'confidence_histogram': dict(sorted(Counter(round(result['confidence'], 1) for _, result in results).items())),
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark ScenarioIndex lookups on a synthetic corpus.
+
+The target is < 10 ms per lookup at 100k indexed scenarios.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_scenario_index [--rows 100000] [--queries 200] [--json]
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+
+from scenario_index import ScenarioIndex
+
+WORDS = (
+    "agency contract incumbent recompete renewal solicitation rfp rfq sources sought naics "
+    "cybersecurity cloud migration data analytics help desk network modernization training "
+    "logistics facilities support engineering program management gsa schedule small business "
+    "8a hubzone sdvosb award option period base year deadline proposal response teaming "
+    "partnership subcontracting capability past performance certification army navy air force"
+).split()
+
+
+def synthetic_text(rng, length=80):
+    return ' '.join(rng.choice(WORDS) for _ in range(length))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--dimensions', type=int, default=128)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    corpus = [synthetic_text(rng) for _ in range(args.rows)]
+
+    with tempfile.TemporaryDirectory() as path:
+        index = ScenarioIndex(path, dimensions=args.dimensions)
+        start = time.perf_counter()
+        for offset in range(0, args.rows, 5000):
+            index.add_many((i + 1, corpus[i]) for i in range(offset, min(offset + 5000, args.rows)))
+        build_seconds = time.perf_counter() - start
+
+        # Reload from disk to confirm persistence and measure load time
+        start = time.perf_counter()
+        index = ScenarioIndex(path, dimensions=args.dimensions)
+        load_seconds = time.perf_counter() - start
+
+        latencies = []
+        hits = 0
+        for _ in range(args.queries):
+            target = rng.randrange(args.rows)
+            start = time.perf_counter()
+            results = index.search(corpus[target], k=3)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += results[0][0] == target + 1
+
+    report = {
+        'rows': args.rows,
+        'dimensions': args.dimensions,
+        'index_rows_per_second': round(args.rows / build_seconds, 1),
+        'load_seconds': round(load_seconds, 3),
+        'lookup_ms_p50': round(percentile(latencies, 50), 3),
+        'lookup_ms_p99': round(percentile(latencies, 99), 3),
+        'exact_match_recall': round(hits / args.queries, 3),
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
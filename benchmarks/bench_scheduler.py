@@ -0,0 +1,145 @@
+"""
+Benchmark the send scheduler: cost of picking the next campaign and fairness between queues.
+
+Fills a throwaway SQLite database with one large import (--import-rows, spread
+over --companies companies), then replays --picks sends. A second import of
+half the size arrives after a tenth of the picks, and a campaign is added by
+hand every --manual-every picks. Each pick reads the next campaign and marks
+it sent. The replay runs twice: once in id order, reading on from the last id
+like the sender did before send_scheduler, and once in send_scheduler order.
+
+The report gives pick latency percentiles, the query plan of the pick, how
+many picks each hand-added campaign waited, the share of sends per queue
+while both imports were pending, and the longest run of one company.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_scheduler [--import-rows 100000] [--picks 2000] [--manual-every 50] [--json]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+
+from benchmarks.harness import percentile
+
+SCHEDULER_INDEXES = ('ix_email_campaign_schedule', 'ix_email_campaign_pending_tag')
+
+
+def seed_import(db, EmailCampaign, job, rows, companies, start=0):
+    db.session.execute(db.insert(EmailCampaign), [
+        {'email': f"contact{i}@company{i % companies}.example", 'subject': 'Partnership',
+         'company_name': f"{job} company {i % companies}", 'status': 'pending', 'queue': f"import:{job}"}
+        # Each company's contacts come in one block, as in a list sorted by company
+        for i in sorted(range(start, start + rows), key=lambda i: i % companies)
+    ])
+    db.session.commit()
+
+
+def replay(args, order):
+    from models import db, EmailCampaign
+    import send_scheduler
+
+    EmailCampaign.query.delete()
+    db.session.execute(db.delete(db.metadata.tables['send_queue']))
+    db.session.commit()
+    # The id-order replay runs on the schema from before send_scheduler, without its indexes
+    for index in EmailCampaign.__table__.indexes:
+        if index.name in SCHEDULER_INDEXES and order == 'scheduler':
+            index.create(db.engine, checkfirst=True)
+        elif index.name in SCHEDULER_INDEXES:
+            index.drop(db.engine, checkfirst=True)
+    seed_import(db, EmailCampaign, 'a', args.import_rows, args.companies)
+    if order == 'scheduler':
+        send_scheduler.backfill()
+    columns = (EmailCampaign.id, EmailCampaign.queue, EmailCampaign.company_name)
+
+    def next_query(last_id):
+        query = db.session.query(*columns).filter(EmailCampaign.status == 'pending')
+        if order == 'scheduler':
+            return query.order_by(*send_scheduler.SEND_ORDER).limit(1)
+        return query.filter(EmailCampaign.id > last_id).order_by(EmailCampaign.id).limit(1)
+
+    plan = [row[-1] for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + str(
+        next_query(0).statement.compile(compile_kwargs={'literal_binds': True}))))]
+
+    latencies, waits, shares = [], [], Counter()
+    added = {}
+    run, longest, last_company = 0, 0, None
+    last_id = 0
+    for pick in range(args.picks):
+        if pick == args.picks // 10:
+            seed_import(db, EmailCampaign, 'b', args.import_rows // 2, args.companies, start=args.import_rows)
+            if order == 'scheduler':
+                send_scheduler.backfill()
+        if pick % args.manual_every == 0:
+            campaign = EmailCampaign(email=f"manual{pick}@example.com", subject='Urgent follow-up',
+                                     company_name=f"Manual {pick}")
+            db.session.add(campaign)
+            db.session.commit()
+            added[campaign.id] = pick
+        start = time.perf_counter()
+        row = next_query(last_id).first()
+        if row is None:
+            # The id-order sender starts a new pass from the lowest id
+            last_id = 0
+            row = next_query(last_id).first()
+        latencies.append(time.perf_counter() - start)
+        EmailCampaign.query.filter_by(id=row.id).update({'status': 'sent'}, synchronize_session=False)
+        db.session.commit()
+        last_id = row.id
+        if row.id in added:
+            waits.append(pick - added.pop(row.id))
+        if pick >= args.picks // 10:
+            shares[row.queue] += 1
+        run = run + 1 if row.company_name == last_company else 1
+        longest, last_company = max(longest, run), row.company_name
+    counted = sum(shares.values())
+    return {
+        'pick_ms_p50': round(percentile(latencies, 50) * 1000, 3),
+        'pick_ms_p95': round(percentile(latencies, 95) * 1000, 3),
+        'query_plan': plan,
+        'manual_sent': len(waits),
+        'manual_unsent': len(added),
+        'manual_wait_picks_max': max(waits) if waits else None,
+        'send_share_after_second_import': {name: round(count / counted, 3) for name, count in shares.items()},
+        'longest_company_run': longest,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--import-rows', type=int, default=100000)
+    parser.add_argument('--companies', type=int, default=500)
+    parser.add_argument('--picks', type=int, default=2000)
+    parser.add_argument('--manual-every', type=int, default=50)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        os.environ.setdefault('SMTP_PORT', '587')
+        os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+        os.environ['LOG_LEVEL'] = 'WARNING'
+        os.environ.setdefault('DB_SLOW_QUERY_MS', '10000')
+        os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(path, 'scheduler.db')}"
+        from app import create_app
+        from models import db
+
+        app = create_app()
+        report = {'import_rows': args.import_rows, 'picks': args.picks, 'manual_every': args.manual_every,
+                  'orders': {}}
+        with app.app_context():
+            db.create_all()
+            for order in ('id', 'scheduler'):
+                report['orders'][order] = replay(args, order)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for order, result in report['orders'].items():
+            print(f"{order:<10} " + ' '.join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
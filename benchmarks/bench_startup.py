@@ -0,0 +1,94 @@
+"""
+Benchmark web startup and per-request setup cost.
+
+Measures, each in a fresh interpreter:
+  - import_seconds: `import app` (the app itself is built on demand)
+  - first_request_seconds: import, create_app(), create tables on a throwaway SQLite
+    database and serve GET / through the test client
+  - warm_up_seconds: ServiceContainer.warm_up() (clients, heavy imports, templates)
+and in this process the cost of EmailAutomation() as built by add_campaign/upload_cab.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_startup [--runs 3] [--json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+FIRST_REQUEST = """
+import time
+start = time.perf_counter()
+import app as web
+import_seconds = time.perf_counter() - start
+application = web.create_app()
+with application.app_context():
+    web.db.create_all()
+response = application.test_client().get('/')
+assert response.status_code == 200, response.status_code
+total = time.perf_counter() - start
+start = time.perf_counter()
+from services import get_services
+get_services().warm_up(application)
+print(import_seconds, total, time.perf_counter() - start)
+"""
+
+
+def run_cold_start(env):
+    output = subprocess.run(
+        [sys.executable, '-c', FIRST_REQUEST],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout.strip().splitlines()[-1]
+    return [float(value) for value in output.split()]
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        env = dict(os.environ)
+        env.setdefault('SMTP_PORT', '587')
+        env.setdefault('FLASK_SECRET_KEY', 'benchmark')
+        env.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')  # client creation does not call the API
+        env['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(path, 'startup.db')}"
+        env['LOG_LEVEL'] = 'WARNING'
+        samples = [run_cold_start(env) for _ in range(args.runs)]
+
+        os.environ.update({key: env[key] for key in ('SMTP_PORT', 'FLASK_SECRET_KEY', 'SQLALCHEMY_DATABASE_URI', 'LOG_LEVEL')})
+        import app as web
+        from automated_email_system import EmailAutomation
+        with web.app.app_context():
+            web.db.create_all()
+            start = time.perf_counter()
+            for _ in range(100):
+                EmailAutomation()
+            per_request_ms = (time.perf_counter() - start) * 10
+
+    report = {
+        'runs': args.runs,
+        'import_seconds': round(median([s[0] for s in samples]), 3),
+        'first_request_seconds': round(median([s[1] for s in samples]), 3),
+        'warm_up_seconds': round(median([s[2] for s in samples]), 3),
+        'email_automation_setup_ms': round(per_request_ms, 3),
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark the suppression index: loading it, refreshing it and screening an import.
+
+Fills a throwaway SQLite database with suppressed addresses/domains and
+existing campaigns, then times the first (full) load, an incremental refresh
+after a few new suppressions, and screening of an --import-rows address list.
+The target is a 1M-row import screened in seconds.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_suppression [--suppressed 100000] [--campaigns 200000] [--import-rows 1000000] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--suppressed', type=int, default=100000)
+    parser.add_argument('--campaigns', type=int, default=200000)
+    parser.add_argument('--import-rows', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as path:
+        os.environ.setdefault('SMTP_PORT', '587')
+        os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+        os.environ['LOG_LEVEL'] = 'WARNING'
+        os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(path, 'suppression.db')}"
+        from app import create_app
+        from models import db, EmailCampaign, Suppression
+        from suppression import SuppressionIndex
+
+        app = create_app()
+        report = {'suppressed': args.suppressed, 'campaigns': args.campaigns, 'import_rows': args.import_rows}
+        with app.app_context():
+            db.create_all()
+            db.session.execute(db.insert(Suppression), [
+                {'kind': 'email', 'value': f"person{i}@company{i % 5000}.com", 'reason': 'bounced'}
+                for i in range(args.suppressed)
+            ] + [{'kind': 'domain', 'value': f"blocked{i}.com", 'reason': 'manual'} for i in range(100)])
+            db.session.execute(db.insert(EmailCampaign), [
+                {'email': f"lead{i}@prospect{i % 20000}.com", 'subject': 'Hello'} for i in range(args.campaigns)
+            ])
+            db.session.commit()
+
+            index = SuppressionIndex()
+            tracemalloc.start()
+            start = time.perf_counter()
+            index.refresh()
+            report['full_load_seconds'] = round(time.perf_counter() - start, 3)
+            report['index_memory_mb'] = round(tracemalloc.get_traced_memory()[0] / 1024 / 1024, 1)
+            tracemalloc.stop()
+
+            db.session.execute(db.insert(Suppression), [
+                {'kind': 'email', 'value': f"new{i}@late.com", 'reason': 'unsubscribed'} for i in range(100)
+            ])
+            db.session.commit()
+            start = time.perf_counter()
+            index.refresh()
+            report['incremental_refresh_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            start = time.perf_counter()
+            index.refresh()
+            report['noop_refresh_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+            # A realistic import: mostly new addresses, some suppressed, some already contacted, some repeated
+            emails = []
+            for i in range(args.import_rows):
+                roll = rng.random()
+                if roll < 0.05:
+                    j = rng.randrange(args.suppressed)
+                    emails.append(f"Person{j}@Company{j % 5000}.com ")
+                elif roll < 0.10:
+                    j = rng.randrange(args.campaigns)
+                    emails.append(f"lead{j}@prospect{j % 20000}.com")
+                elif roll < 0.12:
+                    emails.append(f"ops@mail.blocked{rng.randrange(100)}.com")
+                else:
+                    emails.append(f"buyer{rng.randrange(args.import_rows)}@firm{i % 9000}.com")
+            start = time.perf_counter()
+            reasons = index.screen(emails)
+            seconds = time.perf_counter() - start
+            report['screen_seconds'] = round(seconds, 3)
+            report['screen_rows_per_second'] = round(args.import_rows / seconds)
+            report['skipped'] = {reason: reasons.count(reason) for reason in set(reasons) if reason}
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
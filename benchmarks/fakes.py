@@ -0,0 +1,512 @@
+"""
+Stand-ins for external services, used by the benchmarks.
+
+  - FakeGenAIClient: google-genai shaped client (sync and .aio) with
+    configurable latency, jitter and error rate, a context cache API
+    (client.caches) and usage metadata on its responses
+  - FakeOpenAI: the openai.chat.completions.create surface, same knobs
+  - SMTPSink: a minimal local SMTP server that accepts and counts messages
+  - NullSMTPPool: SMTPPool replacement that counts messages without any I/O
+  - IMAPStandIn: a minimal local IMAP server holding folders of messages,
+    with reply_message/bounce_message to build what it serves
+"""
+import asyncio
+import math
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+
+class FakeLatency:
+    """
+    Latency/error model shared by the fake providers.
+
+    distribution: 'fixed', 'normal' (jitter is the standard deviation) or
+    'lognormal' (mean `latency`, jitter is sigma of the underlying normal).
+    slow_rate adds tail spikes of slow_factor x the sampled latency; failing
+    calls still wait their latency, as a real provider error would.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.2, error_rate=0.0, seed=None, distribution='normal',
+                 slow_rate=0.0, slow_factor=10):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.distribution = distribution
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def _delay(self):
+        if self.distribution == 'fixed' or not self.jitter:
+            delay = self.latency
+        elif self.distribution == 'lognormal':
+            mu = math.log(self.latency) - self.jitter ** 2 / 2 if self.latency > 0 else 0
+            delay = self.random.lognormvariate(mu, self.jitter) if self.latency > 0 else 0.0
+        else:
+            delay = max(0.0, self.random.gauss(self.latency, self.jitter))
+        if self.slow_rate and self.random.random() < self.slow_rate:
+            delay *= self.slow_factor
+        return delay
+
+    def sample(self):
+        """(delay_seconds, should_fail) for one call"""
+        with self.lock:
+            self.calls += 1
+            delay = self._delay()
+            fail = self.random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        return delay, fail
+
+
+class FakeProviderError(Exception):
+    pass
+
+
+def fake_email_text(prompt):
+    return f"Subject: Partnership\n\nHello,\n\nA generated email for a {len(prompt)} character prompt.\n\nBest regards"
+
+
+def _tokens(text):
+    return len(text) // 4 + 1
+
+
+class _FakeCaches:
+    """client.caches: create(model, config={'contents': [...], 'ttl': ...}) and delete(name)"""
+
+    def __init__(self, min_tokens=0):
+        self.min_tokens = min_tokens
+        self.contents = {}
+        self.created = 0
+
+    def create(self, model, config):
+        text = ''.join(str(part) for part in config['contents'])
+        if _tokens(text) < self.min_tokens:
+            raise FakeProviderError(f"cached content is too small: {_tokens(text)} < {self.min_tokens} tokens")
+        self.created += 1
+        name = f"cachedContents/fake-{self.created}"
+        self.contents[name] = text
+        return SimpleNamespace(name=name, model=model)
+
+    def delete(self, name, **kwargs):
+        self.contents.pop(name, None)
+
+
+class _FakeModels:
+    """
+    Time to respond is the sampled latency plus prefill_per_1k x thousands of input tokens not read
+    from a cache. traffic counts calls, prompt bytes sent and cached tokens.
+    """
+
+    def __init__(self, model, chunk_delay=0.0, caches=None, prefill_per_1k=0.0):
+        self.model = model
+        self.chunk_delay = chunk_delay
+        self.caches = caches
+        self.prefill_per_1k = prefill_per_1k
+        self.traffic = {'calls': 0, 'bytes_sent': 0, 'cached_tokens': 0}
+        self.lock = threading.Lock()
+
+    def prepare(self, contents, config):
+        """(delay, fail, prompt text, usage metadata) of one call"""
+        sent = str(contents)
+        name = (config or {}).get('cached_content') if isinstance(config, dict) else getattr(config, 'cached_content', None)
+        cached = ''
+        if name:
+            if name not in self.caches.contents:
+                raise FakeProviderError(f"cached content {name} not found")
+            cached = self.caches.contents[name]
+        delay, fail = self.model.sample()
+        with self.lock:
+            self.traffic['calls'] += 1
+            self.traffic['bytes_sent'] += len(sent.encode('utf-8'))
+            self.traffic['cached_tokens'] += _tokens(cached) if cached else 0
+        delay += self.prefill_per_1k * _tokens(sent) / 1000
+        usage = SimpleNamespace(prompt_token_count=_tokens(cached + sent), cached_content_token_count=_tokens(cached) if cached else 0)
+        return delay, fail, cached + sent, usage
+
+    def respond(self, prompt, usage):
+        text = fake_email_text(prompt)
+        usage.candidates_token_count = _tokens(text)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def generate_content(self, model, contents, config=None, **kwargs):
+        delay, fail, prompt, usage = self.prepare(contents, config)
+        time.sleep(delay)
+        if fail:
+            raise FakeProviderError("fake provider error")
+        return self.respond(prompt, usage)
+
+    def generate_content_stream(self, model, contents, config=None, **kwargs):
+        """The latency is time to the first chunk; then a word every chunk_delay seconds"""
+        delay, fail, prompt, usage = self.prepare(contents, config)
+        time.sleep(delay)
+        if fail:
+            raise FakeProviderError("fake provider error")
+        final = self.respond(prompt, usage)
+        words = re.findall(r'\S+\s*', final.text)
+        for i, word in enumerate(words):
+            if i and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            # Like the real API, the usage metadata of the whole stream comes with the last chunk
+            yield SimpleNamespace(text=word, usage_metadata=usage if i == len(words) - 1 else None)
+
+
+class _FakeAsyncModels:
+    def __init__(self, models):
+        self.models = models
+
+    async def generate_content(self, model, contents, config=None, **kwargs):
+        delay, fail, prompt, usage = self.models.prepare(contents, config)
+        await asyncio.sleep(delay)
+        if fail:
+            raise FakeProviderError("fake provider error")
+        return self.models.respond(prompt, usage)
+
+
+class FakeGenAIClient:
+    """
+    Replaces google.genai.Client: client.models.generate_content(_stream),
+    client.aio.models.generate_content and client.caches. prefill_per_1k adds
+    latency per thousand input tokens not read from a cache; caches smaller
+    than cache_min_tokens are rejected, as the real API does.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.2, error_rate=0.0, seed=None, chunk_delay=0.0, prefill_per_1k=0.0,
+                 cache_min_tokens=0, **model):
+        self.latency = FakeLatency(latency, jitter, error_rate, seed, **model)
+        self.caches = _FakeCaches(cache_min_tokens)
+        self.models = _FakeModels(self.latency, chunk_delay, self.caches, prefill_per_1k)
+        self.aio = SimpleNamespace(models=_FakeAsyncModels(self.models))
+
+
+class FakeOpenAI:
+    """Replaces openai.chat.completions.create; reply(messages) builds the response text"""
+
+    def __init__(self, reply, latency=0.5, jitter=0.2, error_rate=0.0, seed=None, **model):
+        self.reply = reply
+        self.latency = FakeLatency(latency, jitter, error_rate, seed, **model)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        delay, fail = self.latency.sample()
+        time.sleep(delay)
+        if fail:
+            raise FakeProviderError("fake provider error")
+        message = SimpleNamespace(content=self.reply(messages))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class SMTPSink:
+    """
+    Local SMTP server on a background thread. Accepts AUTH without checking,
+    never offers STARTTLS (run senders with SMTP_STARTTLS=0) and discards
+    message bodies after counting them.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, data_latency=0.0):
+        self.host = host
+        self.port = port
+        self.data_latency = data_latency
+        self.messages = 0
+        self.connections = 0
+        self._ready = threading.Event()
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='smtp-sink', daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(10)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._session, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _session(self, reader, writer):
+        self.connections += 1
+
+        async def reply(line):
+            writer.write(line.encode() + b"\r\n")
+            await writer.drain()
+
+        await reply("220 sink ESMTP")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors='replace').strip().upper()
+                if command.startswith(('EHLO', 'HELO')):
+                    await reply("250-sink\r\n250-8BITMIME\r\n250-AUTH PLAIN LOGIN\r\n250 SIZE 52428800")
+                elif command.startswith('AUTH'):
+                    await reply("235 2.7.0 Authentication successful")
+                elif command.startswith('DATA'):
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    while (await reader.readline()) not in (b".\r\n", b".\n", b""):
+                        pass
+                    if self.data_latency:
+                        await asyncio.sleep(self.data_latency)
+                    self.messages += 1
+                    await reply("250 2.0.0 Ok: queued")
+                elif command.startswith('QUIT'):
+                    await reply("221 2.0.0 Bye")
+                    break
+                else:
+                    await reply("250 2.0.0 Ok")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class NullSMTPPool:
+    """Drop-in for services.SMTPPool (ServiceContainer.override(smtp_pool=...)) that only counts messages"""
+
+    def __init__(self):
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    def send_message(self, msg):
+        with self._lock:
+            self.messages += 1
+
+    def close(self):
+        pass
+
+
+def reply_message(in_reply_to, sender='prospect@example.com', to='outreach@example.com', subject='Re: Hello',
+                  auto_reply=False):
+    """Raw reply to the email with Message-ID `in_reply_to`"""
+    auto = "Auto-Submitted: auto-replied\r\n" if auto_reply else ""
+    return (
+        f"From: {sender}\r\nTo: {to}\r\nSubject: {subject}\r\n"
+        f"Date: Mon, 05 Oct 2026 10:00:00 +0000\r\nMessage-ID: <reply.{random.getrandbits(48)}@example.com>\r\n"
+        f"In-Reply-To: {in_reply_to}\r\nReferences: {in_reply_to}\r\n{auto}"
+        f"Content-Type: text/plain\r\n\r\nThanks, tell me more.\r\n"
+    ).encode()
+
+
+def bounce_message(original_message_id, recipient, status='5.1.1', action='failed', to='outreach@example.com',
+                   include_headers=True):
+    """Raw RFC 3464 delivery status notification for the email with Message-ID `original_message_id`"""
+    original = (
+        "--dsn\r\nContent-Type: text/rfc822-headers\r\n\r\n"
+        f"From: {to}\r\nTo: {recipient}\r\nSubject: Hello\r\nMessage-ID: {original_message_id}\r\n\r\n"
+    ) if include_headers else ""
+    return (
+        f"From: Mail Delivery Subsystem <mailer-daemon@example.net>\r\nTo: {to}\r\n"
+        f"Subject: Delivery Status Notification\r\nDate: Mon, 05 Oct 2026 10:00:00 +0000\r\n"
+        f"MIME-Version: 1.0\r\nContent-Type: multipart/report; report-type=delivery-status; boundary=dsn\r\n\r\n"
+        f"--dsn\r\nContent-Type: text/plain\r\n\r\nDelivery to {recipient} {action}.\r\n\r\n"
+        f"--dsn\r\nContent-Type: message/delivery-status\r\n\r\n"
+        f"Reporting-MTA: dns; mx.example.net\r\n\r\n"
+        f"Final-Recipient: rfc822; {recipient}\r\nAction: {action}\r\nStatus: {status}\r\n"
+        f"Diagnostic-Code: smtp; 550 {status} User unknown\r\n\r\n"
+        f"{original}--dsn--\r\n"
+    ).encode()
+
+
+class IMAPStandIn:
+    """
+    Local IMAP4rev1 server on a background thread, enough for imap_tools:
+    LOGIN (any password), SELECT/EXAMINE, STATUS, UID SEARCH by UID set
+    and/or one HEADER field, UID FETCH of BODY.PEEK[HEADER] or BODY.PEEK[],
+    IDLE/DONE and LOGOUT.
+    append() delivers a message and wakes idling clients;
+    reset_uidvalidity() renumbers a folder as a server rebuild would.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, idle=True, folders=('INBOX',)):
+        self.host = host
+        self.port = port
+        self.idle = idle
+        self.folders = {name: {'uidvalidity': 1, 'next_uid': 1, 'messages': {}} for name in folders}
+        self.commands = []
+        self._idlers = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='imap-stand-in', daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(10)
+
+    def append(self, raw, folder='INBOX'):
+        with self._lock:
+            box = self.folders[folder]
+            uid = box['next_uid']
+            box['messages'][uid] = raw
+            box['next_uid'] += 1
+            exists = len(box['messages'])
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._notify, folder, exists)
+        return uid
+
+    def reset_uidvalidity(self, folder='INBOX'):
+        with self._lock:
+            box = self.folders[folder]
+            messages = list(box['messages'].values())
+            box['uidvalidity'] += 1
+            box['messages'] = {uid: raw for uid, raw in enumerate(messages, start=1)}
+            box['next_uid'] = len(messages) + 1
+
+    def _notify(self, folder, exists):
+        for selected, writer in list(self._idlers):
+            if selected == folder:
+                writer.write(f"* {exists} EXISTS\r\n".encode())
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._session, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def _match(self, box, spec):
+        uids = sorted(box['messages'])
+        highest = uids[-1] if uids else 0
+        wanted = set()
+        for part in spec.split(','):
+            first, _, last = part.partition(':')
+            first = highest if first == '*' else int(first)
+            last = first if not last else highest if last == '*' else int(last)
+            low, high = min(first, last), max(first, last)
+            wanted.update(uid for uid in uids if low <= uid <= high)
+        return sorted(wanted)
+
+    async def _session(self, reader, writer):
+        selected = None
+        capabilities = "IMAP4rev1 IDLE" if self.idle else "IMAP4rev1"
+
+        def send(data):
+            writer.write(data if isinstance(data, bytes) else data.encode() + b"\r\n")
+
+        send(f"* OK [CAPABILITY {capabilities}] stand-in ready")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                tag, _, rest = line.decode(errors='replace').strip().partition(' ')
+                command, _, args = rest.partition(' ')
+                command = command.upper()
+                self.commands.append(rest)
+                if command == 'UID':
+                    command, _, args = args.partition(' ')
+                    command = 'UID ' + command.upper()
+                folder_name = args.split(' (')[0].strip().strip('"')
+
+                if command == 'CAPABILITY':
+                    send(f"* CAPABILITY {capabilities}")
+                    send(f"{tag} OK CAPABILITY completed")
+                elif command in ('LOGIN', 'NOOP'):
+                    send(f"{tag} OK {command} completed")
+                elif command in ('SELECT', 'EXAMINE', 'STATUS'):
+                    if folder_name not in self.folders:
+                        send(f"{tag} NO [NONEXISTENT] no such folder")
+                        continue
+                    with self._lock:
+                        box = self.folders[folder_name]
+                        exists, uidnext, uidvalidity = len(box['messages']), box['next_uid'], box['uidvalidity']
+                    if command == 'STATUS':
+                        send(f'* STATUS "{folder_name}" (MESSAGES {exists} UIDNEXT {uidnext} UIDVALIDITY {uidvalidity})')
+                    else:
+                        selected = folder_name
+                        send(f"* {exists} EXISTS")
+                        send("* 0 RECENT")
+                        send(f"* OK [UIDVALIDITY {uidvalidity}] UIDs valid")
+                        send(f"* OK [UIDNEXT {uidnext}] next UID")
+                        send("* FLAGS (\\Seen)")
+                    send(f"{tag} OK {command} completed")
+                elif command == 'UID SEARCH' and selected:
+                    match = re.search(r'\bUID\s+([\d:*,]+)', args, re.I)
+                    header = re.search(r'\bHEADER\s+(\S+)\s+"([^"]*)"', args, re.I)
+                    with self._lock:
+                        box = self.folders[selected]
+                        uids = self._match(box, match.group(1)) if match else sorted(box['messages'])
+                        if header:
+                            needle = f"{header.group(1)}: {header.group(2)}".lower().encode()
+                            uids = [uid for uid in uids if needle in box['messages'][uid].split(b"\r\n\r\n", 1)[0].lower()]
+                    send("* SEARCH" + ''.join(f" {uid}" for uid in uids))
+                    send(f"{tag} OK SEARCH completed")
+                elif command == 'UID FETCH' and selected:
+                    spec, _, items = args.partition(' ')
+                    headers_only = '[HEADER]' in items.upper()
+                    with self._lock:
+                        box = self.folders[selected]
+                        sequence = {uid: number for number, uid in enumerate(sorted(box['messages']), start=1)}
+                        found = [(uid, box['messages'][uid]) for uid in self._match(box, spec)]
+                    for uid, raw in found:
+                        body = raw.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n" if headers_only else raw
+                        section = 'BODY[HEADER]' if headers_only else 'BODY[]'
+                        send(f"* {sequence[uid]} FETCH (UID {uid} FLAGS () RFC822.SIZE {len(raw)} "
+                             f"{section} {{{len(body)}}}\r\n".encode() + body + b")\r\n")
+                    send(f"{tag} OK FETCH completed")
+                elif command == 'IDLE' and self.idle and selected:
+                    entry = (selected, writer)
+                    self._idlers.append(entry)
+                    send("+ idling")
+                    await writer.drain()
+                    done = await reader.readline()
+                    self._idlers.remove(entry)
+                    if not done:
+                        break
+                    send(f"{tag} OK IDLE terminated")
+                elif command == 'LOGOUT':
+                    send("* BYE logging out")
+                    send(f"{tag} OK LOGOUT completed")
+                    await writer.drain()
+                    break
+                else:
+                    send(f"{tag} BAD unsupported command")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,173 @@
+"""
+Shared pieces for the end-to-end benchmarks: an isolated environment,
+seeded campaigns, per-stage timers, commit counting and baseline comparison.
+"""
+import asyncio
+import functools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def configure_env(path, sink_port):
+    """Environment for the app under test; must run before importing app"""
+    os.environ.update({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(path, 'benchmark.db')}",
+        'FLASK_SECRET_KEY': 'benchmark',
+        'LOG_LEVEL': 'WARNING',
+        'SMTP_SERVER': '127.0.0.1',
+        'SMTP_PORT': str(sink_port),
+        'SMTP_STARTTLS': '0',
+        'EMAIL_ADDRESS': 'sender@example.com',
+        'EMAIL_PASSWORD': 'benchmark',
+        'GOOGLE_API_KEY': 'benchmark-placeholder',
+        'EMAILS_PER_HOUR': '1000000',
+        'MIN_DELAY_SECONDS': '0',
+        'MAX_DELAY_SECONDS': '0',
+    })
+
+
+def seed_campaigns(count):
+    """Replace all campaigns with `count` pending AI-mode campaigns"""
+    from models import db, EmailCampaign
+    EmailCampaign.query.delete()
+    db.session.add_all([
+        EmailCampaign(
+            email=f"contact{i}@company{i}.example",
+            subject=f"Partnership {i}",
+            company_name=f"Company {i}",
+            target_person=f"Person {i}",
+            context='IT services and cloud migration',
+            status='pending'
+        )
+        for i in range(count)
+    ])
+    db.session.commit()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(values)) - 1)
+    return values[rank]
+
+
+class StageTimer:
+    """Collects wall-clock durations per named stage"""
+
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def wrap(self, obj, method, stage=None):
+        """Time every call of obj.method (sync or async) under `stage`"""
+        stage = stage or method
+        original = getattr(obj, method)
+
+        if asyncio.iscoroutinefunction(original):
+            @functools.wraps(original)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+        else:
+            @functools.wraps(original)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+
+        setattr(obj, method, timed)
+        return original
+
+    def summary(self):
+        """{stage: {count, p50_ms, p95_ms, p99_ms}}"""
+        return {
+            stage: {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 50) * 1000, 3),
+                'p95_ms': round(percentile(values, 95) * 1000, 3),
+                'p99_ms': round(percentile(values, 99) * 1000, 3),
+            }
+            for stage, values in sorted(self.samples.items())
+        }
+
+
+class CommitCounter:
+    """Counts transaction commits on a SQLAlchemy engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.commits = 0
+        self._engine = engine
+        event.listen(engine, 'commit', self._on_commit)
+
+    def _on_commit(self, conn):
+        self.commits += 1
+
+    def close(self):
+        from sqlalchemy import event
+        event.remove(self._engine, 'commit', self._on_commit)
+
+
+# Metrics compared against a baseline: (path, direction); 'higher' means bigger is better
+DEFAULT_CHECKS = [
+    ('emails_per_second', 'higher'),
+    ('db_commits_per_email', 'lower'),
+]
+
+
+def lookup(report, path):
+    for key in path.split('.'):
+        if not isinstance(report, dict) or key not in report:
+            return None
+        report = report[key]
+    return report
+
+
+def compare_with_baseline(report, baseline, checks, tolerance=0.2):
+    """
+    Compare metrics with a previous run. Returns a list of regressions, each
+    {metric, baseline, current, change}; metrics missing on either side are skipped.
+    """
+    regressions = []
+    for path, direction in checks:
+        old, new = lookup(baseline, path), lookup(report, path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (direction == 'higher' and change < -tolerance) or (direction == 'lower' and change > tolerance):
+            regressions.append({'metric': path, 'baseline': old, 'current': new, 'change': round(change, 3)})
+    return regressions
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
@@ -0,0 +1,129 @@
+"""
+Soak test of the sender loop: RSS must stay flat while it works through many campaigns.
+
+Seeds a throwaway SQLite database with --campaigns pending campaigns carrying a
+large generated_content (the column that used to pile up in the session), then
+runs one sender pass with a zero-latency fake Gemini client. The threaded
+engine sends through an in-memory SMTP pool; the async engine sends to a local
+SMTP sink. A sampler thread records RSS against the number of emails sent.
+Growth is measured from the point where --warmup of the campaigns are done;
+the run exits 1 if it exceeds --max-growth-mb.
+
+Usage (from the repository root):
+    python -m benchmarks.soak_automation [--campaigns 100000] [--engine threaded|async] [--json]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fakes import FakeGenAIClient, NullSMTPPool, SMTPSink
+from benchmarks.harness import configure_env
+
+
+def seed(count, body_size):
+    from datetime import datetime
+    from models import db, EmailCampaign
+    body = 'x' * body_size
+    now = datetime.utcnow()
+    for start in range(0, count, 10000):
+        db.session.execute(db.insert(EmailCampaign), [
+            {'email': f"contact{i}@company{i}.example", 'subject': f"Partnership {i}", 'company_name': f"Company {i}",
+             'target_person': f"Person {i}", 'context': 'IT services and cloud migration', 'status': 'pending',
+             'inline_content': body, 'render_mode': 'ai', 'created_at': now}
+            for i in range(start, min(start + 10000, count))
+        ])
+        db.session.commit()
+
+
+def run_threaded(app):
+    from automated_email_system import EmailAutomation
+    with app.app_context():
+        return EmailAutomation().process_campaigns()
+
+
+def run_async(app):
+    from async_outbound import AsyncOutboundEngine
+
+    async def drain():
+        engine = AsyncOutboundEngine(app)
+        await engine.start()
+        try:
+            return await engine.process_pending()
+        finally:
+            await engine.shutdown()
+
+    return asyncio.run(drain())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--campaigns', type=int, default=100000)
+    parser.add_argument('--engine', choices=['threaded', 'async'], default='threaded')
+    parser.add_argument('--body-size', type=int, default=20000, help='Bytes of generated_content per campaign')
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between RSS samples')
+    parser.add_argument('--warmup', type=float, default=0.1, help='Share of campaigns before growth is measured')
+    parser.add_argument('--max-growth-mb', type=float, default=25.0)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path, SMTPSink() as sink:
+        configure_env(path, sink.port)
+        from app import create_app
+        from models import db
+        from services import get_services, rss_mb
+
+        app = create_app()
+        with app.app_context():
+            db.create_all()
+            seed(args.campaigns, args.body_size)
+        pool = NullSMTPPool()
+        get_services().override(genai_client=FakeGenAIClient(latency=0, jitter=0), smtp_pool=pool)
+
+        samples = []
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(args.interval):
+                samples.append((pool.messages + sink.messages, round(rss_mb(), 1)))
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        processed = (run_threaded if args.engine == 'threaded' else run_async)(app)
+        seconds = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        samples.append((pool.messages + sink.messages, round(rss_mb(), 1)))
+
+    warm = [rss for sent, rss in samples if sent >= args.campaigns * args.warmup] or [samples[-1][1]]
+    report = {
+        'engine': args.engine,
+        'campaigns': args.campaigns,
+        'processed': processed,
+        'sent': samples[-1][0],
+        'seconds': round(seconds, 1),
+        'rss_after_warmup_mb': warm[0],
+        'rss_peak_mb': max(warm),
+        'rss_final_mb': warm[-1],
+        'growth_mb': round(max(warm) - warm[0], 1),
+        'samples': samples,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            if key != 'samples':
+                print(f"{key}: {value}")
+        step = max(1, len(samples) // 10)
+        print("sent/rss_mb: " + ", ".join(f"{sent}/{rss}" for sent, rss in samples[::step]))
+    if report['growth_mb'] > args.max_growth_mb:
+        print(f"RSS grew {report['growth_mb']} MB after warmup (limit {args.max_growth_mb} MB)", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""
+Background generation of AI campaigns added from the web form.
+
+add_campaign saves the campaign as 'generating' and returns right away. A
+GenerationWorker thread then streams the subject and body from the model and
+publishes each chunk to the campaign's GenerationFeed, which the campaigns
+page follows over server-sent events. When the text is complete it is saved
+and the campaign becomes 'pending' for the sender, which sends that body
+as shown rather than generating another. A failure marks it 'failed'. The
+finished body goes to content_store.
+
+Partial text is also written to the row (the body to inline_content) every GENERATION_SAVE_INTERVAL
+seconds. A stream request served by another web process has no feed to
+follow, so it polls the row instead (follow_campaign). Campaigns left
+'generating' by a process that died are picked up again when the next
+worker starts, after GENERATION_STALE_SECONDS.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import or_
+from models import db, EmailCampaign
+import content_store
+import token_usage
+from services import get_services
+from log_pipeline import log_context
+
+logger = logging.getLogger(__name__)
+
+FEED_TTL = 120  # seconds a finished feed stays available to late subscribers
+KEEPALIVE = 15
+
+
+class GenerationFeed:
+    """Events ('subject', 'body', 'done', 'error') of one generation; every subscriber replays from the start"""
+
+    def __init__(self):
+        self.events = []
+        self.finished_at = None
+        self._changed = threading.Condition()
+
+    def publish(self, event, data, final=False):
+        with self._changed:
+            self.events.append((event, data))
+            if final:
+                self.finished_at = time.monotonic()
+            self._changed.notify_all()
+
+    def follow(self, keepalive=KEEPALIVE):
+        """Yield events as they are published, None after `keepalive` quiet seconds; ends after the final event"""
+        position = 0
+        while True:
+            with self._changed:
+                if position == len(self.events) and self.finished_at is None:
+                    self._changed.wait(keepalive)
+                new = self.events[position:]
+                position += len(new)
+                finished = self.finished_at is not None and position == len(self.events)
+            if not new:
+                yield None
+            yield from new
+            if finished:
+                return
+
+
+class GenerationWorker:
+    """Thread pool generating 'generating' campaigns, with a live feed per campaign"""
+
+    def __init__(self, app, workers=None):
+        self.app = app
+        self.save_interval = float(os.getenv('GENERATION_SAVE_INTERVAL', 1.0))
+        self.stale_after = timedelta(seconds=int(os.getenv('GENERATION_STALE_SECONDS', 600)))
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or int(os.getenv('GENERATION_WORKERS', 4)), thread_name_prefix='generation'
+        )
+        self._feeds = {}
+        self._lock = threading.Lock()
+
+    def submit(self, campaign_id):
+        feed = GenerationFeed()
+        with self._lock:
+            now = time.monotonic()
+            for key in [key for key, old in self._feeds.items() if old.finished_at and now - old.finished_at > FEED_TTL]:
+                del self._feeds[key]
+            self._feeds[campaign_id] = feed
+        self.executor.submit(self._run, campaign_id, feed)
+        return feed
+
+    def feed(self, campaign_id):
+        with self._lock:
+            return self._feeds.get(campaign_id)
+
+    def resume_stale(self):
+        """Resubmit campaigns whose generation stopped without finishing (call inside an app context)"""
+        cutoff = datetime.utcnow() - self.stale_after
+        ids = [row.id for row in db.session.query(EmailCampaign.id).filter(
+            EmailCampaign.status == 'generating',
+            or_(EmailCampaign.generation_started_at < cutoff,
+                EmailCampaign.generation_started_at.is_(None) & (EmailCampaign.created_at < cutoff))
+        )]
+        if ids:
+            logger.info("Resuming generation of %s interrupted campaigns", len(ids))
+        for campaign_id in ids:
+            self.submit(campaign_id)
+        return len(ids)
+
+    def _claim(self, campaign_id):
+        # Only one process picks up a stale campaign: the one whose update matches
+        cutoff = datetime.utcnow() - self.stale_after
+        claimed = EmailCampaign.query.filter(
+            EmailCampaign.id == campaign_id,
+            EmailCampaign.status == 'generating',
+            or_(EmailCampaign.generation_started_at.is_(None), EmailCampaign.generation_started_at < cutoff)
+        ).update({'generation_started_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def _run(self, campaign_id, feed):
+        with self.app.app_context(), log_context(campaign_id=campaign_id):
+            try:
+                if not self._claim(campaign_id):
+                    feed.publish('error', {'error': 'Campaign is not waiting for generation'}, final=True)
+                    return
+                self.generate(campaign_id, feed)
+            except Exception as e:
+                logger.error("Error generating campaign %s: %s", campaign_id, e)
+                db.session.rollback()
+                EmailCampaign.query.filter_by(id=campaign_id).update(
+                    # Drop partial text, so a campaign set back to 'pending' is generated again rather than sent half-written
+                    {'status': 'failed', 'inline_content': None}, synchronize_session=False
+                )
+                db.session.commit()
+                feed.publish('error', {'error': str(e)}, final=True)
+            finally:
+                db.session.remove()
+                token_usage.flush()
+
+    def generate(self, campaign_id, feed):
+        campaign = db.session.get(EmailCampaign, campaign_id)
+        automation = get_services().email_automation
+        from automated_email_system import SUBJECT_PROMPT
+        subject_prompt = SUBJECT_PROMPT.format(context=campaign.context)
+        body_prompt = automation.outreach_prompt(campaign.company_name, campaign.context, campaign.target_person)
+        # The prompts are built, so the session is not needed while the model streams
+        db.session.rollback()
+
+        subject = self._stream(automation.stream_content(subject_prompt, 'subject'),
+                               campaign_id, feed, 'subject', 'subject').strip()[:200]
+        body = self._stream(automation.stream_content(body_prompt, 'outreach'),
+                            campaign_id, feed, 'body', EmailCampaign.inline_content).strip()
+        if not subject or not body:
+            raise ValueError('The model returned an empty subject or body')
+        EmailCampaign.query.filter_by(id=campaign_id).update(
+            {'subject': subject, 'content_hash': content_store.put(body), 'inline_content': None, 'status': 'pending'},
+            synchronize_session=False
+        )
+        db.session.commit()
+        logger.info("Generated campaign %s", campaign_id)
+        feed.publish('done', {'status': 'pending', 'subject': subject}, final=True)
+
+    def _stream(self, chunks, campaign_id, feed, event, column):
+        text = ''
+        saved_at = time.monotonic()
+        for chunk in chunks:
+            text += chunk
+            feed.publish(event, {'text': chunk})
+            if time.monotonic() - saved_at >= self.save_interval:
+                value = text[:200] if column == 'subject' else text
+                EmailCampaign.query.filter_by(id=campaign_id).update({column: value}, synchronize_session=False)
+                db.session.commit()
+                saved_at = time.monotonic()
+        return text
+
+
+def follow_campaign(campaign_id, interval=1.0, timeout=600):
+    """Events for a campaign generated by another process, by polling its row (inside an app context)"""
+    shown = {'subject': '', 'body': ''}
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        row = db.session.query(EmailCampaign.subject, EmailCampaign.inline_content, EmailCampaign.content_hash,
+                               EmailCampaign.status).filter_by(id=campaign_id).first()
+        body = content_store.get(row.content_hash) if row is not None and row.content_hash else None
+        # End the read transaction so the next poll sees new commits
+        db.session.rollback()
+        if row is None:
+            yield 'error', {'error': 'Campaign not found'}
+            return
+        changed = False
+        for event, text in (('subject', row.subject or ''), ('body', body or row.inline_content or '')):
+            if text != shown[event]:
+                if text.startswith(shown[event]):
+                    yield event, {'text': text[len(shown[event]):]}
+                else:
+                    yield event, {'text': text, 'replace': True}
+                shown[event] = text
+                changed = True
+        if row.status != 'generating':
+            yield 'done', {'status': row.status, 'subject': row.subject}
+            return
+        if not changed:
+            yield None
+        time.sleep(interval)
+
+
+def server_sent_events(events):
+    """Format (event, data) pairs as text/event-stream; None becomes a keep-alive comment"""
+    for item in events:
+        if item is None:
+            yield ': keep-alive\n\n'
+        else:
+            event, data = item
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
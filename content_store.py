@@ -0,0 +1,199 @@
+"""
+Content-addressed store for large texts: generated email bodies, and later prompts.
+
+put(text) compresses a text and stores it once under its SHA-256, then
+returns the hash. Identical texts share one ContentBlob row. get(hash) and
+get_many(hashes) return the text. Blobs are compressed with zstd when the
+optional zstandard package is installed, otherwise with zlib. Set
+CONTENT_CODEC=zlib to force zlib. Each blob records its codec, so both kinds
+stay readable.
+
+EmailCampaign.generated_content reads and writes through this store.
+EmailCampaign.inline_content is the old uncompressed column. It still holds
+rows that have not been migrated yet and drafts that are being generated.
+
+Usage (from the repository root):
+    python content_store.py migrate [--chunk-size 500]   # move inline bodies into the store
+    python content_store.py prune                        # drop blobs no campaign references
+    python content_store.py stats
+"""
+import os
+import zlib
+import hashlib
+import logging
+import argparse
+from datetime import datetime, timedelta
+from functools import lru_cache
+from sqlalchemy import func, insert
+from models import db, ContentBlob, EmailCampaign
+
+try:
+    import zstandard
+except ImportError:  # Optional: zlib is used without it
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+PRUNE_AGE = timedelta(hours=1)
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def default_codec():
+    codec = os.getenv('CONTENT_CODEC') or ('zstd' if zstandard else 'zlib')
+    if codec == 'zstd' and zstandard is None:
+        raise RuntimeError("CONTENT_CODEC=zstd needs the zstandard package (pip install zstandard)")
+    return codec
+
+
+def compress(text, codec):
+    data = text.encode('utf-8')
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    if codec == 'zlib':
+        return zlib.compress(data, 9)
+    return data
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("This content is zstd-compressed; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    if codec == 'zlib':
+        return zlib.decompress(data).decode('utf-8')
+    return bytes(data).decode('utf-8')
+
+
+def put(text):
+    """Store `text` (a no-op when it is already stored) and return its hash; runs in the caller's transaction"""
+    if text is None:
+        return None
+    key = content_hash(text)
+    codec = default_codec()
+    raw = text.encode('utf-8')
+    data = compress(text, codec)
+    if len(data) >= len(raw):
+        # Short texts do not compress
+        codec, data = 'raw', raw
+    row = {'hash': key, 'codec': codec, 'size': len(raw), 'data': data, 'created_at': datetime.utcnow()}
+    table = ContentBlob.__table__
+    # An existing blob older than this is touched, so prune() cannot delete it under a new reference
+    stale = row['created_at'] - PRUNE_AGE / 2
+    dialect = db.session.connection().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        db.session.execute(dialect_insert(table).values(row).on_conflict_do_update(
+            index_elements=['hash'], set_={'created_at': row['created_at']}, where=table.c.created_at < stale
+        ))
+    elif db.session.get(ContentBlob, key) is None:
+        db.session.execute(insert(table).values(row))
+    else:
+        db.session.execute(table.update().where(table.c.hash == key, table.c.created_at < stale)
+                           .values(created_at=row['created_at']))
+    return key
+
+
+@lru_cache(maxsize=512)
+def _text(data, codec):
+    return decompress(data, codec)
+
+
+def get(key):
+    """The text stored under `key`, or None"""
+    if not key:
+        return None
+    row = db.session.query(ContentBlob.codec, ContentBlob.data).filter(ContentBlob.hash == key).first()
+    # Decompressed texts are cached by their compressed bytes: blobs never change
+    return _text(bytes(row.data), row.codec) if row else None
+
+
+def get_many(keys):
+    """{hash: text} for the stored hashes among `keys`, with one query per 500"""
+    keys = sorted({key for key in keys if key})
+    texts = {}
+    for start in range(0, len(keys), 500):
+        rows = db.session.query(ContentBlob.hash, ContentBlob.codec, ContentBlob.data) \
+            .filter(ContentBlob.hash.in_(keys[start:start + 500]))
+        texts.update((row.hash, decompress(row.data, row.codec)) for row in rows)
+    return texts
+
+
+def migrate(chunk_size=500):
+    """
+    Move campaign bodies from the inline column into the store, a chunk of rows per transaction,
+    so an interrupted run can be restarted. Campaigns still being generated are left alone.
+    Returns the number of campaigns moved.
+    """
+    moved = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(EmailCampaign.id, EmailCampaign.inline_content).filter(
+            EmailCampaign.id > last_id,
+            EmailCampaign.inline_content.isnot(None),
+            EmailCampaign.status != 'generating'
+        ).order_by(EmailCampaign.id).limit(chunk_size).all()
+        if not rows:
+            break
+        for campaign_id, text in rows:
+            EmailCampaign.query.filter_by(id=campaign_id).update(
+                {'content_hash': put(text), 'inline_content': None}, synchronize_session=False
+            )
+        db.session.commit()
+        moved += len(rows)
+        last_id = rows[-1].id
+        logger.info("Moved %s campaign bodies into the content store", moved)
+    return moved
+
+
+def prune(min_age=PRUNE_AGE):
+    """Delete blobs no campaign references; recent ones are kept, as their campaign may not be committed yet"""
+    referenced = db.session.query(EmailCampaign.id).filter(EmailCampaign.content_hash == ContentBlob.hash).exists()
+    deleted = ContentBlob.query.filter(
+        ContentBlob.created_at < datetime.utcnow() - min_age, ~referenced
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def stats():
+    blobs, raw, stored = db.session.query(
+        func.count(ContentBlob.hash), func.sum(ContentBlob.size), func.sum(func.length(ContentBlob.data))
+    ).one()
+    referencing, inline = db.session.query(
+        func.count(EmailCampaign.content_hash), func.count(EmailCampaign.inline_content)
+    ).one()
+    return {
+        'blobs': blobs,
+        'campaigns_in_store': referencing,
+        'campaigns_inline': inline,
+        'raw_bytes': raw or 0,
+        'stored_bytes': stored or 0,
+        'compression_ratio': round((raw or 0) / stored, 2) if stored else None,
+    }
+
+
+if __name__ == '__main__':
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Manage the compressed content store')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subcommands.add_parser('migrate', help='Move inline campaign bodies into the store')
+    migrate_parser.add_argument('--chunk-size', type=int, default=500)
+    subcommands.add_parser('prune', help='Delete blobs no campaign references')
+    subcommands.add_parser('stats', help='Blob count, sizes and compression ratio')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        if args.command == 'migrate':
+            logger.info("Moved %s campaign bodies; reclaim the space with VACUUM", migrate(args.chunk_size))
+        elif args.command == 'prune':
+            logger.info("Deleted %s unreferenced blobs", prune())
+        for key, value in stats().items():
+            print(f"{key}: {value}")
@@ -0,0 +1,218 @@
+import io
+import csv
+import json
+import sys
+import logging
+import argparse
+from datetime import datetime
+import sqlalchemy as sa
+import content_store
+from models import db, EmailCampaign, EmailActivity
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: CSV exports work without it
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Exportable tables and the timestamp used by the start/end filters
+EXPORTS = {
+    'campaigns': (EmailCampaign.__table__, 'created_at'),
+    'activities': (EmailActivity.__table__, 'created_at'),
+}
+FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+# Large columns left out of exports unless asked for
+HEAVY_COLUMNS = {'generated_content', 'template_variables'}
+
+
+def export_columns(kind, include_content=False):
+    table, _ = EXPORTS[kind]
+    return [column for column in table.columns if include_content or column.name not in HEAVY_COLUMNS]
+
+
+def build_query(kind, start=None, end=None, status=None, company=None, include_content=False, raw_datetimes=False):
+    """
+    SELECT for an export; status for activities is 'sent' or 'failed' (logged without a response time).
+    raw_datetimes skips SQLAlchemy's datetime conversion, which on SQLite turns stored text into
+    datetime objects only for the CSV writer to format them back.
+    """
+    if kind not in EXPORTS:
+        raise ValueError(f"Unknown export: {kind}")
+    table, time_column = EXPORTS[kind]
+    columns = export_columns(kind, include_content)
+    if raw_datetimes:
+        columns = [sa.type_coerce(column, sa.String).label(column.name) if isinstance(column.type, sa.DateTime)
+                   else column for column in columns]
+    query = sa.select(*columns)
+    if start:
+        query = query.where(table.c[time_column] >= start)
+    if end:
+        query = query.where(table.c[time_column] < end)
+    if status:
+        if kind == 'activities':
+            if status not in ('sent', 'failed'):
+                raise ValueError("Activity status must be 'sent' or 'failed'")
+            query = query.where(table.c.response_time.isnot(None) if status == 'sent' else table.c.response_time.is_(None))
+        else:
+            query = query.where(table.c.status == status)
+    if company:
+        query = query.where(table.c.company_name.ilike(f"%{company}%"))
+    return query.order_by(table.c.id)
+
+
+def stream_rows(query, chunk_size=10000):
+    """Row chunks from a server-side cursor; only one chunk is held in memory"""
+    result = db.session.execute(query.execution_options(yield_per=chunk_size))
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+
+def resolve_content(chunks, columns):
+    """Fill in generated_content from the content store for campaigns whose body is kept there"""
+    names = [column.name for column in columns]
+    if 'generated_content' not in names:
+        yield from chunks
+        return
+    body, key = names.index('generated_content'), names.index('content_hash')
+    for rows in chunks:
+        texts = content_store.get_many(row[key] for row in rows)
+        if texts:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                row[body] = texts.get(row[key], row[body])
+        yield rows
+
+
+def iter_csv(query, columns, chunk_size=5000):
+    """CSV text, one piece per chunk of rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.name for column in columns])
+    json_columns = [i for i, column in enumerate(columns) if isinstance(column.type, sa.JSON)]
+    for rows in resolve_content(stream_rows(query, chunk_size), columns):
+        if json_columns:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for i in json_columns:
+                    row[i] = json.dumps(row[i]) if row[i] is not None else None
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes back to a generator instead of storing them"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _arrow_schema(columns):
+    types = {
+        sa.Integer: pyarrow.int64(), sa.Float: pyarrow.float64(), sa.DateTime: pyarrow.timestamp('us'),
+        sa.Boolean: pyarrow.bool_(),
+    }
+    fields = []
+    for column in columns:
+        arrow_type = next((value for key, value in types.items() if isinstance(column.type, key)), pyarrow.string())
+        fields.append(pyarrow.field(column.name, arrow_type))
+    return pyarrow.schema(fields)
+
+
+def iter_parquet(query, columns, chunk_size=50000):
+    """Parquet bytes, one row group per chunk of rows"""
+    schema = _arrow_schema(columns)
+    text_columns = {i for i, field in enumerate(schema) if pyarrow.types.is_string(field.type)}
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for rows in resolve_content(stream_rows(query, chunk_size), columns):
+            arrays = []
+            for i, field in enumerate(schema):
+                values = [row[i] for row in rows]
+                if i in text_columns:
+                    # JSON columns come back as dicts; store them as JSON text
+                    values = [value if value is None or isinstance(value, str) else json.dumps(value) for value in values]
+                arrays.append(pyarrow.array(values, type=field.type))
+            writer.write_batch(pyarrow.record_batch(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export(kind, file_format='csv', chunk_size=None, include_content=False, **filters):
+    """Generator of export pieces (str for CSV, bytes for Parquet); call inside an app context"""
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format: {file_format}")
+    if file_format == 'parquet' and pyarrow is None:
+        raise RuntimeError("Parquet exports need pyarrow (pip install pyarrow)")
+    query = build_query(kind, include_content=include_content, raw_datetimes=file_format == 'csv', **filters)
+    columns = export_columns(kind, include_content)
+    if file_format == 'parquet':
+        return iter_parquet(query, columns, chunk_size or 50000)
+    return iter_csv(query, columns, chunk_size or 5000)
+
+
+def parse_filters(args):
+    """start, end, status and company from a mapping of strings (request.args or argparse vars)"""
+    def parse_date(value):
+        return datetime.fromisoformat(value) if value else None
+    return {
+        'start': parse_date(args.get('start')),
+        'end': parse_date(args.get('end')),
+        'status': args.get('status') or None,
+        'company': args.get('company') or None,
+    }
+
+
+if __name__ == '__main__':
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Stream campaigns or activities to CSV or Parquet')
+    parser.add_argument('kind', choices=sorted(EXPORTS))
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--output', default='-', help="File to write, '-' for stdout")
+    parser.add_argument('--start', help='Created at or after (YYYY-MM-DD[THH:MM])')
+    parser.add_argument('--end', help='Created before')
+    parser.add_argument('--status', help="Campaign status, or 'sent'/'failed' for activities")
+    parser.add_argument('--company', help='Company name contains (case-insensitive)')
+    parser.add_argument('--include-content', action='store_true', help='Include generated email bodies')
+    parser.add_argument('--chunk-size', type=int, default=None)
+    args = parser.parse_args()
+
+    with app.app_context():
+        pieces = export(args.kind, args.format, args.chunk_size, args.include_content, **parse_filters(vars(args)))
+        binary = args.format == 'parquet'
+        if args.output == '-':
+            out = sys.stdout.buffer if binary else sys.stdout
+            for piece in pieces:
+                out.write(piece)
+        else:
+            with open(args.output, 'wb' if binary else 'w', newline=None if binary else '') as out:
+                for piece in pieces:
+                    out.write(piece)
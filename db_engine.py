@@ -0,0 +1,240 @@
+"""
+Database engine settings, read-replica routing and pool/query instrumentation.
+
+engine_config() turns DB_* environment variables into Flask-SQLAlchemy
+settings: pool size, overflow, checkout timeout, recycle and pre-ping. It also
+sets driver options that are safe behind the Supabase transaction pooler
+(port 6543, or DB_POOLER_MODE=transaction). In transaction mode a server
+connection belongs to us for one transaction only, so prepared statements
+created on it can vanish or collide. psycopg2 never prepares. psycopg 3 gets
+prepare_threshold=None. SQLAlchemy's compiled-statement cache is client side
+and stays on. Idle connections are recycled sooner in that mode because the
+pooler drops them.
+
+With DATABASE_REPLICA_URL set, SELECTs issued inside replica_reads() (the
+dashboard routes) go to the replica. Flushes and other statements still go to
+the primary. Without a replica everything uses the primary.
+
+instrument() records checkout wait (including connecting) and query latency
+per engine. stats() reports them, and they are served at /api/db_stats.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event, exc, Select, CompoundSelect
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from flask_sqlalchemy.session import Session
+
+logger = logging.getLogger(__name__)
+
+REPLICA = 'replica'
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+class LatencyStats:
+    """Count, mean, max and percentiles over the most recent samples of one timing"""
+
+    def __init__(self, samples=2000):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=samples)
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            self.recent.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            count, total, peak, recent = self.count, self.total, self.max, sorted(self.recent)
+
+        def pct(p):
+            return round(recent[min(len(recent) - 1, int(p / 100 * len(recent)))] * 1000, 2) if recent else None
+
+        return {
+            'count': count,
+            'avg_ms': round(total / count * 1000, 2) if count else None,
+            'p50_ms': pct(50),
+            'p95_ms': pct(95),
+            'p99_ms': pct(99),
+            'max_ms': round(peak * 1000, 2),
+        }
+
+
+class EngineStats:
+    def __init__(self):
+        self.checkout = LatencyStats()
+        self.query = LatencyStats()
+        self.checkout_timeouts = 0
+        self.slow_queries = 0
+        self.engine = None
+
+    def snapshot(self):
+        report = {
+            'checkout_wait': self.checkout.snapshot(),
+            'checkout_timeouts': self.checkout_timeouts,
+            'query_latency': self.query.snapshot(),
+            'slow_queries': self.slow_queries,
+        }
+        pool = self.engine.pool if self.engine is not None else None
+        if isinstance(pool, QueuePool):
+            report['pool'] = {'size': pool.size(), 'checked_out': pool.checkedout(), 'overflow': pool.overflow()}
+        return report
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def engine_stats(name):
+    with _stats_lock:
+        if name not in _stats:
+            _stats[name] = EngineStats()
+        return _stats[name]
+
+
+def stats():
+    """Checkout wait, query latency and pool usage per engine ('primary', 'replica')"""
+    with _stats_lock:
+        items = list(_stats.items())
+    return {name: entry.snapshot() for name, entry in items}
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waited, by pool_logging_name (kept across dispose())"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        entry = engine_stats(self._orig_logging_name or 'primary')
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            entry.checkout_timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            entry.checkout.add(waited)
+            if waited * 1000 > float(os.getenv('DB_SLOW_CHECKOUT_MS', 100)):
+                logger.warning("Waited %.0f ms for a %s connection (%s checked out of %s + %s overflow)",
+                               waited * 1000, self._orig_logging_name, self.checkedout(), self.size(),
+                               self._max_overflow)
+
+
+def pooler_mode(url):
+    """'transaction' behind a transaction-mode pooler, else 'session' (DB_POOLER_MODE overrides)"""
+    mode = os.getenv('DB_POOLER_MODE', 'auto')
+    if mode != 'auto':
+        return mode
+    return 'transaction' if url.get_backend_name() == 'postgresql' and url.port == 6543 else 'session'
+
+
+def engine_options(uri, name='primary'):
+    """create_engine() options for `uri` from the DB_* environment variables"""
+    url = make_url(uri)
+    options = {
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') == '1',
+        'pool_logging_name': name,
+    }
+    if os.getenv('DB_QUERY_CACHE_SIZE'):
+        options['query_cache_size'] = int(os.getenv('DB_QUERY_CACHE_SIZE'))
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # Flask-SQLAlchemy gives in-memory SQLite a single static connection
+        return options
+    transaction = pooler_mode(url) == 'transaction'
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=int(os.getenv('DB_POOL_SIZE', 5)),
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 300 if transaction else 1800)),
+    )
+    if url.get_backend_name() == 'postgresql':
+        connect_args = {'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 10))}
+        if transaction and url.get_driver_name() == 'psycopg':
+            # psycopg 3 prepares statements after 5 executions; the pooler cannot keep them
+            connect_args['prepare_threshold'] = None
+        options['connect_args'] = connect_args
+    return options
+
+
+def engine_config(uri):
+    """Flask-SQLAlchemy config for the primary database and, with DATABASE_REPLICA_URL, the replica bind"""
+    if not uri:
+        return {}
+    config = {'SQLALCHEMY_ENGINE_OPTIONS': engine_options(uri)}
+    replica_uri = os.getenv('DATABASE_REPLICA_URL')
+    if replica_uri:
+        config['SQLALCHEMY_BINDS'] = {REPLICA: {'url': replica_uri, **engine_options(replica_uri, REPLICA)}}
+    return config
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_execute(name):
+    entry = engine_stats(name)
+    threshold = float(os.getenv('DB_SLOW_QUERY_MS', 500)) / 1000
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        entry.query.add(elapsed)
+        if elapsed > threshold:
+            entry.slow_queries += 1
+            logger.warning("Slow query on %s (%.0f ms): %s", name, elapsed * 1000, ' '.join(statement.split())[:200])
+
+    return record
+
+
+def _on_error(context):
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument(engines):
+    """Record query latency on each engine of db.engines (checkout wait is recorded by TimedQueuePool)"""
+    for key, engine in engines.items():
+        name = key or 'primary'
+        engine_stats(name).engine = engine
+        if event.contains(engine, 'before_cursor_execute', _before_execute):
+            continue
+        event.listen(engine, 'before_cursor_execute', _before_execute)
+        event.listen(engine, 'after_cursor_execute', _after_execute(name))
+        event.listen(engine, 'handle_error', _on_error)
+
+
+@contextmanager
+def replica_reads():
+    """Send SELECTs in this block to the read replica, when one is configured; also works as a decorator"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def on_replica(pieces):
+    """Iterate a streamed response body with its queries on the replica"""
+    with replica_reads():
+        yield from pieces
+
+
+class RoutingSession(Session):
+    """db.session class: SELECTs inside replica_reads() use the replica bind, everything else the primary"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _replica_reads.get() and not self._flushing and isinstance(clause, (Select, CompoundSelect)):
+            engine = self._db.engines.get(REPLICA)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,365 @@
+"""
+Queue drain forecast: when will the pending campaigns have been sent?
+
+simulate() runs the real AsyncOutboundEngine batching and AsyncRateLimiter
+over a snapshot of the pending queue, in send_scheduler order, on an event
+loop with a virtual clock. Whenever every task waits on a timer the clock
+jumps to the next one, so days of sending take seconds of wall time. Model
+calls and SMTP sessions are replaced by durations sampled from recent
+observations: outreach call latencies from llm_usage, SMTP times from the
+activity log, and the send failure rate from the last week of daily rollups.
+Without observations it uses FORECAST_GENERATE_SECONDS (default 10) and
+FORECAST_SMTP_SECONDS (default 1). The sender's own database work (tens of
+milliseconds per campaign) is left out; it only shows when neither the rate
+limits nor the model hold sends back. Nothing is written to the database.
+
+The threaded engine (AUTOMATION_ENGINE=threaded, the default) is simulated as
+one campaign at a time with a MIN_DELAY_SECONDS..MAX_DELAY_SECONDS pause after
+each send, as EmailAutomation does. At the hourly cap that sender polls every
+check interval; the simulation resumes as soon as the cap allows, so a forecast
+can be a few minutes early per capped hour.
+
+Sends already made in the last hour are replayed into the rate limiter, so
+the hourly cap starts where the real sender's stands.
+
+The dashboard (/api/forecast) reads the forecast stored in QueueForecast. The
+automation runner holding the lease recomputes it with DrainForecaster, with
+fresh calibration, once it is older than FORECAST_TTL seconds (default 300).
+In between, the ETA is scaled by the number of campaigns still pending.
+
+Usage (from the repository root):
+    python drain_forecast.py [--engine async] [--runs 3] [--json]
+    python drain_forecast.py --emails-per-hour 80 --generate-seconds 4   # what if
+"""
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+import itertools
+import selectors
+import statistics
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import func
+from async_outbound import AsyncOutboundEngine, AsyncRateLimiter
+from activity_rollup import bucket_start
+from models import db, EmailCampaign, EmailActivity, ActivityRollup, LLMUsage, QueueForecast
+from services import get_services
+import send_scheduler
+
+logger = logging.getLogger(__name__)
+
+SAMPLES = 500  # Most recent observations per stage
+FAILURE_WINDOW = timedelta(days=7)
+HORIZON = timedelta(days=365)  # Simulated time after which a forecast stops
+FORECAST_ID = 1
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """Polls instead of blocking, and moves the loop's clock forward by the time it would have blocked"""
+
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if not events:
+            if timeout is None:
+                raise RuntimeError('Simulation stalled: no task is ready and none waits on a timer')
+            self.loop.now += timeout
+        return events
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop on a virtual clock that only moves when every task waits on a timer"""
+
+    TICK = 1 / 1024  # Seconds
+
+    def __init__(self):
+        self.now = 0.0
+        super().__init__(_VirtualSelector(self))
+        # Timers and the clock stay on a grid of exact binary fractions, so no wait is lost to float
+        # rounding: months into a simulation the default nanosecond resolution is below the clock's
+        # float spacing, and a timer due now would never run
+        self._clock_resolution = self.TICK / 2
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback, *args, context=None):
+        return super().call_at(math.ceil(when / self.TICK) * self.TICK, callback, *args, context=context)
+
+
+class Calibration:
+    """Stage durations (seconds) the simulation samples from, and the share of sends that fail"""
+
+    def __init__(self, generate=(), smtp=(), failure_rate=0.0):
+        self.samples = {'generate': len(generate), 'smtp': len(smtp)}
+        self.generate = list(generate) or [float(os.getenv('FORECAST_GENERATE_SECONDS', 10))]
+        self.smtp = list(smtp) or [float(os.getenv('FORECAST_SMTP_SECONDS', 1))]
+        self.failure_rate = failure_rate
+
+    @classmethod
+    def from_database(cls, samples=SAMPLES):
+        """The most recent observations; call inside an app context"""
+        generate = [ms / 1000 for ms, in db.session.query(LLMUsage.latency_ms).filter(
+            LLMUsage.call_site == 'outreach', LLMUsage.latency_ms.isnot(None)
+        ).order_by(LLMUsage.id.desc()).limit(samples)]
+        smtp = [seconds for seconds, in db.session.query(EmailActivity.response_time).filter(
+            EmailActivity.response_time.isnot(None)
+        ).order_by(EmailActivity.id.desc()).limit(samples)]
+        counts = dict(db.session.query(ActivityRollup.status, func.sum(ActivityRollup.count)).filter(
+            ActivityRollup.period == 'day',
+            ActivityRollup.bucket >= bucket_start(datetime.utcnow() - FAILURE_WINDOW, 'day')
+        ).group_by(ActivityRollup.status).all())
+        total = sum(counts.values())
+        return cls(generate, smtp, (counts.get('failed') or 0) / total if total else 0.0)
+
+    def summary(self):
+        return {
+            'generate_seconds_median': round(statistics.median(self.generate), 3),
+            'generate_samples': self.samples['generate'],
+            'smtp_seconds_median': round(statistics.median(self.smtp), 3),
+            'smtp_samples': self.samples['smtp'],
+            'failure_rate': round(self.failure_rate, 4),
+        }
+
+
+def pending_snapshot():
+    """Pending campaigns in send order as plain objects, suppressed ones flagged; call inside an app context"""
+    index = get_services().suppression_index.refresh(recipients=False)
+    rows = db.session.query(
+        EmailCampaign.id, EmailCampaign.email, EmailCampaign.render_mode, EmailCampaign.priority, EmailCampaign.sched_key
+    ).filter(EmailCampaign.status == 'pending').order_by(*send_scheduler.SEND_ORDER).yield_per(10000)
+    return [SimpleNamespace(**row._asdict(), suppressed=bool(index.check(row.email))) for row in rows]
+
+
+def recent_sends(now=None):
+    """Seconds since each email of the last hour was sent, oldest first; call inside an app context"""
+    now = now or datetime.utcnow()
+    # Failed attempts are logged without a response time and do not count against the hourly cap
+    sent = db.session.query(EmailActivity.created_at).filter(
+        EmailActivity.created_at > now - timedelta(hours=1),
+        EmailActivity.response_time.isnot(None)
+    ).order_by(EmailActivity.created_at)
+    return [(now - created_at).total_seconds() for created_at, in sent]
+
+
+class SimulatedEngine(AsyncOutboundEngine):
+    """AsyncOutboundEngine over a queue snapshot, with the database, model and SMTP replaced by sampled durations"""
+
+    def __init__(self, app, campaigns, calibration, engine='async', emails_per_hour=None, seed=None, sent_ago=()):
+        super().__init__(app, db_concurrency=1)
+        if emails_per_hour:
+            self.automation.emails_per_hour = emails_per_hour
+        self.threaded = engine == 'threaded'
+        if self.threaded:
+            # EmailAutomation generates and sends one campaign at a time
+            self.generation_concurrency = 1
+            self.batch_size = 1
+        self.campaigns = iter(campaigns)
+        self.calibration = calibration
+        self.sent_ago = list(sent_ago)
+        self.rng = random.Random(seed)
+        self.sent_at = []
+        self.failed = 0
+        self.suppressed = 0
+
+    async def start(self):
+        await super().start()
+        if self.threaded:
+            # The threaded sender pauses after each send instead (see deliver)
+            self.rate_limiter = AsyncRateLimiter(self.automation.emails_per_hour, 0, 0, send_scheduler.urgent_reserve())
+        if self.sent_ago:
+            # The clock starts at 0 = now: earlier sends still count against the hourly cap, and the
+            # pause after the latest one still runs
+            self.rate_limiter.sent.extend(-ago for ago in self.sent_ago)
+            self.rate_limiter.next_send_at = -self.sent_ago[-1] + self.rng.uniform(
+                self.automation.min_delay, self.automation.max_delay
+            )
+
+    async def db(self, fn, *args):
+        return fn(*args)
+
+    def _load_pending(self, exclude):
+        campaigns = list(itertools.islice(self.campaigns, self.lookahead()))
+        suppressed = {campaign.id for campaign in campaigns if campaign.suppressed}
+        self.suppressed += len(suppressed)
+        return campaigns, suppressed, None
+
+    def _mark_failed(self, campaign_ids):
+        self.failed += len(campaign_ids)
+
+    async def generate(self, campaign, templates):
+        if campaign.render_mode != 'template':
+            async with self.generation_slots:
+                await asyncio.sleep(self.rng.choice(self.calibration.generate))
+        return 'simulated'
+
+    async def deliver(self, campaign, content):
+        await asyncio.sleep(self.rng.choice(self.calibration.smtp))
+        if self.rng.random() < self.calibration.failure_rate:
+            self.failed += 1
+            return
+        self.sent_at.append(self._loop.time())
+        if self.threaded:
+            await asyncio.sleep(self.rng.randint(self.automation.min_delay, self.automation.max_delay))
+
+    async def drain(self, horizon):
+        """Process the whole snapshot; returns False when `horizon` simulated seconds ran out first"""
+        await self.start()
+        try:
+            async with asyncio.timeout(horizon):
+                await self.process_pending()
+            return True
+        except TimeoutError:
+            return False
+        finally:
+            await self.shutdown()
+
+
+def simulate(app, campaigns=None, calibration=None, engine=None, emails_per_hour=None, min_delay=None,
+             max_delay=None, runs=1, seed=None, sent_ago=None):
+    """
+    Forecast the drain of `campaigns` (default: the pending queue) with `runs` simulations;
+    the reported run is the median by drain time. `sent_ago` (default: recent_sends()) seeds
+    the hourly cap. Call inside an app context.
+    """
+    start = time.perf_counter()
+    campaigns = pending_snapshot() if campaigns is None else campaigns
+    calibration = calibration or Calibration.from_database()
+    sent_ago = recent_sends() if sent_ago is None else sent_ago
+    engine = engine or os.getenv('AUTOMATION_ENGINE', 'threaded')
+    simulations = []
+    for run in range(runs):
+        simulation = SimulatedEngine(app, campaigns, calibration, engine, emails_per_hour,
+                                     seed=None if seed is None else seed + run, sent_ago=sent_ago)
+        if min_delay is not None:
+            simulation.automation.min_delay = min_delay
+        if max_delay is not None:
+            simulation.automation.max_delay = max_delay
+        loop = VirtualClockLoop()
+        try:
+            simulation.complete = loop.run_until_complete(simulation.drain(HORIZON.total_seconds()))
+        finally:
+            loop.close()
+        simulation.drain_seconds = simulation.sent_at[-1] if simulation.sent_at else 0.0
+        simulations.append(simulation)
+    simulations.sort(key=lambda simulation: simulation.drain_seconds)
+    median = simulations[len(simulations) // 2]
+    hours = Counter(int(at // 3600) for at in median.sent_at)
+    now = datetime.utcnow()
+    return {
+        'computed_at': now.isoformat(),
+        'engine': engine,
+        'emails_per_hour': median.automation.emails_per_hour,
+        'pending': len(campaigns),
+        'sent_last_hour': len(sent_ago),
+        'sent': len(median.sent_at),
+        'failed': median.failed,
+        'suppressed': median.suppressed,
+        'complete': median.complete,
+        'drain_seconds': round(median.drain_seconds, 1),
+        'drain_seconds_range': [round(simulations[0].drain_seconds, 1), round(simulations[-1].drain_seconds, 1)],
+        'finish_at': (now + timedelta(seconds=median.drain_seconds)).isoformat(),
+        'hourly_sends': [hours.get(hour, 0) for hour in range(max(hours) + 1)] if hours else [],
+        'calibration': calibration.summary(),
+        'wall_seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def live_eta(forecast, pending):
+    """`forecast` plus an ETA from now, scaled to the `pending` campaigns still left"""
+    share = pending / forecast['pending'] if forecast['pending'] else 0.0
+    eta_seconds = round(forecast['drain_seconds'] * share)
+    return dict(forecast, pending_now=pending, eta_seconds=eta_seconds,
+                eta_at=(datetime.utcnow() + timedelta(seconds=eta_seconds)).isoformat())
+
+
+def store_forecast(forecast):
+    row = db.session.get(QueueForecast, FORECAST_ID)
+    if row is None:
+        row = QueueForecast(id=FORECAST_ID)
+        db.session.add(row)
+    row.forecast = forecast
+    row.computed_at = datetime.utcnow()
+    db.session.commit()
+
+
+def latest_forecast():
+    """The stored forecast with a live ETA, or None until a runner has stored one; call inside an app context"""
+    row = db.session.get(QueueForecast, FORECAST_ID)
+    if row is None or row.forecast is None:
+        return None
+    pending = db.session.query(func.count(EmailCampaign.id)).filter(EmailCampaign.status == 'pending').scalar()
+    return live_eta(row.forecast, pending)
+
+
+class DrainForecaster:
+    """Recomputes the stored forecast once it is older than `ttl` seconds; run by the automation runner"""
+
+    def __init__(self, app, ttl=None):
+        self.app = app
+        self.ttl = ttl or int(os.getenv('FORECAST_TTL', 300))
+        self.retry_at = float('-inf')
+
+    def refresh_if_stale(self):
+        """Compute and store a new forecast if the stored one is stale; returns it, or None"""
+        if time.monotonic() < self.retry_at:
+            return None
+        with self.app.app_context():
+            try:
+                computed_at = db.session.query(QueueForecast.computed_at).filter_by(id=FORECAST_ID).scalar()
+                if computed_at and datetime.utcnow() - computed_at < timedelta(seconds=self.ttl):
+                    return None
+                forecast = simulate(self.app)
+                store_forecast(forecast)
+            except Exception as e:
+                db.session.rollback()
+                logger.error("Could not forecast the queue drain: %s", e)
+                self.retry_at = time.monotonic() + self.ttl
+                return None
+        logger.info("Forecast %s pending campaigns to drain in %s s (%s s to compute)",
+                    forecast['pending'], forecast['drain_seconds'], forecast['wall_seconds'])
+        return forecast
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description='Forecast when the pending campaigns will have been sent')
+    parser.add_argument('--engine', choices=['threaded', 'async'], default=None,
+                        help='Sender to simulate (default: AUTOMATION_ENGINE or threaded)')
+    parser.add_argument('--emails-per-hour', type=int, default=None, help='What-if EMAILS_PER_HOUR')
+    parser.add_argument('--min-delay', type=int, default=None, help='What-if MIN_DELAY_SECONDS')
+    parser.add_argument('--max-delay', type=int, default=None, help='What-if MAX_DELAY_SECONDS')
+    parser.add_argument('--generate-seconds', type=float, default=None, help='What-if model call duration')
+    parser.add_argument('--failure-rate', type=float, default=None, help='What-if share of failed sends')
+    parser.add_argument('--runs', type=int, default=1, help='Simulations to run; the median is reported')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        calibration = Calibration.from_database()
+        if args.generate_seconds is not None:
+            calibration.generate = [args.generate_seconds]
+        if args.failure_rate is not None:
+            calibration.failure_rate = args.failure_rate
+        forecast = simulate(app, calibration=calibration, engine=args.engine, emails_per_hour=args.emails_per_hour, min_delay=args.min_delay,
+                            max_delay=args.max_delay, runs=args.runs, seed=args.seed)
+    if args.json:
+        print(json.dumps(forecast, indent=2))
+    else:
+        hourly = forecast.pop('hourly_sends')
+        for key, value in forecast.items():
+            print(f"{key}: {value}")
+        print(f"hourly_sends (first 24 h): {hourly[:24]}")
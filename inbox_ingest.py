@@ -0,0 +1,291 @@
+"""
+Incremental reply and bounce ingestion from the outreach mailbox.
+
+Each folder keeps a (UIDVALIDITY, last UID) watermark in MailboxWatermark, so
+a pass only fetches messages that arrived since the previous one. Headers are
+fetched first; full bodies are fetched only for delivery status notifications,
+which carry the bounce details. Replies are matched to EmailCampaign through
+In-Reply-To/References, bounces through the Message-ID of the original email
+(or its recipient when the DSN omits the original headers), and campaign
+statuses are updated in one batch per fetched chunk, committed together with
+the watermark. Hard-bounced addresses also go on the suppression list.
+
+Usage (from the repository root):
+    python inbox_ingest.py [--once] [--folder INBOX --folder Spam]
+"""
+import os
+import re
+import time
+import logging
+import argparse
+from datetime import datetime, timezone
+from email.parser import HeaderParser
+from email.utils import parseaddr, parsedate_to_datetime
+from dotenv import load_dotenv
+from imap_tools import MailBox, MailBoxUnencrypted
+from sqlalchemy import update
+from models import db, EmailCampaign, MailboxWatermark
+from suppression import suppress
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+MESSAGE_ID_RE = re.compile(r'<[^<>\s]+>')
+STATUS_RE = re.compile(r'\b[245]\.\d{1,3}\.\d{1,3}\b')
+HEADER_MESSAGE_ID_RE = re.compile(r'(?im)^message-id:\s*(<[^<>\s]+>)')
+BOUNCE_SENDERS = ('mailer-daemon', 'postmaster')
+
+
+def message_ids(value):
+    return MESSAGE_ID_RE.findall(str(value or ''))
+
+
+def uid_set(uids):
+    """Compact IMAP sequence set for sorted UIDs, e.g. [1, 2, 3, 7] -> '1:3,7'"""
+    ranges = []
+    for uid in uids:
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(first) if first == last else f"{first}:{last}" for first, last in ranges)
+
+
+def received_at(headers):
+    """Date header as naive UTC, falling back to now"""
+    try:
+        value = parsedate_to_datetime(headers.get('Date'))
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def is_auto_reply(headers):
+    # Out-of-office and other automatic answers are not replies from the prospect (RFC 3834)
+    auto_submitted = (headers.get('Auto-Submitted') or 'no').strip().lower()
+    return auto_submitted != 'no' or headers.get('X-Autoreply') is not None
+
+
+def is_bounce_candidate(headers):
+    if headers.get_content_type() == 'multipart/report':
+        return (headers.get_param('report-type') or '').lower() == 'delivery-status'
+    sender = parseaddr(headers.get('From', ''))[1]
+    return sender.split('@', 1)[0].lower() in BOUNCE_SENDERS
+
+
+def parse_bounce(message):
+    """
+    Original Message-ID, recipient, status and reason from a delivery status notification (RFC 3464).
+    Returns None unless delivery permanently failed: delayed, relayed and delivered reports are ignored.
+    Non-standard bounces without a delivery-status part are read from their text.
+    """
+    action = status = recipient = diagnostic = original_id = None
+    texts = []
+    for part in message.walk():
+        content_type = part.get_content_type()
+        if content_type == 'message/delivery-status':
+            for block in part.get_payload():
+                if block.get('Action') and action is None:
+                    action = block['Action'].strip().lower()
+                    status = (block.get('Status') or '').strip() or None
+                    recipient = parseaddr((block.get('Final-Recipient') or block.get('Original-Recipient') or '')
+                                          .split(';')[-1])[1] or None
+                    diagnostic = ' '.join((block.get('Diagnostic-Code') or '').split(';')[-1].split()) or None
+        elif content_type == 'message/rfc822' and original_id is None:
+            original = part.get_payload(0)
+            original_id = next(iter(message_ids(original.get('Message-ID'))), None)
+            if recipient is None:
+                recipient = parseaddr(original.get('To', ''))[1] or None
+        elif content_type == 'text/rfc822-headers' and original_id is None:
+            original = HeaderParser().parsestr(part.get_payload(decode=True).decode(errors='replace'))
+            original_id = next(iter(message_ids(original.get('Message-ID'))), None)
+        elif content_type == 'text/plain':
+            texts.append((part.get_payload(decode=True) or b'').decode(errors='replace'))
+
+    if action is None:
+        text = '\n'.join(texts)
+        match = STATUS_RE.search(text)
+        status = match.group(0) if match else None
+        action = 'failed' if status and status.startswith('5') else None
+        if original_id is None:
+            match = HEADER_MESSAGE_ID_RE.search(text)
+            original_id = match.group(1) if match else None
+    if action != 'failed':
+        return None
+    return {
+        'message_id': original_id,
+        'recipient': recipient.lower() if recipient else None,
+        'reason': ' '.join(filter(None, [status, diagnostic]))[:255] or None,
+        'at': received_at(message),
+    }
+
+
+class InboxIngester:
+    def __init__(self, host=None, port=None, username=None, password=None, folders=None, ssl=None, batch_size=None):
+        self.host = host or os.getenv('IMAP_SERVER', 'imap.gmail.com')
+        self.ssl = ssl if ssl is not None else os.getenv('IMAP_SSL', '1') != '0'
+        self.port = int(port or os.getenv('IMAP_PORT', 993 if self.ssl else 143))
+        self.username = username or os.getenv('EMAIL_ADDRESS')
+        self.password = password or os.getenv('EMAIL_PASSWORD')
+        self.folders = folders or [folder.strip() for folder in os.getenv('IMAP_FOLDERS', 'INBOX').split(',') if folder.strip()]
+        self.batch_size = int(batch_size or os.getenv('IMAP_BATCH_SIZE', 200))
+        self.idle_timeout = int(os.getenv('IMAP_IDLE_TIMEOUT', 600))  # RFC 2177: re-issue IDLE within 29 minutes
+        self.poll_interval = int(os.getenv('IMAP_POLL_INTERVAL', 60))
+        self.stop_flag = False
+
+    def connect(self):
+        mailbox_class = MailBox if self.ssl else MailBoxUnencrypted
+        return mailbox_class(self.host, self.port).login(self.username, self.password, initial_folder=None)
+
+    def sync(self, mailbox):
+        """One incremental pass over every folder; returns message, reply and bounce counts"""
+        totals = {'messages': 0, 'replied': 0, 'bounced': 0}
+        for folder in self.folders:
+            counts = self.sync_folder(mailbox, folder)
+            for key in totals:
+                totals[key] += counts[key]
+        if totals['messages']:
+            logger.info("Ingested %s messages: %s replies, %s bounces",
+                        totals['messages'], totals['replied'], totals['bounced'])
+        return totals
+
+    def sync_folder(self, mailbox, folder):
+        counts = {'messages': 0, 'replied': 0, 'bounced': 0}
+        status = mailbox.folder.status(folder, ['UIDVALIDITY', 'UIDNEXT'])
+        watermark = db.session.get(MailboxWatermark, folder)
+        if watermark is None:
+            watermark = MailboxWatermark(folder=folder, last_uid=0)
+            db.session.add(watermark)
+        if watermark.uidvalidity != status['UIDVALIDITY']:
+            # UIDs from before a UIDVALIDITY change mean nothing any more: read the folder again
+            if watermark.uidvalidity is not None:
+                logger.warning("UIDVALIDITY of %s changed, re-reading the folder", folder)
+            watermark.uidvalidity = status['UIDVALIDITY']
+            watermark.last_uid = 0
+        last_uid = watermark.last_uid or 0
+        if status.get('UIDNEXT') and status['UIDNEXT'] <= last_uid + 1:
+            db.session.commit()
+            return counts
+
+        mailbox.folder.set(folder)
+        # 'n:*' always matches the highest UID, even when it is below n
+        uids = sorted(uid for uid in map(int, mailbox.uids(f"UID {last_uid + 1}:*")) if uid > last_uid)
+        for start in range(0, len(uids), self.batch_size):
+            batch = uids[start:start + self.batch_size]
+            replied, bounced = self.ingest_batch(mailbox, batch)
+            watermark.last_uid = batch[-1]
+            db.session.commit()
+            counts['messages'] += len(batch)
+            counts['replied'] += replied
+            counts['bounced'] += bounced
+        db.session.commit()
+        return counts
+
+    def ingest_batch(self, mailbox, uids):
+        """Match one chunk of UIDs against campaigns and stage the status updates"""
+        replies = []
+        bounce_uids = []
+        for msg in mailbox.fetch(f"UID {uid_set(uids)}", headers_only=True, mark_seen=False, bulk=True):
+            headers = msg.obj
+            if is_bounce_candidate(headers):
+                bounce_uids.append(int(msg.uid))
+            elif not is_auto_reply(headers):
+                references = message_ids(headers.get('In-Reply-To')) + message_ids(headers.get('References'))[::-1]
+                if references:
+                    replies.append((references, received_at(headers)))
+
+        bounces = []
+        if bounce_uids:
+            for msg in mailbox.fetch(f"UID {uid_set(sorted(bounce_uids))}", mark_seen=False, bulk=True):
+                bounce = parse_bounce(msg.obj)
+                if bounce:
+                    bounces.append(bounce)
+        return self.apply(replies, bounces)
+
+    def apply(self, replies, bounces):
+        ids = {message_id for references, _ in replies for message_id in references}
+        ids.update(bounce['message_id'] for bounce in bounces if bounce['message_id'])
+        by_message_id = {}
+        if ids:
+            rows = db.session.query(EmailCampaign.id, EmailCampaign.email, EmailCampaign.message_id, EmailCampaign.status) \
+                .filter(EmailCampaign.message_id.in_(ids)).all()
+            by_message_id = {row.message_id: row for row in rows}
+
+        # DSNs without the original headers: the most recent email sent to the failed recipient
+        recipients = {bounce['recipient'] for bounce in bounces
+                      if bounce['recipient'] and bounce['message_id'] not in by_message_id}
+        by_recipient = {}
+        if recipients:
+            rows = db.session.query(EmailCampaign.id, EmailCampaign.email, EmailCampaign.status) \
+                .filter(db.func.lower(EmailCampaign.email).in_(recipients), EmailCampaign.status == 'sent') \
+                .order_by(EmailCampaign.sent_at).all()
+            by_recipient = {row.email.lower(): row for row in rows}
+
+        replied = {}
+        for references, at in replies:
+            row = next((by_message_id[message_id] for message_id in references if message_id in by_message_id), None)
+            if row:
+                replied[row.id] = {'id': row.id, 'status': 'replied', 'replied_at': at}
+        bounced = {}
+        bounced_emails = set()
+        for bounce in bounces:
+            row = by_message_id.get(bounce['message_id']) or by_recipient.get(bounce['recipient'])
+            # A reply shows the address works, whatever a late bounce says
+            if row and row.status != 'replied' and row.id not in replied:
+                bounced[row.id] = {'id': row.id, 'status': 'bounced', 'bounced_at': bounce['at'],
+                                   'bounce_reason': bounce['reason']}
+                bounced_emails.add(row.email)
+
+        if replied:
+            db.session.execute(update(EmailCampaign), list(replied.values()))
+        if bounced:
+            db.session.execute(update(EmailCampaign), list(bounced.values()))
+            # Hard-bounced addresses are never mailed again
+            suppress(bounced_emails, 'bounced', source='inbox')
+        return len(replied), len(bounced)
+
+    def run(self, once=False):
+        """Catch up, then wait for new mail with IDLE (or poll when the server lacks it) until stopped"""
+        while not self.stop_flag:
+            try:
+                with self.connect() as mailbox:
+                    supports_idle = 'IDLE' in mailbox.client.capabilities
+                    logger.info("Connected to %s, %s for new mail", self.host, 'IDLE' if supports_idle else 'polling')
+                    while not self.stop_flag:
+                        totals = self.sync(mailbox)
+                        if once:
+                            return totals
+                        if supports_idle:
+                            # IDLE watches the selected folder; other folders are caught up on every wake-up
+                            mailbox.folder.set(self.folders[0])
+                            mailbox.idle.wait(timeout=self.idle_timeout)
+                        else:
+                            self._sleep(self.poll_interval)
+            except Exception as e:
+                db.session.rollback()
+                if once:
+                    raise
+                logger.error("Inbox ingestion error: %s", e)
+                self._sleep(self.poll_interval)
+
+    def _sleep(self, seconds):
+        for _ in range(seconds):
+            if self.stop_flag:
+                return
+            time.sleep(1)
+
+
+if __name__ == '__main__':
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Ingest replies and bounces from the outreach mailbox')
+    parser.add_argument('--once', action='store_true', help='Catch up once and exit instead of waiting for new mail')
+    parser.add_argument('--folder', action='append', dest='folders', help='Folder to read (repeatable, default IMAP_FOLDERS)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        InboxIngester(folders=args.folders).run(once=args.once)
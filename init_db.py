@@ -1,14 +1,38 @@
-from app import app, db
+from app import create_app, db
+from sqlalchemy import inspect, text
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def upgrade_schema():
+    """Add columns and indexes introduced after a table was first created (create_all never alters tables)"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            logger.info("Adding column %s.%s (%s)", table.name, column.name, column_type)
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+        # Indexes declared on columns added above
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                logger.info("Creating index %s", index.name)
+                index.create(bind=db.engine, checkfirst=True)
+
 def init_db():
+    app = create_app()
     with app.app_context():
         logger.info("Creating database tables...")
         db.create_all()
+        upgrade_schema()
         logger.info("Database tables created successfully!")
 
 if __name__ == "__main__":
-    init_db() 
\ No newline at end of file
+    init_db()
@@ -0,0 +1,182 @@
+"""
+Logging off the hot path: the calling thread queues the record, and one
+background thread formats and writes it.
+
+configure_logging() puts a QueueHandler on the root logger. A QueueListener
+writes to stderr, and also to LOG_FILE when set. Output is the usual
+LEVEL:logger:message text, or one JSON object per line with LOG_FORMAT=json.
+Log calls pass their arguments %-style (logger.info("Sent %s", email)).
+Nothing is formatted for records below the level. Records that are written
+get formatted on the writer thread, so pass values that will not change
+afterwards. When the queue (LOG_QUEUE_SIZE) is full, records are dropped and
+counted instead of blocking the caller. Source file/line, thread and process
+are not recorded (LOG_SOURCE_LINES=1 keeps file/line).
+
+Fields set with log_context(campaign_id=...) or passed as extra= are attached
+to every record. They are JSON keys in JSON output and appended as key=value
+in text output. LOG_SAMPLE_RATES (e.g. "automated_email_system.prompts=0.1")
+keeps only that share of a logger's records. By default it samples the
+prompt/response dumps.
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = '%(levelname)s:%(name)s:%(message)s'
+DEFAULT_SAMPLE_RATES = {'automated_email_system.prompts': 0.1}
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_context = ContextVar('log_context', default={})
+_lock = threading.Lock()
+_handler = None
+_listener = None
+
+
+@contextmanager
+def log_context(**fields):
+    """Attach fields (campaign_id=..., job=...) to every record logged in this block, thread or task"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def current_context():
+    """The log_context() fields in effect here"""
+    return _context.get()
+
+
+def record_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS and not key.startswith('_')}
+
+
+class ContextFilter(logging.Filter):
+    """Copies the log_context() fields onto the record in the calling thread, before it is queued"""
+
+    def filter(self, record):
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener and drops records when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Same process: hand the record over as is instead of formatting it here
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            message += ' [' + ' '.join(f"{key}={value}" for key, value in fields.items()) + ']'
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **record_fields(record),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def sample_rates():
+    """Per-logger sampling rates: the defaults, updated from LOG_SAMPLE_RATES ("name=rate,...")"""
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    for item in os.getenv('LOG_SAMPLE_RATES', '').split(','):
+        name, _, rate = item.partition('=')
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def configure_logging(level=None, stream=None):
+    """Route all logging through the background writer; safe to call more than once"""
+    global _handler, _listener
+    with _lock:
+        root = logging.getLogger()
+        root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO'))
+        if _listener is not None:
+            return _handler
+        # Record attributes the formats never show (logging HOWTO, "Optimization"); finding the
+        # caller's file and line is the most expensive part of building a record
+        if os.getenv('LOG_SOURCE_LINES') != '1':
+            logging._srcfile = None
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+        formatter = JsonFormatter() if os.getenv('LOG_FORMAT') == 'json' else TextFormatter(TEXT_FORMAT)
+        outputs = [logging.StreamHandler(stream or sys.stderr)]
+        if os.getenv('LOG_FILE'):
+            outputs.append(logging.FileHandler(os.getenv('LOG_FILE')))
+        for output in outputs:
+            output.setFormatter(formatter)
+
+        _handler = DeferredQueueHandler(queue.Queue(int(os.getenv('LOG_QUEUE_SIZE', 10000))))
+        _handler.addFilter(ContextFilter())
+        # Replaces handlers from an earlier logging.basicConfig()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        for name, rate in sample_rates().items():
+            sampled = logging.getLogger(name)
+            for existing in [f for f in sampled.filters if isinstance(f, SampleFilter)]:
+                sampled.removeFilter(existing)
+            sampled.addFilter(SampleFilter(rate))
+
+        _listener = QueueListener(_handler.queue, *outputs, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        return _handler
+
+
+def stop_logging():
+    """Write out everything still queued and stop the writer thread (registered with atexit)"""
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
+        if _handler.dropped:
+            sys.stderr.write(f"WARNING:{__name__}:Dropped {_handler.dropped} log records (queue full)\n")
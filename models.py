@@ -2,8 +2,10 @@ from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
+from db_engine import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class EmailLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -45,7 +47,48 @@ class EmailCampaign(db.Model):
     status = db.Column(db.String(20), default='pending')
     sent_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    generated_content = db.Column(db.Text)  # AI-generated email body
+    # AI-generated email body, stored compressed in content_store by hash; see the generated_content property
+    content_hash = db.Column(db.String(64), index=True)
+    # Body not (yet) in the content store: rows from before it, and drafts being generated. Deferred: pages never need it
+    inline_content = db.deferred(db.Column('generated_content', db.Text))
+    render_mode = db.Column(db.String(20), default='ai')  # 'ai' or 'template' (local rendering only)
+    template_variables = db.Column(db.JSON)  # Values used to render template-only campaigns
+    message_id = db.Column(db.String(255), index=True)  # Message-ID header of the sent email, matched by inbox_ingest.py
+    replied_at = db.Column(db.DateTime)
+    bounced_at = db.Column(db.DateTime)
+    bounce_reason = db.Column(db.String(255))
+    generation_started_at = db.Column(db.DateTime)  # Set while campaign_generation.py writes a 'generating' campaign
+    # Send order (send_scheduler.py): higher priority first, then the fair-queueing tag within the priority
+    priority = db.Column(db.Integer, default=0)
+    queue = db.Column(db.String(80))  # 'manual' or 'import:<job id>'
+    sched_key = db.Column(db.Float)
+
+    @property
+    def generated_content(self):
+        if self.content_hash:
+            import content_store
+            return content_store.get(self.content_hash)
+        return self.inline_content
+
+    @generated_content.setter
+    def generated_content(self, text):
+        import content_store
+        self.content_hash = content_store.put(text)
+        self.inline_content = None
+
+# Next campaign to send: one seek on (status, priority desc, sched_key, id); send_scheduler.SEND_ORDER
+db.Index('ix_email_campaign_schedule', EmailCampaign.status, EmailCampaign.priority.desc(),
+         EmailCampaign.sched_key, EmailCampaign.id)
+# Virtual time (the smallest pending tag) and untagged pending campaigns
+db.Index('ix_email_campaign_pending_tag', EmailCampaign.status, EmailCampaign.sched_key)
+
+class ContentBlob(db.Model):
+    """A compressed text stored once under its SHA-256 (content_store.py)"""
+    hash = db.Column(db.String(64), primary_key=True)
+    codec = db.Column(db.String(10), nullable=False)  # 'zstd', 'zlib' or 'raw'
+    size = db.Column(db.Integer, nullable=False)  # Uncompressed bytes
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class EmailActivity(db.Model):
     __tablename__ = 'emailAuto'
@@ -77,6 +120,119 @@ class ScenarioTraining(db.Model):
     success_metrics = db.Column(db.JSON)
     learning_insights = db.Column(db.JSON)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
+    outcome_recorded_at = db.Column(db.DateTime, index=True)
+
+    @validates('success_metrics')
+    def _stamp_outcome(self, key, value):
+        # The learning job picks rows up by this timestamp, so an outcome recorded late is still learned
+        if value:
+            self.outcome_recorded_at = datetime.utcnow()
+        return value
+
     def __repr__(self):
-        return f'<ScenarioTraining {self.scenario_type}>' 
\ No newline at end of file
+        return f'<ScenarioTraining {self.scenario_type}>'
+
+class ScenarioIndicator(db.Model):
+    """Indicator phrases learned from feedback, merged with the built-in scenario indicators"""
+    __table_args__ = (db.UniqueConstraint('scenario_type', 'phrase'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    scenario_type = db.Column(db.String(50), nullable=False)
+    phrase = db.Column(db.String(200), nullable=False)
+    source = db.Column(db.String(20), default='feedback')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ScenarioLearningState(db.Model):
+    """Watermark and latest learned insights of the batch learning job, per scenario type"""
+    scenario_type = db.Column(db.String(50), primary_key=True)
+    last_training_id = db.Column(db.Integer, default=0)
+    last_outcome_at = db.Column(db.DateTime)
+    insights = db.Column(db.JSON)
+    rows_learned = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class AutomationControl(db.Model):
+    """Desired runner state written by the web tier, plus the lease held by the active runner"""
+    id = db.Column(db.Integer, primary_key=True)
+    desired_state = db.Column(db.String(20), default='stopped')
+    requested_at = db.Column(db.DateTime)
+    runner_id = db.Column(db.String(120))
+    heartbeat_at = db.Column(db.DateTime)
+
+class QueueForecast(db.Model):
+    """Latest drain forecast of the pending queue, stored by the automation runner (see drain_forecast.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    forecast = db.Column(db.JSON)
+    computed_at = db.Column(db.DateTime)
+
+class ActivityRollup(db.Model):
+    """Activity totals per hour or day bucket, status, sender and recipient domain (see activity_rollup.py)"""
+    __table_args__ = (
+        db.UniqueConstraint('period', 'bucket', 'status', 'sender', 'domain', name='uq_activity_rollup_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(5), nullable=False)  # 'hour' or 'day'
+    bucket = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(10), nullable=False)  # 'sent' or 'failed'
+    sender = db.Column(db.String(120), nullable=False, default='')
+    domain = db.Column(db.String(120), nullable=False, default='')
+    count = db.Column(db.Integer, nullable=False, default=0)
+    response_time_sum = db.Column(db.Float, nullable=False, default=0)
+    response_time_count = db.Column(db.Integer, nullable=False, default=0)
+    response_time_max = db.Column(db.Float)
+
+class MailboxWatermark(db.Model):
+    """Highest IMAP UID ingested per folder, valid only while the folder keeps the same UIDVALIDITY"""
+    folder = db.Column(db.String(255), primary_key=True)
+    uidvalidity = db.Column(db.BigInteger)
+    last_uid = db.Column(db.BigInteger, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Suppression(db.Model):
+    """Addresses and whole domains never to generate for or send to (see suppression.py)"""
+    __table_args__ = (db.UniqueConstraint('kind', 'value', name='uq_suppression_value'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # 'email' or 'domain'
+    value = db.Column(db.String(255), nullable=False)  # lowercased
+    reason = db.Column(db.String(20), nullable=False)  # 'bounced', 'unsubscribed', 'complaint' or 'manual'
+    source = db.Column(db.String(120))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SendJournal(db.Model):
+    """Write-ahead record of each campaign email: claimed before SMTP, settled after (see send_journal.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.String(255), unique=True, nullable=False)
+    campaign_id = db.Column(db.Integer, index=True)
+    recipient = db.Column(db.String(120))
+    state = db.Column(db.String(20), nullable=False, default='claimed', index=True)  # claimed, sent, failed, unconfirmed
+    error = db.Column(db.String(255))
+    claimed_at = db.Column(db.DateTime)
+    confirmed_at = db.Column(db.DateTime)
+
+class SendQueue(db.Model):
+    """A source of campaigns for the send scheduler (send_scheduler.py): manual entries or one import"""
+    name = db.Column(db.String(80), primary_key=True)
+    weight = db.Column(db.Float, nullable=False, default=1.0)  # Share of the send rate among queues with pending campaigns
+    last_tag = db.Column(db.Float, nullable=False, default=0.0)  # Tag of the queue's newest campaign
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class LLMUsage(db.Model):
+    """Tokens and estimated cost of one LLM call (see token_usage.py)"""
+    __tablename__ = 'llm_usage'
+
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    call_site = db.Column(db.String(50), nullable=False, index=True)  # e.g. 'outreach', 'subject', 'scenario_analysis'
+    model = db.Column(db.String(100))
+    input_tokens = db.Column(db.Integer, nullable=False, default=0)
+    output_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cached_tokens = db.Column(db.Integer, default=0)  # Part of input_tokens read from a provider context cache
+    cost_usd = db.Column(db.Float)  # From token_usage price table; None for unknown models
+    estimated = db.Column(db.Boolean, default=False)  # Counted from text length: the response carried no usage
+    campaign_id = db.Column(db.Integer, index=True)
+    import_job = db.Column(db.String(40), index=True)
+    sections = db.Column(db.JSON)  # Estimated input tokens per prompt section, when the prompt was built in sections
+    latency_ms = db.Column(db.Integer)  # Duration of the call, where the caller timed it
+    cache_skipped = db.Column(db.String(30))  # Why a cacheable prompt prefix was sent whole, e.g. 'below_minimum'
@@ -0,0 +1,175 @@
+"""
+Outreach prompts split into a stable prefix and a per-contact suffix.
+
+The prefix holds the instructions and the template catalog. It is the same
+for every contact until the templates or PROMPT_VERSION change. Its version is
+PROMPT_VERSION plus a hash of its text. The suffix holds the recipient
+variables and the contract context. The instructions are stated once; the old
+prompt repeated most of them in a paragraph and again as a list. The prefix
+comes first and never mentions the contact, so providers that cache matching
+prompt prefixes on their own can reuse it.
+
+PromptCache registers a prefix with the provider's context cache
+(client.caches.create) once per model and prefix version. Later calls then
+send only the suffix and reference the cache. The cache is renewed before its
+PROMPT_CACHE_TTL runs out. Prefixes shorter than the model's minimum cache
+size (CACHE_MIN_TOKENS, e.g. 32768 tokens for Gemini 1.5) are not registered,
+since the provider rejects them; PROMPT_CACHE_MIN_TOKENS overrides the minimum.
+The instructions and a handful of templates come to a few thousand tokens, so
+on the default gemini-1.5-pro the prefix is only cached with a very large
+template catalog; on Gemini 2.x models it usually is. Calls sent whole for that
+reason are recorded with cache_skipped='below_minimum' in llm_usage (see
+skip_reason). When a registration fails, or the client has no caches API, full
+prompts are sent for PROMPT_CACHE_RETRY seconds before trying again.
+PROMPT_CACHE=off always sends full prompts.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from token_usage import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+PROMPT_VERSION = 'outreach-2'
+SENDER_COMPANY = 'Enspyre Management Services'
+RENEW_MARGIN = 300  # seconds before expiry a cache is replaced
+# Smallest prefix each model accepts in a context cache, by longest matching model name prefix
+CACHE_MIN_TOKENS = {
+    'gemini-1.5': 32768,
+    'gemini-2.0': 4096,
+    'gemini-2.5-pro': 4096,
+    'gemini-2.5-flash': 1024,
+}
+DEFAULT_CACHE_MIN_TOKENS = 4096
+
+INSTRUCTIONS = f"""You are an expert B2B outreach email writer for {SENDER_COMPANY}. Each request below names a company and a recipient and gives the contract/context. Select the most appropriate template from the list and adapt it into ONLY the main body of an email from {SENDER_COMPANY} to that company.
+
+Rules:
+- Adapt the technical details and bullet points to match the contract/context.
+- Use HTML <ul><li>...</li></ul> for 3 to 5 concise, high-impact bullets.
+- End with a line mentioning the attached capabilities statement (e.g., 'I've attached our capabilities statement for your review.').
+- Fill in all variables. Keep the message concise and professional.
+- Do NOT include a subject line, signature, closing, sender name, title, company, logo, website, or placeholders for these. The signature is added automatically.
+
+"""
+
+
+class OutreachPrompt:
+    """One outreach prompt: `prefix` + `suffix` == `text`; `sections` maps section names to their text"""
+
+    def __init__(self, version, sections, prefix_sections=('instructions', 'templates')):
+        self.version = version
+        self.sections = sections
+        self.prefix = ''.join(text for name, text in sections.items() if name in prefix_sections)
+        self.suffix = ''.join(text for name, text in sections.items() if name not in prefix_sections)
+
+    @property
+    def text(self):
+        return self.prefix + self.suffix
+
+
+@lru_cache(maxsize=16)
+def _prefix_sections(templates):
+    catalog = "\n\n".join(
+        f"Template {i + 1}:\nName: {name}\nDescription: {description}\nContent:\n{(content or '').strip()}"
+        for i, (name, description, content) in enumerate(templates)
+    )
+    sections = {'instructions': INSTRUCTIONS, 'templates': f"Templates:\n{catalog}\n\n"}
+    digest = hashlib.sha256(''.join(sections.values()).encode('utf-8')).hexdigest()[:12]
+    return f"{PROMPT_VERSION}-{digest}", sections
+
+
+def outreach_prompt(company_name, company_info, target_person="", contract_type=None, templates=()):
+    """The outreach prompt for one contact; `templates` have name, description and template_content"""
+    version, prefix = _prefix_sections(tuple((t.name, t.description, t.template_content) for t in templates))
+    return OutreachPrompt(version, {
+        **prefix,
+        'variables': f"""Request:
+- company_name: {company_name}
+- recipient_name: {target_person or 'the recipient'}
+- contract_type: {contract_type or '(extract from context)'}
+- sender_company: {SENDER_COMPANY}
+
+""",
+        'context': f"""Context/Contract Details:
+{company_info}
+""",
+    })
+
+
+class PromptCache:
+    """Provider context caches of prompt prefixes, one per client, model and prefix version"""
+
+    def __init__(self):
+        self.enabled = os.getenv('PROMPT_CACHE', 'auto') != 'off'
+        self.ttl = int(os.getenv('PROMPT_CACHE_TTL', 3600))
+        min_tokens = os.getenv('PROMPT_CACHE_MIN_TOKENS')
+        self.min_tokens = int(min_tokens) if min_tokens else None  # None: the model's own limit
+        self.retry_after = int(os.getenv('PROMPT_CACHE_RETRY', 600))
+        self._entries = {}  # key -> (cache name or None, monotonic time it stops being used)
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._skipped = set()  # (model, prefix version) already logged as too short to cache
+
+    def name_for(self, client, model, prompt):
+        """The provider cache holding `prompt`'s prefix for `model`, registering it if needed; None means send it all"""
+        if not self.enabled or self.skip_reason(model, prompt):
+            return None
+        key = (id(client), model, prompt.version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() < entry[1]:
+                return entry[0]
+            lock = self._locks.setdefault(key, threading.Lock())
+        # One registration per key; other callers wait for it rather than registering duplicates
+        with lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() < entry[1]:
+                return entry[0]
+            entry = self._register(client, model, prompt)
+            with self._lock:
+                self._entries[key] = entry
+            return entry[0]
+
+    def skip_reason(self, model, prompt):
+        """'below_minimum' when caching is on but `prompt`'s prefix is too short for `model`'s cache, else None"""
+        if not self.enabled:
+            return None
+        tokens, minimum = estimate_tokens(prompt.prefix), self.min_tokens_for(model)
+        if tokens >= minimum:
+            return None
+        if (model, prompt.version) not in self._skipped:
+            self._skipped.add((model, prompt.version))
+            logger.info("Not caching prompt prefix %s on %s: about %s tokens, below the model's minimum of %s",
+                        prompt.version, model, tokens, minimum)
+        return 'below_minimum'
+
+    def min_tokens_for(self, model):
+        """PROMPT_CACHE_MIN_TOKENS if set, else the provider's minimum cache size for `model`"""
+        if self.min_tokens is not None:
+            return self.min_tokens
+        name = (model or '').rsplit('/', 1)[-1]
+        matches = [prefix for prefix in CACHE_MIN_TOKENS if name.startswith(prefix)]
+        return CACHE_MIN_TOKENS[max(matches, key=len)] if matches else DEFAULT_CACHE_MIN_TOKENS
+
+    def _register(self, client, model, prompt):
+        caches = getattr(client, 'caches', None)
+        if caches is None:
+            return None, time.monotonic() + self.retry_after
+        try:
+            cache = caches.create(model=model, config={
+                'contents': [prompt.prefix], 'ttl': f"{self.ttl}s", 'display_name': prompt.version,
+            })
+        except Exception as e:
+            logger.warning("Could not cache prompt prefix %s on %s, sending full prompts: %s", prompt.version, model, e)
+            return None, time.monotonic() + self.retry_after
+        logger.info("Cached prompt prefix %s on %s as %s", prompt.version, model, cache.name)
+        return cache.name, time.monotonic() + max(self.ttl - RENEW_MARGIN, self.ttl / 2)
+
+    def invalidate(self, client, model, prompt):
+        """Forget the cache of `prompt`'s prefix (e.g. after the provider rejected it); the next call registers anew"""
+        with self._lock:
+            self._entries.pop((id(client), model, prompt.version), None)
@@ -1,8 +1,17 @@
+import os
+import re
 import openai
 import json
 import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
-from models import db, EmailCampaign
+from types import SimpleNamespace
+from sqlalchemy.exc import IntegrityError
+from models import db, EmailCampaign, ScenarioIndicator, ScenarioTraining
+from scenario_classifier import ScenarioClassifier
+from scenario_index import get_scenario_index
+import token_usage
 
 logger = logging.getLogger(__name__)
 
@@ -27,11 +36,251 @@ class ScenarioAnalyzer:
             }
         }
         
-    def analyze_scenario(self, input_text, additional_context=None):
+        # Inputs classified locally above this confidence skip the LLM classification step
+        self.confidence_threshold = float(os.getenv('SCENARIO_CLASSIFIER_CONFIDENCE', 0.75))
+        # Stored analyses are reused above this similarity; weaker matches become few-shot examples
+        self.reuse_threshold = float(os.getenv('SCENARIO_REUSE_SIMILARITY', 0.95))
+        self.example_threshold = float(os.getenv('SCENARIO_EXAMPLE_SIMILARITY', 0.3))
+        self.load_learned_indicators()
+        self.rebuild_classifier()
+
+    def load_learned_indicators(self):
+        """
+        Merge indicators persisted by learn_from_feedback into the built-in table
+        """
+        try:
+            for indicator in ScenarioIndicator.query.all():
+                scenario = self.scenarios.get(indicator.scenario_type)
+                if scenario and indicator.phrase not in scenario['indicators']:
+                    scenario['indicators'].append(indicator.phrase)
+        except Exception as e:
+            logger.warning("Could not load learned scenario indicators: %s", e)
+
+    def rebuild_classifier(self):
+        """
+        Compile the current indicator table into the local classifier
+        """
+        self.classifier = ScenarioClassifier({
+            scenario_type: scenario['indicators'] for scenario_type, scenario in self.scenarios.items()
+        })
+
+    def add_indicators(self, scenario_type, phrases):
+        """
+        Persist new indicator phrases for a scenario type and rebuild the classifier
+        """
+        scenario = self.scenarios.get(scenario_type)
+        if not scenario:
+            return []
+        if isinstance(phrases, str):
+            phrases = [phrases]
+        added = []
+        for phrase in phrases:
+            if not isinstance(phrase, str):
+                continue
+            phrase = phrase.strip().lower()[:200]
+            if not phrase or phrase in scenario['indicators']:
+                continue
+            scenario['indicators'].append(phrase)
+            try:
+                # A savepoint per phrase: another worker may have stored the same phrase meanwhile
+                with db.session.begin_nested():
+                    db.session.add(ScenarioIndicator(scenario_type=scenario_type, phrase=phrase))
+            except IntegrityError:
+                logger.debug("Indicator %r for %s was already stored by another worker", phrase, scenario_type)
+            added.append(phrase)
+        if added:
+            db.session.commit()
+            self.rebuild_classifier()
+            logger.info("Learned %s new indicator(s) for %s", len(added), scenario_type)
+        return added
+
+    def classify_scenario(self, input_text, additional_context=None):
+        """
+        Classify the input locally using the indicator table
+        """
+        text = f"{input_text}\n{additional_context}" if additional_context else input_text
+        return self.classifier.classify(text)
+
+    def find_similar_scenarios(self, input_text, k=3):
+        """
+        Return [(ScenarioTraining, similarity)] for the most similar stored scenarios
+        """
+        try:
+            index = get_scenario_index()
+            if not index.synced:
+                index.sync()
+            matches = index.search(input_text, k=k)
+            rows = {row.id: row for row in ScenarioTraining.query.filter(
+                ScenarioTraining.id.in_([row_id for row_id, _ in matches])
+            ).all()} if matches else {}
+            return [(rows[row_id], score) for row_id, score in matches if row_id in rows]
+        except Exception as e:
+            logger.error("Error searching similar scenarios: %s", e)
+            return []
+
+    def analyze_with_strategy(self, input_text, additional_context=None):
+        """
+        Return {'analysis', 'strategy', 'reused_from', 'similarity'}, reusing a stored
+        near-identical scenario instead of calling the LLM when one exists
+        """
+        similar = self.find_similar_scenarios(input_text)
+        if similar:
+            best, similarity = similar[0]
+            if similarity >= self.reuse_threshold and best.analysis and best.response_strategy:
+                logger.info("Reusing analysis of scenario %s (similarity %.3f)", best.id, similarity)
+                return {
+                    'analysis': best.analysis,
+                    'strategy': best.response_strategy,
+                    'reused_from': best.id,
+                    'similarity': similarity
+                }
+
+        examples = [row for row, score in similar if score >= self.example_threshold and row.analysis]
+        analysis = self.analyze_scenario(input_text, additional_context, examples=examples)
+        if not analysis:
+            return None
+        strategy = self.generate_response_strategy(analysis, examples=examples)
+        return {
+            'analysis': analysis,
+            'strategy': strategy,
+            'reused_from': None,
+            'similarity': similar[0][1] if similar else None
+        }
+
+    def analyze_batch(self, inputs, max_concurrency=None, save=True):
+        """
+        Analyze many inputs concurrently, yielding one result dict per input as it completes.
+
+        Analysis calls run in a bounded thread pool and each strategy call is submitted
+        as soon as its analysis finishes. Database work (similarity lookups and saving
+        to ScenarioTraining) stays on the calling thread, one commit per finished item.
+        """
+        max_concurrency = max_concurrency or int(os.getenv('SCENARIO_BATCH_CONCURRENCY', 8))
+        items = []
+        for position, item in enumerate(inputs):
+            if isinstance(item, str):
+                item = {'input_text': item}
+            items.append((position, item.get('input_text') or '', item.get('additional_context')))
+
+        pool = ThreadPoolExecutor(max_workers=max_concurrency)
+        try:
+            pending = {}
+            for position, input_text, additional_context in items:
+                if not input_text.strip():
+                    yield {'index': position, 'success': False, 'error': 'Empty input_text'}
+                    continue
+                similar = self.find_similar_scenarios(input_text)
+                if similar and similar[0][1] >= self.reuse_threshold and similar[0][0].analysis and similar[0][0].response_strategy:
+                    best, similarity = similar[0]
+                    yield {
+                        'index': position,
+                        'success': True,
+                        'analysis': best.analysis,
+                        'strategy': best.response_strategy,
+                        'reused_from': best.id,
+                        'similarity': similarity,
+                        'training_id': best.id
+                    }
+                    continue
+                # Detach examples from the session so worker threads never touch it
+                examples = [
+                    SimpleNamespace(input_text=row.input_text, analysis=row.analysis, response_strategy=row.response_strategy)
+                    for row, score in similar if score >= self.example_threshold and row.analysis
+                ]
+                # Copied context: the job's token budget and log fields apply on the worker threads
+                future = pool.submit(contextvars.copy_context().run, self.analyze_scenario, input_text, additional_context, examples)
+                pending[future] = ('analysis', position, input_text, examples, None)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, position, input_text, examples, analysis = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except token_usage.BudgetExceeded as e:
+                        yield {'index': position, 'success': False, 'error': str(e), 'budget_exceeded': True}
+                        continue
+                    except Exception as e:
+                        logger.error("Error in batch %s for item %s: %s", stage, position, e)
+                        result = None
+
+                    if stage == 'analysis':
+                        if not result:
+                            yield {'index': position, 'success': False, 'error': 'Could not analyze scenario'}
+                            continue
+                        # Pipeline: strategy generation starts as soon as this analysis is done
+                        strategy_future = pool.submit(contextvars.copy_context().run, self.generate_response_strategy,
+                                                      result, examples)
+                        pending[strategy_future] = ('strategy', position, input_text, examples, result)
+                        continue
+
+                    training_id = None
+                    if save:
+                        training = self.save_training_data({
+                            'type': analysis.get('scenario_type') or 'unknown',
+                            'input': input_text,
+                            'analysis': analysis,
+                            'strategy': result
+                        })
+                        training_id = training.id if training else None
+                    yield {
+                        'index': position,
+                        'success': True,
+                        'analysis': analysis,
+                        'strategy': result,
+                        'reused_from': None,
+                        'training_id': training_id
+                    }
+        finally:
+            # A disconnected client stops the generator; drop work that has not started yet
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def format_examples(examples, field, limit=1500):
+        """
+        Render stored scenarios as few-shot examples for a prompt
+        """
+        if not examples:
+            return ''
+        blocks = []
+        for row in examples:
+            blocks.append(
+                f"Example input:\n{row.input_text[:limit]}\n"
+                f"Example {field}:\n{json.dumps(getattr(row, field), default=str)[:limit]}"
+            )
+        return "Similar past scenarios for reference:\n\n" + "\n\n".join(blocks)
+
+    @staticmethod
+    def chat(call_site, system, prompt, **parts):
+        """
+        One gpt-4 chat completion held to the current token budget and accounted for; `parts` are
+        named pieces of `prompt` (input, examples) reported as prompt sections, the rest as 'instructions'
+        """
+        messages = [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+        parts = {name: text for name, text in parts.items() if text}
+        instructions = prompt
+        for text in parts.values():
+            instructions = instructions.replace(text, '', 1)
+        model = token_usage.model_for(call_site, messages, "gpt-4")
+        response = openai.chat.completions.create(model=model, messages=messages)
+        token_usage.record(call_site, model, messages, response,
+                           sections={'system': system, **parts, 'instructions': instructions})
+        return response.choices[0].message.content
+
+    def analyze_scenario(self, input_text, additional_context=None, examples=None):
         """
         Analyze the input text to determine the scenario type and extract key information
         """
         try:
+            classification = self.classify_scenario(input_text, additional_context)
+            if classification['scenario_type'] and classification['confidence'] >= self.confidence_threshold:
+                analysis = self.extract_scenario_details(classification['scenario_type'], input_text, additional_context)
+                if analysis is not None:
+                    analysis['scenario_type'] = classification['scenario_type']
+                    analysis['classification'] = classification
+                    return analysis
+
+            examples_text = self.format_examples(examples, 'analysis')
             analysis_prompt = f"""
             Analyze this business opportunity and categorize it:
 
@@ -49,33 +298,86 @@ class ScenarioAnalyzer:
             5. Required Follow-up Information
 
             Format the response as a JSON object with these fields.
+
+            {examples_text}
             """
 
-            response = openai.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are an expert in government contracting and business development, skilled at analyzing business opportunities."},
-                    {"role": "user", "content": analysis_prompt}
-                ]
+            response = self.chat(
+                'scenario_analysis',
+                "You are an expert in government contracting and business development, skilled at analyzing business opportunities.",
+                analysis_prompt, input=input_text, context=additional_context or '', examples=examples_text
             )
 
             # Parse the response
-            analysis = json.loads(response.choices[0].message.content)
+            analysis = json.loads(response)
+            analysis['scenario_type'] = self.normalize_scenario_type(analysis)
             return analysis
 
+        except token_usage.BudgetExceeded:
+            raise
         except Exception as e:
-            logger.error(f"Error analyzing scenario: {str(e)}")
+            logger.error("Error analyzing scenario: %s", e)
             return None
 
-    def generate_response_strategy(self, scenario_analysis):
+    def normalize_scenario_type(self, analysis):
+        """
+        The known scenario type an LLM analysis names, whatever the key is spelled
+        like ("Scenario Type", "scenario_type", "type"); None when it names no known type
+        """
+        for key, value in analysis.items():
+            if re.sub(r'[^a-z]', '', str(key).lower()) in ('scenariotype', 'type') and isinstance(value, str):
+                scenario_type = re.sub(r'[^a-z]+', '_', value.lower()).strip('_')
+                # Exact, or named with a qualifier such as "expiring_contract (recompete)"
+                for known in self.scenarios:
+                    if known in scenario_type:
+                        return known
+        return None
+
+    def extract_scenario_details(self, scenario_type, input_text, additional_context=None):
+        """
+        Extraction-only analysis for inputs whose scenario type is already known
+        """
+        try:
+            required_info = self.scenarios[scenario_type]['required_info']
+            extraction_prompt = f"""
+            This is a {scenario_type} opportunity. Extract the following fields from it:
+            {', '.join(required_info)}, critical_deadlines
+
+            Input Text:
+            {input_text}
+
+            Additional Context (if any):
+            {additional_context or 'None provided'}
+
+            Return a JSON object with fields "Key Information Extracted" (an object with the fields above, null when absent)
+            and "Critical Deadlines".
+            """
+
+            response = self.chat(
+                'scenario_details',
+                "You extract structured facts from government contracting notices.",
+                extraction_prompt, input=input_text, context=additional_context or ''
+            )
+
+            return json.loads(response)
+
+        except token_usage.BudgetExceeded:
+            raise
+        except Exception as e:
+            logger.error("Error extracting %s details: %s", scenario_type, e)
+            return None
+
+    def generate_response_strategy(self, scenario_analysis, examples=None):
         """
         Generate a strategic response based on the scenario analysis
         """
         try:
+            analysis_text = json.dumps(scenario_analysis, indent=2)
+            examples_text = self.format_examples(examples, 'response_strategy')
             strategy_prompt = f"""
             Create a strategic response plan based on this scenario analysis:
 
-            Analysis: {json.dumps(scenario_analysis, indent=2)}
+            Analysis: {analysis_text}
 
             Provide a response strategy that includes:
             1. Key points to address
@@ -85,20 +387,22 @@ class ScenarioAnalyzer:
             5. Risk mitigation approaches
 
             Format the response as a JSON object with these fields.
+
+            {examples_text}
             """
 
-            response = openai.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a senior business development strategist specializing in government contracts."},
-                    {"role": "user", "content": strategy_prompt}
-                ]
+            response = self.chat(
+                'scenario_strategy',
+                "You are a senior business development strategist specializing in government contracts.",
+                strategy_prompt, analysis=analysis_text, examples=examples_text
             )
 
-            return json.loads(response.choices[0].message.content)
+            return json.loads(response)
 
+        except token_usage.BudgetExceeded:
+            raise
         except Exception as e:
-            logger.error(f"Error generating response strategy: {str(e)}")
+            logger.error("Error generating response strategy: %s", e)
             return None
 
     def learn_from_feedback(self, scenario_type, input_text, success_metrics):
@@ -114,32 +418,30 @@ class ScenarioAnalyzer:
             Success Metrics: {json.dumps(success_metrics, indent=2)}
 
             Provide:
-            1. Successful elements to retain
-            2. Areas for improvement
-            3. New patterns identified
-            4. Recommended adjustments
+            1. successful_elements: Successful elements to retain
+            2. areas_for_improvement: Areas for improvement
+            3. new_patterns: Short phrases (2-4 words) that indicate this scenario type in future inputs
+            4. recommended_adjustments: Recommended adjustments
 
             Format the response as a JSON object with these fields.
             """
 
-            response = openai.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are an AI learning specialist focused on improving business development strategies."},
-                    {"role": "user", "content": learning_prompt}
-                ]
+            response = self.chat(
+                'scenario_feedback',
+                "You are an AI learning specialist focused on improving business development strategies.",
+                learning_prompt, input=input_text
             )
 
-            insights = json.loads(response.choices[0].message.content)
+            insights = json.loads(response)
             
-            # Update scenario indicators based on learning
-            if scenario_type in self.scenarios:
-                self.scenarios[scenario_type]['indicators'].extend(insights.get('new_patterns', []))
+            # Update and persist scenario indicators based on learning
+            self.add_indicators(scenario_type, insights.get('new_patterns', []))
             
             return insights
 
         except Exception as e:
-            logger.error(f"Error learning from feedback: {str(e)}")
+            db.session.rollback()
+            logger.error("Error learning from feedback: %s", e)
             return None
 
     def save_training_data(self, scenario_data):
@@ -147,20 +449,22 @@ class ScenarioAnalyzer:
         Save training data for future reference and learning
         """
         try:
-            # Create a new training data entry
-            training_entry = {
-                'scenario_type': scenario_data['type'],
-                'input_text': scenario_data['input'],
-                'analysis': scenario_data['analysis'],
-                'response_strategy': scenario_data['strategy'],
-                'success_metrics': scenario_data['metrics'],
-                'learning_insights': scenario_data['insights'],
-                'timestamp': datetime.utcnow()
-            }
-            
-            # Save to database (implement your database logic here)
-            return True
+            training = ScenarioTraining(
+                scenario_type=scenario_data['type'],
+                input_text=scenario_data['input'],
+                analysis=scenario_data.get('analysis'),
+                response_strategy=scenario_data.get('strategy'),
+                success_metrics=scenario_data.get('metrics') or {},
+                learning_insights=scenario_data.get('insights') or {}
+            )
+            db.session.add(training)
+            db.session.commit()
+
+            # Keep the similarity index current without a full resync
+            get_scenario_index().add(training.id, training.input_text)
+            return training
 
         except Exception as e:
-            logger.error(f"Error saving training data: {str(e)}")
-            return False 
\ No newline at end of file
+            logger.error("Error saving training data: %s", e)
+            db.session.rollback()
+            return None
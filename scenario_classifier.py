@@ -0,0 +1,102 @@
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class AhoCorasick:
+    """Case-insensitive multi-pattern matcher that only reports whole-word matches"""
+
+    def __init__(self, patterns):
+        # patterns: iterable of (phrase, label)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for phrase, label in patterns:
+            self._add(phrase.lower().strip(), label)
+        self._build()
+
+    def _add(self, phrase, label):
+        if not phrase:
+            return
+        node = 0
+        for char in phrase:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = next_node
+        self.output[node].append((phrase, label))
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text):
+        """Yield (phrase, label) for every whole-word occurrence in text"""
+        text = text.lower()
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        length = len(text)
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if not output[node]:
+                continue
+            end = index + 1
+            if end < length and text[end].isalnum():
+                continue
+            for phrase, label in output[node]:
+                start = end - len(phrase)
+                if start == 0 or not text[start - 1].isalnum():
+                    yield phrase, label
+
+
+class ScenarioClassifier:
+    """Scores scenario types by the indicator phrases found in the input"""
+
+    def __init__(self, indicators):
+        # indicators: {scenario_type: [phrase, ...]}
+        self.scenario_types = list(indicators)
+        self.matcher = AhoCorasick(
+            (phrase, scenario_type)
+            for scenario_type, phrases in indicators.items()
+            for phrase in phrases
+        )
+
+    def classify(self, text):
+        """
+        Return {'scenario_type', 'confidence', 'matches'} for the input text.
+        Confidence is the winning type's lead over the runner-up: 1.0 when only
+        one type matches (a single indicator is enough for a short notice), and
+        lower as other types match as well.
+        """
+        matches = {}
+        for phrase, scenario_type in self.matcher.find(text or ''):
+            matches.setdefault(scenario_type, set()).add(phrase)
+
+        if not matches:
+            return {'scenario_type': None, 'confidence': 0.0, 'matches': {}}
+
+        scores = sorted(((len(phrases), scenario_type) for scenario_type, phrases in matches.items()), reverse=True)
+        top_score, top_type = scores[0]
+        runner_up = scores[1][0] if len(scores) > 1 else 0
+
+        margin = (top_score - runner_up) / top_score
+        return {
+            'scenario_type': top_type if top_score > runner_up else None,
+            'confidence': round(margin, 3),
+            'matches': {scenario_type: sorted(phrases) for scenario_type, phrases in matches.items()}
+        }
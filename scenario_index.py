@@ -0,0 +1,197 @@
+import os
+import re
+import zlib
+import math
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def embed_text(text, dimensions):
+    """Hashed word unigram/bigram embedding, L2-normalised"""
+    tokens = TOKEN_PATTERN.findall((text or '').lower())
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    counts = {}
+    for feature in features:
+        counts[feature] = counts.get(feature, 0) + 1
+
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature, count in counts.items():
+        hashed = zlib.crc32(feature.encode('utf-8'))
+        # The top bit picks the sign so collisions cancel out instead of piling up
+        sign = 1.0 if hashed & 0x80000000 else -1.0
+        vector[hashed % dimensions] += sign * (1.0 + math.log(count))
+
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+
+class ScenarioIndex:
+    """
+    Append-only vector index over ScenarioTraining.input_text.
+
+    Each row is one fixed-size (id, vector) record in a single flat file, so
+    inserts only append a record to disk; lookups are one matrix-vector
+    product. Appends take an exclusive flock on the file, so several web
+    workers can share it: each worker reads the records the others appended
+    before writing its own, and before searching when the file has grown.
+    """
+
+    def __init__(self, path, dimensions=128):
+        self.path = path
+        self.dimensions = dimensions
+        self.record = np.dtype([('id', '<i8'), ('vector', '<f4', (dimensions,))])
+        self.records_path = os.path.join(path, f'index_{dimensions}.rec')
+        self.lock = threading.Lock()
+        self.synced = False
+        self._load()
+
+    def _load(self):
+        os.makedirs(self.path, exist_ok=True)
+        for legacy in (f'vectors_{self.dimensions}.f32', f'ids_{self.dimensions}.i64'):
+            # The two-file layout could misalign under concurrent writers; sync() re-indexes from the database
+            if os.path.exists(os.path.join(self.path, legacy)):
+                os.remove(os.path.join(self.path, legacy))
+                logger.info("Removed legacy scenario index file %s", legacy)
+        self.offset = 0  # Bytes of the records file already loaded
+        self.known_ids = set()
+        self._vector_buffer = np.zeros((1024, self.dimensions), dtype=np.float32)
+        self._id_buffer = np.zeros(1024, dtype=np.int64)
+        self._publish(0)
+        self.refresh()
+        logger.info("Loaded scenario index with %s entries from %s", len(self.ids), self.path)
+
+    @contextmanager
+    def _locked(self, mode):
+        with open(self.records_path, 'ab') as f:
+            fcntl.flock(f, mode)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_new(self):
+        """Load records appended since the last read (by this or another process); call under the file lock"""
+        rows = (os.path.getsize(self.records_path) - self.offset) // self.record.itemsize
+        if rows <= 0:
+            return
+        records = np.fromfile(self.records_path, dtype=self.record, count=rows, offset=self.offset)
+        self.offset += rows * self.record.itemsize
+        # Two workers may both have indexed a row they were missing; keep the first record
+        _, fresh = np.unique(records['id'], return_index=True)
+        fresh.sort()
+        if self.known_ids:
+            fresh = fresh[~np.isin(records['id'][fresh], np.fromiter(self.known_ids, dtype=np.int64))]
+        if len(fresh):
+            self._append_memory(records['id'][fresh], records['vector'][fresh])
+
+    def _append_memory(self, ids, vectors):
+        start = len(self.ids)
+        end = start + len(ids)
+        if end > len(self._vector_buffer):
+            # Grow geometrically so appends stay amortised O(1)
+            capacity = max(end, len(self._vector_buffer) * 2)
+            vector_buffer = np.zeros((capacity, self.dimensions), dtype=np.float32)
+            id_buffer = np.zeros(capacity, dtype=np.int64)
+            vector_buffer[:start] = self._vector_buffer[:start]
+            id_buffer[:start] = self._id_buffer[:start]
+            self._vector_buffer, self._id_buffer = vector_buffer, id_buffer
+        self._vector_buffer[start:end] = vectors
+        self._id_buffer[start:end] = ids
+        self._publish(end)
+        self.known_ids.update(ids.tolist())
+
+    def _publish(self, rows):
+        # Vectors first: a concurrent search may then see extra ids but never missing ones
+        self.vectors = self._vector_buffer[:rows]
+        self.ids = self._id_buffer[:rows]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def refresh(self):
+        """Load the records other processes appended"""
+        with self.lock, self._locked(fcntl.LOCK_SH):
+            self._read_new()
+
+    def add(self, row_id, text):
+        """Embed and append one row; already indexed ids are ignored"""
+        self.add_many([(row_id, text)])
+
+    def add_many(self, rows):
+        rows = list(rows)
+        with self.lock, self._locked(fcntl.LOCK_EX) as f:
+            self._read_new()
+            rows = [(row_id, text) for row_id, text in rows if row_id not in self.known_ids]
+            if not rows:
+                return 0
+            size = os.path.getsize(self.records_path)
+            if size % self.record.itemsize:
+                # A crash mid-append left a partial record; drop it so later records stay aligned
+                f.truncate(size - size % self.record.itemsize)
+            records = np.zeros(len(rows), dtype=self.record)
+            records['id'] = [row_id for row_id, _ in rows]
+            records['vector'] = np.vstack([embed_text(text, self.dimensions) for _, text in rows])
+            f.write(records.tobytes())
+            f.flush()
+            self.offset = os.path.getsize(self.records_path)
+            self._append_memory(records['id'], records['vector'])
+            return len(rows)
+
+    def sync(self, batch_size=1000):
+        """Index ScenarioTraining rows that are not in the index, whatever their id (late commits included)"""
+        from models import ScenarioTraining
+        self.refresh()
+        missing = sorted(
+            row_id for row_id, in ScenarioTraining.query.with_entities(ScenarioTraining.id).yield_per(10000)
+            if row_id not in self.known_ids
+        )
+        added = 0
+        for start in range(0, len(missing), batch_size):
+            rows = (ScenarioTraining.query
+                    .with_entities(ScenarioTraining.id, ScenarioTraining.input_text)
+                    .filter(ScenarioTraining.id.in_(missing[start:start + batch_size]))
+                    .all())
+            added += self.add_many(rows)
+        self.synced = True
+        if added:
+            logger.info("Indexed %s new scenario(s)", added)
+        return added
+
+    def search(self, text, k=3):
+        """Return up to k (row_id, similarity) pairs, most similar first"""
+        if os.path.getsize(self.records_path) > self.offset:
+            self.refresh()
+        vectors, ids = self.vectors, self.ids
+        if not len(vectors):
+            return []
+        query = embed_text(text, self.dimensions)
+        scores = vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_scenario_index():
+    """Process-wide scenario index, loaded from disk on first use"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ScenarioIndex(
+                os.getenv('SCENARIO_INDEX_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'scenario_index')),
+                dimensions=int(os.getenv('SCENARIO_INDEX_DIMENSIONS', 128))
+            )
+        return _index
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+from sqlalchemy import and_, func, or_
+from models import db, ScenarioTraining, ScenarioLearningState
+from scenario_analyzer import ScenarioAnalyzer
+import token_usage
+from token_usage import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def format_row(row, max_chars):
+    """Compact one ScenarioTraining row for the learning prompt"""
+    row_id, input_text, success_metrics = row[:3]
+    outcome = json.dumps(success_metrics, default=str)
+    return f"[{row_id}] Input: {(input_text or '')[:max_chars]}\nOutcome: {outcome[:max_chars // 2]}"
+
+
+def pack_rows(rows, token_budget, max_chars_per_row=1200):
+    """
+    Take rows in order until the token budget is used up, skipping rows without an outcome.
+    Returns (entries, last_row): last_row is the last row consumed, rows past the budget wait for the next run.
+    """
+    entries = []
+    used = 0
+    last_row = None
+    for row in rows:
+        if not row[2]:
+            # Nothing to learn yet; recording the outcome later stamps the row past the watermark again
+            last_row = row
+            continue
+        entry = format_row(row, max_chars_per_row)
+        cost = estimate_tokens(entry)
+        if entries and used + cost > token_budget:
+            break
+        entries.append(entry)
+        used += cost
+        last_row = row
+    return entries, last_row
+
+
+def summarise_outcomes(scenario_type, entries, previous_insights=None):
+    """One LLM call summarising many scenario outcomes of the same type"""
+    previous = json.dumps(previous_insights, indent=2) if previous_insights else 'None'
+    outcomes = chr(10).join(entries)
+    learning_prompt = f"""
+    Analyze these {len(entries)} outcomes of {scenario_type} scenarios and provide learning insights:
+
+    Previous Insights (if any):
+    {previous}
+
+    Scenario Outcomes:
+    {outcomes}
+
+    Provide:
+    1. successful_elements: Successful elements to retain
+    2. areas_for_improvement: Areas for improvement
+    3. new_patterns: Short phrases (2-4 words) that indicate this scenario type in future inputs
+    4. recommended_adjustments: Recommended adjustments
+
+    Format the response as a JSON object with these fields.
+    """
+
+    response = ScenarioAnalyzer.chat(
+        'scenario_learning',
+        "You are an AI learning specialist focused on improving business development strategies.",
+        learning_prompt, previous_insights=previous, outcomes=outcomes
+    )
+
+    return json.loads(response)
+
+
+def run_learning_job(analyzer=None, token_budget=None, max_rows_per_type=500):
+    """
+    Learn from ScenarioTraining outcomes recorded since the last run, one LLM call per scenario type.
+    Returns {scenario_type: rows_learned}.
+    """
+    analyzer = analyzer or ScenarioAnalyzer()
+    token_budget = token_budget or int(os.getenv('LEARNING_TOKEN_BUDGET', 6000))
+    states = {state.scenario_type: state for state in ScenarioLearningState.query.all()}
+    scenario_types = [row[0] for row in db.session.query(ScenarioTraining.scenario_type).distinct().all()]
+
+    # Rows saved before outcomes were stamped fall back to their creation time
+    outcome_at = func.coalesce(ScenarioTraining.outcome_recorded_at, ScenarioTraining.created_at)
+
+    learned = {}
+    for scenario_type in scenario_types:
+        state = states.get(scenario_type)
+        if state and state.last_outcome_at:
+            # Keyset on (outcome time, id), so rows stamped in the same instant are not skipped
+            since = or_(outcome_at > state.last_outcome_at,
+                        and_(outcome_at == state.last_outcome_at, ScenarioTraining.id > state.last_training_id))
+        else:
+            # Watermark from before outcome stamping: new rows, plus any outcome recorded since
+            watermark = state.last_training_id if state else 0
+            since = or_(ScenarioTraining.id > (watermark or 0), ScenarioTraining.outcome_recorded_at.isnot(None))
+        rows = (ScenarioTraining.query
+                .with_entities(ScenarioTraining.id, ScenarioTraining.input_text, ScenarioTraining.success_metrics,
+                               outcome_at)
+                .filter(ScenarioTraining.scenario_type == scenario_type, since)
+                .order_by(outcome_at, ScenarioTraining.id)
+                .limit(max_rows_per_type)
+                .all())
+        if not rows:
+            continue
+
+        entries, last_row = pack_rows(rows, token_budget)
+        insights = None
+        if entries:
+            try:
+                insights = summarise_outcomes(scenario_type, entries, state.insights if state else None)
+            except Exception as e:
+                # Leave the watermark alone so these rows are retried on the next run
+                logger.error("Error learning from %s outcomes: %s", scenario_type, e)
+                continue
+            analyzer.add_indicators(scenario_type, insights.get('new_patterns', []))
+
+        if not state:
+            state = ScenarioLearningState(scenario_type=scenario_type, rows_learned=0)
+            db.session.add(state)
+        state.last_training_id = last_row[0]
+        state.last_outcome_at = last_row[3]
+        if insights is not None:
+            state.insights = insights
+        state.rows_learned = (state.rows_learned or 0) + len(entries)
+        state.updated_at = datetime.utcnow()
+        db.session.commit()
+
+        if entries:
+            learned[scenario_type] = len(entries)
+            logger.info("Learned from %s %s outcome(s) up to %s", len(entries), scenario_type, last_row[3])
+
+    return learned
+
+
+if __name__ == '__main__':
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Batch learning job over ScenarioTraining')
+    parser.add_argument('--interval', type=int, default=None, help='Run every N seconds instead of once')
+    parser.add_argument('--budget', type=int, default=None, help='Token budget per scenario type')
+    args = parser.parse_args()
+
+    with app.app_context():
+        while True:
+            result = run_learning_job(token_budget=args.budget)
+            token_usage.flush()
+            logger.info("Learning run finished: %s", result or 'nothing new')
+            db.session.remove()
+            if not args.interval:
+                break
+            time.sleep(args.interval)
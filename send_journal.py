@@ -0,0 +1,137 @@
+"""
+Write-ahead journal of campaign emails.
+
+Each campaign email gets a Message-ID derived from the campaign, so every
+attempt at the same campaign carries the same id. claim() records the id and
+moves the campaign to 'sending' in the same commit, before the SMTP
+transaction starts. confirm() marks both 'sent' as soon as the server
+accepts the message. record_failure() marks a refusal 'failed'. An error
+after the message went on the wire without an SMTP reply is marked
+'unconfirmed', because the server may have accepted the message.
+
+A crash between claim and confirm leaves the entry 'claimed' and the campaign
+'sending'. The campaign is no longer 'pending', so it is neither regenerated
+nor sent again. recover() settles those entries when the runner starts. With
+IMAP_SENT_FOLDER set it looks the Message-ID up in the sent folder; otherwise
+it marks the campaign 'unconfirmed' for review. Setting an unconfirmed or failed
+campaign back to 'pending' retries it with the same Message-ID.
+"""
+import os
+import hashlib
+import logging
+from datetime import datetime
+from models import db, EmailCampaign, SendJournal
+
+logger = logging.getLogger(__name__)
+
+
+def message_id_for(campaign, sender):
+    """Deterministic Message-ID for a campaign (anything with id, email and created_at)"""
+    created_at = campaign.created_at.isoformat() if campaign.created_at else ''
+    digest = hashlib.sha256(f"{campaign.id}:{campaign.email}:{created_at}".encode()).hexdigest()[:24]
+    domain = (sender or 'localhost').rsplit('@', 1)[-1]
+    return f"<{digest}.{campaign.id}@{domain}>"
+
+
+def _set_campaign(campaign_id, **values):
+    EmailCampaign.query.filter_by(id=campaign_id).update(values)
+
+
+def claim(campaign_id, recipient, message_id):
+    """
+    Stage the claim for an email about to be sent; the caller commits before talking to SMTP.
+    Returns False when the journal already has this email as sent or in doubt, in which case
+    the campaign status is brought in line with the journal and nothing must be sent.
+    """
+    entry = SendJournal.query.filter_by(message_id=message_id).first()
+    if entry is not None and entry.state in ('sent', 'claimed'):
+        logger.warning("Not sending %s to %s: journal entry is %s", message_id, recipient, entry.state)
+        _set_campaign(campaign_id, status='sent' if entry.state == 'sent' else 'sending', message_id=message_id)
+        return False
+    if entry is None:
+        entry = SendJournal(message_id=message_id, campaign_id=campaign_id, recipient=recipient)
+        db.session.add(entry)
+    entry.state = 'claimed'
+    entry.claimed_at = datetime.utcnow()
+    entry.confirmed_at = None
+    entry.error = None
+    _set_campaign(campaign_id, status='sending', message_id=message_id)
+    return True
+
+
+def confirm(message_id, at=None):
+    """Stage 'sent' for the journal entry and its campaign"""
+    at = at or datetime.utcnow()
+    entry = SendJournal.query.filter_by(message_id=message_id).first()
+    entry.state = 'sent'
+    entry.confirmed_at = at
+    _set_campaign(entry.campaign_id, status='sent', sent_at=at)
+
+
+def is_refusal(error):
+    # smtplib and aiosmtplib errors carrying an SMTP reply code, or refused recipients
+    return isinstance(getattr(error, 'code', None), int) or hasattr(error, 'recipients')
+
+
+def record_failure(message_id, error, on_wire=True):
+    """
+    Stage the outcome of a failed attempt. Failures before the message went out, and SMTP
+    refusals, are 'failed'; anything else (a dropped connection, a timeout waiting for the
+    reply to DATA) is 'unconfirmed', since the server may have accepted the message.
+    """
+    state = 'failed' if not on_wire or is_refusal(error) else 'unconfirmed'
+    entry = SendJournal.query.filter_by(message_id=message_id, state='claimed').first()
+    if entry is None:
+        return None
+    entry.state = state
+    entry.error = str(error)[:255]
+    _set_campaign(entry.campaign_id, status=state)
+    return state
+
+
+def find_in_sent_folder(message_ids, folder=None):
+    """Message-IDs present in the mailbox's sent folder (IMAP_SENT_FOLDER), or None when not configured"""
+    folder = folder or os.getenv('IMAP_SENT_FOLDER')
+    if not folder:
+        return None
+    from inbox_ingest import InboxIngester
+    found = set()
+    with InboxIngester().connect() as mailbox:
+        mailbox.folder.set(folder)
+        for message_id in message_ids:
+            if mailbox.uids(f'HEADER Message-ID "{message_id}"'):
+                found.add(message_id)
+    return found
+
+
+def recover(lookup=find_in_sent_folder):
+    """
+    Settle entries left 'claimed' by a crash, without regenerating or resending anything.
+    Call before sending resumes (the automation runner does, each time it starts the sender).
+    Returns counts per resulting state.
+    """
+    entries = SendJournal.query.filter_by(state='claimed').order_by(SendJournal.id).all()
+    if not entries:
+        return {}
+    logger.warning("Recovering %s in-doubt sends from the journal", len(entries))
+    try:
+        found = lookup([entry.message_id for entry in entries]) if lookup else None
+    except Exception as e:
+        # Leave them claimed: their campaigns stay 'sending' and are retried at the next start
+        logger.error("Could not check the sent folder, leaving in-doubt sends for later: %s", e)
+        return {'claimed': len(entries)}
+
+    counts = {}
+    for entry in entries:
+        if found is not None and entry.message_id in found:
+            confirm(entry.message_id, at=entry.claimed_at)
+            state = 'sent'
+        else:
+            entry.state = 'unconfirmed'
+            entry.error = 'Interrupted during send' if found is None else 'Interrupted during send, not in the sent folder'
+            _set_campaign(entry.campaign_id, status='unconfirmed')
+            state = 'unconfirmed'
+        counts[state] = counts.get(state, 0) + 1
+        logger.info("Journal entry %s for %s: %s", entry.message_id, entry.recipient, state)
+    db.session.commit()
+    return counts
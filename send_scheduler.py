@@ -0,0 +1,204 @@
+"""
+Send order of pending campaigns: strict priorities, then weighted fair queueing across sources.
+
+Every campaign belongs to a queue: 'manual' for campaigns added by hand, or
+'import:<job>' for one CAB import. Campaigns of a higher priority always go
+first. Within a priority level, queues with pending campaigns share the send
+rate in proportion to their weights. Weights are set per queue kind with
+SCHEDULER_WEIGHTS (default manual=4,import=1), or per queue with the `weight`
+command below, which also respaces the queue's pending campaigns. A campaign
+added by hand during a 5,000-row import is therefore sent after a few of the
+import's campaigns, not after all of them.
+
+The queueing is self-clocked: a new campaign is tagged
+max(its queue's last tag, V) + 1 / weight, where the virtual time V is the
+smallest tag still pending. Campaigns are sent in (priority desc, tag, id)
+order, read from an index, so picking the next one is one index seek however
+large the backlog is. The campaigns added in one flush (such as one import)
+are tagged round-robin across companies. That spreads one company's contacts
+through the import instead of sending them back to back.
+
+SCHEDULER_URGENT_RESERVE keeps that many sends of each hour's EMAILS_PER_HOUR
+budget for 'urgent' campaigns (default 0).
+
+Usage (from the repository root):
+    python send_scheduler.py queues
+    python send_scheduler.py weight import:cab-0123456789ab 2
+    python send_scheduler.py backfill   # tag pending campaigns that have no tag (older rows, bulk inserts)
+"""
+import os
+import logging
+import argparse
+from itertools import zip_longest
+from types import SimpleNamespace
+from sqlalchemy import event, func, update
+from db_engine import RoutingSession
+from models import db, EmailCampaign, SendQueue
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = {'low': -1, 'normal': 0, 'high': 1, 'urgent': 2}
+URGENT = PRIORITIES['urgent']
+MANUAL_QUEUE = 'manual'
+DEFAULT_WEIGHTS = 'manual=4,import=1'
+
+# The order campaigns are sent in; ix_email_campaign_schedule serves it
+SEND_ORDER = (EmailCampaign.priority.desc(), EmailCampaign.sched_key, EmailCampaign.id)
+
+
+def import_queue(job_id):
+    return f"import:{job_id}"
+
+
+def parse_priority(value):
+    """A priority from a form field: a name from PRIORITIES or an integer; 'normal' when empty"""
+    if value in (None, ''):
+        return PRIORITIES['normal']
+    if value in PRIORITIES:
+        return PRIORITIES[value]
+    return int(value)
+
+
+def default_weight(queue):
+    weights = {}
+    for item in os.getenv('SCHEDULER_WEIGHTS', DEFAULT_WEIGHTS).split(','):
+        kind, _, weight = item.partition('=')
+        if weight:
+            weights[kind.strip()] = float(weight)
+    return weights.get(queue.split(':', 1)[0], 1.0)
+
+
+def urgent_reserve():
+    return int(os.getenv('SCHEDULER_URGENT_RESERVE', 0))
+
+
+def min_priority_for(budget_left):
+    """The lowest priority that may use the rest of this hour's send budget (None: any)"""
+    reserve = urgent_reserve()
+    return URGENT if reserve and budget_left <= reserve else None
+
+
+def company_key(company_name, email):
+    return (company_name or '').strip().lower() or (email or '').rsplit('@', 1)[-1].lower()
+
+
+def virtual_time(session):
+    """The smallest pending tag; with nothing pending, the last tag handed out"""
+    tag = session.query(func.min(EmailCampaign.sched_key)).filter(EmailCampaign.status == 'pending').scalar()
+    if tag is None:
+        tag = session.query(func.max(SendQueue.last_tag)).scalar()
+    return tag or 0.0
+
+
+def _interleave(campaigns):
+    """Round-robin across companies, keeping each company's campaigns in their original order"""
+    buckets = {}
+    for campaign in campaigns:
+        buckets.setdefault(company_key(campaign.company_name, campaign.email), []).append(campaign)
+    return [campaign for group in zip_longest(*buckets.values()) for campaign in group if campaign is not None]
+
+
+def assign_tags(session, campaigns):
+    """
+    Set queue (default 'manual') and sched_key on `campaigns` (ORM objects or plain
+    objects with the same attributes), advancing each queue's last tag in `session`
+    """
+    by_queue = {}
+    for campaign in campaigns:
+        campaign.queue = campaign.queue or MANUAL_QUEUE
+        by_queue.setdefault(campaign.queue, []).append(campaign)
+    now = virtual_time(session)
+    for name, members in by_queue.items():
+        queue = session.get(SendQueue, name)
+        if queue is None:
+            queue = SendQueue(name=name, weight=default_weight(name), last_tag=0.0)
+            session.add(queue)
+        # Two writers tagging the same queue at once can hand out equal tags; id breaks the tie
+        tag = max(queue.last_tag or 0.0, now)
+        for campaign in _interleave(members):
+            tag += 1.0 / queue.weight
+            campaign.sched_key = tag
+        queue.last_tag = tag
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def tag_new_campaigns(session, flush_context, instances):
+    """Tag every campaign added through the ORM, in the flush that inserts it"""
+    new = [obj for obj in session.new if isinstance(obj, EmailCampaign) and obj.sched_key is None]
+    if new:
+        assign_tags(session, new)
+
+
+def backfill(chunk_size=5000):
+    """Tag pending campaigns inserted without the ORM or before the scheduler; returns the number tagged"""
+    tagged = 0
+    while True:
+        rows = db.session.query(
+            EmailCampaign.id, EmailCampaign.queue, EmailCampaign.priority,
+            EmailCampaign.company_name, EmailCampaign.email
+        ).filter(EmailCampaign.status == 'pending', EmailCampaign.sched_key.is_(None)) \
+            .order_by(EmailCampaign.id).limit(chunk_size).all()
+        if not rows:
+            return tagged
+        campaigns = [SimpleNamespace(**row._asdict()) for row in rows]
+        assign_tags(db.session, campaigns)
+        db.session.execute(update(EmailCampaign), [
+            {'id': c.id, 'queue': c.queue, 'priority': c.priority or 0, 'sched_key': c.sched_key} for c in campaigns
+        ])
+        db.session.commit()
+        tagged += len(campaigns)
+        logger.info("Tagged %s untagged pending campaigns", tagged)
+
+
+def reweigh(queue, weight):
+    """Change a queue's weight, respacing the tags of its pending campaigns from the virtual time on"""
+    now = virtual_time(db.session)
+    ratio = queue.weight / weight
+    EmailCampaign.query.filter(
+        EmailCampaign.queue == queue.name, EmailCampaign.status == 'pending', EmailCampaign.sched_key > now
+    ).update({'sched_key': now + (EmailCampaign.sched_key - now) * ratio}, synchronize_session=False)
+    if queue.last_tag > now:
+        queue.last_tag = now + (queue.last_tag - now) * ratio
+    queue.weight = weight
+    db.session.commit()
+
+
+def queue_summary():
+    """Pending campaigns, weight and last tag per queue, busiest first"""
+    pending = dict(db.session.query(EmailCampaign.queue, func.count(EmailCampaign.id))
+                   .filter(EmailCampaign.status == 'pending').group_by(EmailCampaign.queue).all())
+    summary = [
+        {'queue': queue.name, 'weight': queue.weight, 'pending': pending.pop(queue.name, 0), 'last_tag': queue.last_tag}
+        for queue in SendQueue.query.all()
+    ]
+    summary += [{'queue': name, 'weight': None, 'pending': count, 'last_tag': None} for name, count in pending.items()]
+    return sorted(summary, key=lambda row: -row['pending'])
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description='Inspect and tune the send queues')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    subcommands.add_parser('queues', help='Pending campaigns and weight per queue')
+    weight_parser = subcommands.add_parser('weight', help="Set one queue's weight")
+    weight_parser.add_argument('queue')
+    weight_parser.add_argument('weight', type=float)
+    subcommands.add_parser('backfill', help='Tag pending campaigns that have no tag')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        if args.command == 'weight':
+            if args.weight <= 0:
+                parser.error('weight must be positive')
+            queue = db.session.get(SendQueue, args.queue)
+            if queue is None:
+                parser.error(f"no queue named {args.queue}")
+            reweigh(queue, args.weight)
+            logger.info("Queue %s now has weight %s", args.queue, args.weight)
+        elif args.command == 'backfill':
+            logger.info("Tagged %s campaigns", backfill())
+        for row in queue_summary():
+            print(f"{row['queue']:<40} pending={row['pending']} weight={row['weight']} last_tag={row['last_tag']}")
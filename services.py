@@ -0,0 +1,235 @@
+import os
+import sys
+import time
+import queue
+import smtplib
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPPool:
+    """Small pool of logged-in SMTP sessions, checked with NOOP before reuse"""
+
+    def __init__(self, host, port, username, password, size=2, idle_timeout=240, starttls=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=60)
+        if self.starttls:
+            server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    @staticmethod
+    def _discard(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _checkout(self):
+        while True:
+            try:
+                server, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.time() - last_used > self.idle_timeout:
+                self._discard(server)
+                continue
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._discard(server)
+
+    def _checkin(self, server):
+        if self._idle.qsize() >= self.size:
+            self._discard(server)
+        else:
+            self._idle.put((server, time.time()))
+
+    @contextmanager
+    def connection(self):
+        """Yield a ready SMTP session; it is returned to the pool unless the block raised"""
+        server = self._checkout()
+        try:
+            yield server
+        except Exception:
+            self._discard(server)
+            raise
+        self._checkin(server)
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(server)
+
+
+def rss_mb():
+    """Resident set size of this process in MB (peak RSS where /proc is unavailable, 0 on Windows)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+        except ImportError:
+            return 0.0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+class ServiceContainer:
+    """
+    Long-lived per-process services. Everything is created on first use so
+    importing the web app stays cheap; warm_up() builds them ahead of traffic.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._genai_client = None
+        self._smtp_pool = None
+        self._template_catalog = None
+        self._email_automation = None
+        self._suppression_index = None
+        self._generation_worker = None
+        self._prompt_cache = None
+        self._attachments = {}
+
+    def override(self, **services):
+        """Replace services (e.g. genai_client=FakeClient()) for benchmarks and local runs"""
+        with self._lock:
+            for name, service in services.items():
+                if not hasattr(self, f'_{name}'):
+                    raise AttributeError(f"Unknown service: {name}")
+                setattr(self, f'_{name}', service)
+
+    @property
+    def genai_client(self):
+        with self._lock:
+            if self._genai_client is None:
+                import google.genai as genai
+                self._genai_client = genai.Client(
+                    api_key=os.getenv('GOOGLE_API_KEY'),
+                    http_options=genai.types.HttpOptions(api_version='v1')
+                )
+            return self._genai_client
+
+    @property
+    def smtp_pool(self):
+        with self._lock:
+            if self._smtp_pool is None:
+                self._smtp_pool = SMTPPool(
+                    os.getenv('SMTP_SERVER'),
+                    int(os.getenv('SMTP_PORT', 587)),
+                    os.getenv('EMAIL_ADDRESS'),
+                    os.getenv('EMAIL_PASSWORD'),
+                    size=int(os.getenv('SMTP_POOL_SIZE', 2)),
+                    starttls=os.getenv('SMTP_STARTTLS', '1') == '1'
+                )
+            return self._smtp_pool
+
+    @property
+    def template_catalog(self):
+        with self._lock:
+            if self._template_catalog is None:
+                from template_renderer import TemplateCatalog
+                self._template_catalog = TemplateCatalog()
+            return self._template_catalog
+
+    @property
+    def email_automation(self):
+        """Shared EmailAutomation used by web requests for generation (not for the sender loop)"""
+        with self._lock:
+            if self._email_automation is None:
+                from automated_email_system import EmailAutomation
+                self._email_automation = EmailAutomation()
+            return self._email_automation
+
+    @property
+    def suppression_index(self):
+        """Process-wide SuppressionIndex; call refresh() on it (inside an app context) before checking"""
+        with self._lock:
+            if self._suppression_index is None:
+                from suppression import SuppressionIndex
+                self._suppression_index = SuppressionIndex()
+            return self._suppression_index
+
+    @property
+    def generation_worker(self):
+        """Background generator of web-added campaigns; first used inside a request, whose app it keeps"""
+        with self._lock:
+            if self._generation_worker is None:
+                from flask import current_app
+                from campaign_generation import GenerationWorker
+                self._generation_worker = GenerationWorker(current_app._get_current_object())
+                self._generation_worker.resume_stale()
+            return self._generation_worker
+
+    @property
+    def prompt_cache(self):
+        """Provider-side caches of outreach prompt prefixes (prompt_builder.PromptCache)"""
+        with self._lock:
+            if self._prompt_cache is None:
+                from prompt_builder import PromptCache
+                self._prompt_cache = PromptCache()
+            return self._prompt_cache
+
+    def attachment(self, path):
+        """Attachment bytes, read from disk once per process"""
+        with self._lock:
+            if path not in self._attachments:
+                with open(path, 'rb') as f:
+                    self._attachments[path] = f.read()
+            return self._attachments[path]
+
+    def warm_up(self, app=None, connect_smtp=False):
+        """Create clients, import heavy modules and compile templates before the first request"""
+        start = time.time()
+        try:
+            self.genai_client
+        except Exception as e:
+            # Missing credentials should not stop the web app from starting
+            logger.warning("Could not create the Google Generative AI client: %s", e)
+        import openai  # noqa: F401  (imported for its side effect of loading the SDK)
+        import pandas  # noqa: F401
+        self.email_automation
+        if app is not None:
+            with app.app_context():
+                from models import EmailTemplate
+                for template in EmailTemplate.query.all():
+                    self.template_catalog.get(template)
+        if connect_smtp and os.getenv('SMTP_SERVER'):
+            with self.smtp_pool.connection():
+                pass
+        logger.info("Services warmed up in %.2fs", time.time() - start)
+
+    def close(self):
+        with self._lock:
+            if self._smtp_pool is not None:
+                self._smtp_pool.close()
+            if self._generation_worker is not None:
+                self._generation_worker.executor.shutdown(wait=False)
+
+
+_services = ServiceContainer()
+
+
+def get_services():
+    """The process-wide service container"""
+    return _services
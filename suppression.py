@@ -0,0 +1,198 @@
+"""
+Suppression list: addresses and domains that must not be generated for or sent to.
+
+The Suppression table is the source of truth. SuppressionIndex keeps it in
+memory as hash maps, together with the set of addresses that already have a
+campaign, so intake and the sender check an address without a query. refresh()
+costs one aggregate query per table and loads only rows added since the last
+call; a table that lost rows is reloaded in full.
+
+Usage (from the repository root):
+    python suppression.py add someone@example.com example.org --reason unsubscribed
+    python suppression.py import optouts.txt --reason unsubscribed
+    python suppression.py remove someone@example.com
+    python suppression.py check someone@example.com
+"""
+import csv
+import logging
+import argparse
+import threading
+from sqlalchemy import func
+from models import db, Suppression, EmailCampaign
+
+logger = logging.getLogger(__name__)
+
+REASONS = ('bounced', 'unsubscribed', 'complaint', 'manual')
+REASON_LABELS = {
+    'bounced': 'bounced',
+    'unsubscribed': 'opted out',
+    'complaint': 'reported a complaint',
+    'manual': 'is on the suppression list',
+    'duplicate': 'already has a campaign',
+}
+
+
+def normalize(value):
+    return str(value or '').strip().lower()
+
+
+def value_kind(value):
+    return 'email' if '@' in value else 'domain'
+
+
+class SuppressionIndex:
+    """Suppressed emails and domains plus known campaign recipients, in memory"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.emails = {}  # address -> reason
+        self.domains = {}  # domain -> reason
+        self.recipients = set()
+        self._suppression_mark = (0, 0)  # (max id, row count) loaded so far
+        self._recipient_mark = (0, 0)
+
+    def refresh(self, recipients=True):
+        """
+        Pick up suppressions and campaigns added since the last refresh; call inside an app context.
+        Send-time checks pass recipients=False: they never ask about existing campaigns.
+        """
+        with self._lock:
+            self._suppression_mark = self._sync(
+                Suppression, self._suppression_mark, self._reset_suppressions, self._load_suppressions)
+            if recipients:
+                self._recipient_mark = self._sync(
+                    EmailCampaign, self._recipient_mark, self.recipients.clear, self._load_recipients)
+        return self
+
+    @staticmethod
+    def _sync(model, mark, reset, load):
+        max_id, count = db.session.query(func.max(model.id), func.count(model.id)).one()
+        max_id = max_id or 0
+        last_id, last_count = mark
+        if (max_id, count) == mark:
+            return mark
+        if max_id >= last_id and count >= last_count:
+            added = load(last_id)
+            if last_count + added == count:
+                return max_id, count
+        # Rows were deleted: start over
+        logger.info("Reloading %s into the suppression index", model.__tablename__)
+        reset()
+        load(0)
+        return max_id, count
+
+    def _reset_suppressions(self):
+        self.emails = {}
+        self.domains = {}
+
+    def _load_suppressions(self, after_id):
+        rows = db.session.query(Suppression.kind, Suppression.value, Suppression.reason) \
+            .filter(Suppression.id > after_id).all()
+        for kind, value, reason in rows:
+            (self.emails if kind == 'email' else self.domains)[value] = reason
+        return len(rows)
+
+    def _load_recipients(self, after_id):
+        result = db.session.execute(
+            db.select(EmailCampaign.email).where(EmailCampaign.id > after_id).execution_options(yield_per=50000)
+        )
+        added = 0
+        for emails in result.scalars().partitions():
+            self.recipients.update(email.strip().lower() for email in emails if email)
+            added += len(emails)
+        return added
+
+    def check(self, email, contacted=False):
+        """Why `email` must be skipped, or None. With contacted, an address that already has a campaign is 'duplicate'."""
+        email = normalize(email)
+        reason = self.emails.get(email)
+        if reason:
+            return reason
+        if self.domains:
+            # example.com also covers mail.example.com
+            domain = email.rpartition('@')[2]
+            while domain:
+                reason = self.domains.get(domain)
+                if reason:
+                    return reason
+                domain = domain.partition('.')[2]
+        if contacted and email in self.recipients:
+            return 'duplicate'
+        return None
+
+    def screen(self, emails):
+        """Skip reason (or None) per address of an import; repeats within the import are 'duplicate'"""
+        seen = set()
+        reasons = []
+        for email in emails:
+            email = normalize(email)
+            reason = self.check(email, contacted=True)
+            if reason is None and email in seen:
+                reason = 'duplicate'
+            seen.add(email)
+            reasons.append(reason)
+        return reasons
+
+
+def suppress(values, reason, source=None):
+    """Add addresses/domains to the suppression list (existing entries are kept); returns the number added"""
+    if reason not in REASONS:
+        raise ValueError(f"Unknown suppression reason: {reason}")
+    values = {normalize(value) for value in values} - {''}
+    added = 0
+    ordered = sorted(values)
+    for start in range(0, len(ordered), 500):
+        chunk = ordered[start:start + 500]
+        existing = {row.value for row in db.session.query(Suppression.value).filter(Suppression.value.in_(chunk))}
+        new = [{'kind': value_kind(value), 'value': value, 'reason': reason, 'source': source}
+               for value in chunk if value not in existing]
+        if new:
+            db.session.execute(db.insert(Suppression), new)
+            added += len(new)
+    return added
+
+
+def unsuppress(values):
+    values = {normalize(value) for value in values}
+    return Suppression.query.filter(Suppression.value.in_(values)).delete(synchronize_session=False)
+
+
+def read_values(path):
+    """Addresses or domains from a text file (one per line) or the first column of a CSV"""
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if row and row[0].strip() and row[0].strip().lower() not in ('email', 'domain'):
+                yield row[0]
+
+
+if __name__ == '__main__':
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Manage the suppression list')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    add_parser = subcommands.add_parser('add', help='Suppress addresses or domains')
+    add_parser.add_argument('values', nargs='+')
+    add_parser.add_argument('--reason', choices=REASONS, default='manual')
+    import_parser = subcommands.add_parser('import', help='Suppress every address/domain listed in a file')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--reason', choices=REASONS, default='manual')
+    remove_parser = subcommands.add_parser('remove', help='Remove addresses or domains from the list')
+    remove_parser.add_argument('values', nargs='+')
+    check_parser = subcommands.add_parser('check', help='Show whether addresses would be skipped')
+    check_parser.add_argument('values', nargs='+')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        if args.command == 'add':
+            logger.info("Suppressed %s new entries", suppress(args.values, args.reason, source='cli'))
+        elif args.command == 'import':
+            logger.info("Suppressed %s new entries", suppress(read_values(args.path), args.reason, source=args.path))
+        elif args.command == 'remove':
+            logger.info("Removed %s entries", unsuppress(args.values))
+        else:
+            index = SuppressionIndex().refresh()
+            for value in args.values:
+                reason = index.check(value, contacted=True)
+                print(f"{value}: {reason or 'ok'}")
+        db.session.commit()
@@ -0,0 +1,155 @@
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Matches {variable_name}; anything else in braces (CSS, JSON, etc.) is kept literally
+VARIABLE_PATTERN = re.compile(r'\{([A-Za-z_][A-Za-z0-9_]*)\}')
+SUBJECT_PATTERN = re.compile(r'(?i)^\s*subject\s*:\s*(.*?)\s*\n+')
+
+# Slots that may be filled by the LLM when no value was supplied
+ENRICHMENT_SLOTS = {'custom_research', 'value_prop', 'pain_point'}
+SLOT_PATTERN = re.compile(r'\{(' + '|'.join(sorted(ENRICHMENT_SLOTS)) + r')\}')
+
+# First line of a sign-off paragraph; build_message appends the real signature
+CLOSING_PATTERN = re.compile(r'(?i)^\s*(best regards|kind regards|warm regards|regards|sincerely|best|thanks|thank you)\s*,?\s*$')
+
+
+class CompiledTemplate:
+    """A template precompiled into a flat substitution plan"""
+
+    def __init__(self, content, template_id=None, version=None):
+        self.template_id = template_id
+        self.version = version
+
+        content = content or ''
+        subject_match = SUBJECT_PATTERN.match(content)
+        if subject_match:
+            self.subject_plan = self._compile(subject_match.group(1))
+            content = content[subject_match.end():]
+        else:
+            self.subject_plan = None
+        self.body_plan = self._compile(self._strip_signature(content.strip('\n')))
+
+        self.variables = set(self._variables(self.body_plan))
+        if self.subject_plan:
+            self.variables.update(self._variables(self.subject_plan))
+        self.enrichment_slots = self.variables & ENRICHMENT_SLOTS
+
+    @staticmethod
+    def _strip_signature(text):
+        """Drop a sign-off paragraph near the end (keeping any P.S. after it), since build_message adds the signature"""
+        paragraphs = re.split(r'\n\s*\n', text)
+        for index in range(len(paragraphs) - 1, max(len(paragraphs) - 3, -1), -1):
+            if CLOSING_PATTERN.match(paragraphs[index].split('\n', 1)[0]):
+                return '\n\n'.join(paragraphs[:index] + paragraphs[index + 1:]).rstrip('\n')
+        return text
+
+    @staticmethod
+    def _compile(text):
+        """Split text into alternating (literal, variable) pairs"""
+        plan = []
+        position = 0
+        for match in VARIABLE_PATTERN.finditer(text):
+            plan.append((text[position:match.start()], match.group(1)))
+            position = match.end()
+        plan.append((text[position:], None))
+        return plan
+
+    @staticmethod
+    def _variables(plan):
+        return [name for _, name in plan if name]
+
+    @staticmethod
+    def _execute(plan, values):
+        parts = []
+        for literal, name in plan:
+            parts.append(literal)
+            if name:
+                value = values.get(name)
+                # Leave the placeholder visible so a missing value is obvious
+                parts.append(str(value) if value not in (None, '') else '{' + name + '}')
+        return ''.join(parts)
+
+    def missing_variables(self, values, include_enrichment=False):
+        """Return the variables that would be left unfilled by these values"""
+        missing = {name for name in self.variables if values.get(name) in (None, '')}
+        if not include_enrichment:
+            missing -= ENRICHMENT_SLOTS
+        return sorted(missing)
+
+    def render(self, values):
+        """Render the body with the given values"""
+        return self._execute(self.body_plan, values)
+
+    def render_subject(self, values):
+        """Render the template's own subject line, if it has one"""
+        if not self.subject_plan:
+            return None
+        return self._execute(self.subject_plan, values)
+
+
+class TemplateCatalog:
+    """Per-process cache of compiled templates keyed by id and last update"""
+
+    def __init__(self):
+        self._compiled = {}
+
+    def get(self, template):
+        version = template.updated_at.isoformat() if template.updated_at else None
+        cached = self._compiled.get(template.id)
+        if cached is None or cached.version != version:
+            cached = CompiledTemplate(template.template_content, template_id=template.id, version=version)
+            self._compiled[template.id] = cached
+            logger.debug("Compiled template %s with variables: %s", template.id, sorted(cached.variables))
+        return cached
+
+    def clear(self):
+        self._compiled.clear()
+
+
+def build_template_values(company_name='', target_person='', email='', context='', industry='', extra=None):
+    """Build the variable mapping for a campaign, including the aliases used by existing templates"""
+    values = {
+        'company_name': company_name,
+        'person_name': target_person,
+        'recipient_name': target_person,
+        'email': email,
+        'context': context,
+        'industry': industry,
+    }
+    for key, value in (extra or {}).items():
+        name = re.sub(r'\W+', '_', str(key).strip().lower()).strip('_')
+        if name and value not in (None, '') and not values.get(name):
+            values[name] = value
+    # Our own details come from the SENDER_* settings unless the row supplies them
+    for name, value in sender_values().items():
+        if not values.get(name):
+            values[name] = value
+    return values
+
+
+def sender_values():
+    """Template variables describing the sender, from the same settings build_message uses"""
+    phone = os.getenv('SENDER_PHONE', '555-555-5555')
+    email = os.getenv('SENDER_EMAIL', 'your@email.com')
+    return {
+        'sender_name': os.getenv('SENDER_NAME', 'Your Name'),
+        'sender_title': os.getenv('SENDER_TITLE', 'Your Title'),
+        'our_company_name': os.getenv('SENDER_COMPANY', 'Enspyre Management Services'),
+        'sender_phone': phone,
+        'sender_email': email,
+        'contact_info': ' | '.join(part for part in (phone, email) if part),
+        'website_url': os.getenv('SENDER_WEBSITE', 'https://yourcompany.com'),
+    }
+
+
+def unfilled_slots(text):
+    """Enrichment slots left as {placeholders} in a rendered body"""
+    return {match.group(1) for match in SLOT_PATTERN.finditer(text or '')}
+
+
+def fill_slots(text, values):
+    """Fill the enrichment placeholders of a rendered body; everything else is left as rendered"""
+    return SLOT_PATTERN.sub(lambda match: str(values.get(match.group(1)) or match.group(0)), text)
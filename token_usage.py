@@ -0,0 +1,347 @@
+"""
+Token and cost accounting for LLM calls, with optional per-job budgets.
+
+Each provider call asks model_for() which model to use, then hands the
+response to record(). record() takes the input and output tokens from the
+response's usage metadata, or estimates them from the text length when the
+response has none. It estimates the cost from PRICES, in USD per million
+tokens. LLM_PRICES="model=input/output,..." overrides those prices. Tokens
+read from a provider context cache are charged at CACHED_INPUT_RATE. Each call
+is tagged with its call site and with the campaign_id and import_job of the
+current log_context(). Rows are buffered in memory. flush() writes them to
+llm_usage at the end of every app context, and long-running jobs also call it
+between batches. totals() and section_totals() query the rows.
+
+track(import_job=..., budget=Budget(...)) scopes a job such as a CAB import
+or a scenario batch. Inside it, model_for() checks each call against the
+budget before the call is made. If the call would go over, the budget either
+stops the job by raising BudgetExceeded, or downgrades to the model's cheaper
+fallback (CHEAPER_MODELS) while that still fits. The expected output of a
+call is the job's average so far. Concurrent calls can each pass the check,
+so a concurrent job can overshoot by up to one call per worker.
+
+Usage (from the repository root):
+    python token_usage.py report [--group-by call_site,model] [--since 2024-01-01] [--import-job ID]
+    python token_usage.py sections [--call-site outreach] [--since 2024-01-01]
+"""
+import os
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from sqlalchemy import func, insert
+from models import db, LLMUsage
+from log_pipeline import log_context, current_context
+
+logger = logging.getLogger(__name__)
+
+# USD per million input / output tokens: list prices, used for estimates only
+PRICES = {
+    'gemini-1.5-pro': (1.25, 5.00),
+    'gemini-1.5-flash': (0.075, 0.30),
+    'gpt-4': (30.00, 60.00),
+    'gpt-4o-mini': (0.15, 0.60),
+}
+# Share of the input price charged for tokens read from a context cache (cache storage is not counted)
+CACHED_INPUT_RATE = 0.25
+# What on_exceed='downgrade' switches to
+CHEAPER_MODELS = {'models/gemini-1.5-pro': 'models/gemini-1.5-flash', 'gpt-4': 'gpt-4o-mini'}
+DEFAULT_OUTPUT_TOKENS = 500  # Expected output of a job's first call
+
+_budget = ContextVar('usage_budget', default=None)
+_buffer = []
+_buffer_lock = threading.Lock()
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)"""
+    return len(text) // 4 + 1
+
+
+def prices():
+    """PRICES updated from LLM_PRICES ("model=input/output,...")"""
+    table = dict(PRICES)
+    for item in os.getenv('LLM_PRICES', '').split(','):
+        name, _, rate = item.partition('=')
+        if name.strip() and rate.strip():
+            input_price, _, output_price = rate.partition('/')
+            table[name.strip()] = (float(input_price), float(output_price or input_price))
+    return table
+
+
+def cost(model, input_tokens, output_tokens, cached_tokens=0):
+    """Estimated USD for a call, or None for a model without a price"""
+    price = prices().get((model or '').rsplit('/', 1)[-1])
+    if price is None:
+        return None
+    uncached = input_tokens - cached_tokens
+    return (uncached * price[0] + cached_tokens * price[0] * CACHED_INPUT_RATE + output_tokens * price[1]) / 1e6
+
+
+def prompt_text(prompt):
+    """The text of a prompt: a string, or chat messages ([{'role': ..., 'content': ...}])"""
+    if isinstance(prompt, str):
+        return prompt
+    return '\n'.join(str(message.get('content', '')) for message in prompt)
+
+
+def response_text(response):
+    if response is None:
+        return ''
+    choices = getattr(response, 'choices', None)
+    if choices:
+        return choices[0].message.content or ''
+    return getattr(response, 'text', None) or ''
+
+
+def usage_of(response):
+    """(input_tokens, output_tokens, cached_tokens) reported by the provider; None where it reported nothing"""
+    metadata = getattr(response, 'usage_metadata', None)  # google-genai
+    if metadata is not None:
+        return (getattr(metadata, 'prompt_token_count', None), getattr(metadata, 'candidates_token_count', None),
+                getattr(metadata, 'cached_content_token_count', None))
+    usage = getattr(response, 'usage', None)  # openai
+    if usage is not None:
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return (getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None),
+                getattr(details, 'cached_tokens', None))
+    return None, None, None
+
+
+class Budget:
+    """Spending limit of one job: record() charges it, model_for() checks it"""
+
+    def __init__(self, max_cost_usd=None, max_tokens=None, on_exceed='stop'):
+        if on_exceed not in ('stop', 'downgrade'):
+            raise ValueError("on_exceed must be 'stop' or 'downgrade'")
+        self.max_cost_usd = max_cost_usd
+        self.max_tokens = max_tokens
+        self.on_exceed = on_exceed
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost_usd = 0.0
+        self.downgraded = 0
+        self._lock = threading.Lock()
+
+    def charge(self, input_tokens, output_tokens, cost_usd):
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cost_usd += cost_usd or 0.0
+
+    def _fits(self, model, input_tokens):
+        output_tokens = self.output_tokens // self.calls if self.calls else DEFAULT_OUTPUT_TOKENS
+        if self.max_tokens is not None:
+            if self.input_tokens + self.output_tokens + input_tokens + output_tokens > self.max_tokens:
+                return False
+        if self.max_cost_usd is not None:
+            if self.cost_usd + (cost(model, input_tokens, output_tokens) or 0.0) > self.max_cost_usd:
+                return False
+        return True
+
+    def model_for(self, call_site, prompt, model):
+        input_tokens = estimate_tokens(prompt_text(prompt))
+        with self._lock:
+            if self._fits(model, input_tokens):
+                return model
+            cheaper = CHEAPER_MODELS.get(model)
+            if self.on_exceed == 'downgrade' and cheaper and self._fits(cheaper, input_tokens):
+                if not self.downgraded:
+                    logger.warning("Budget nearly spent; switching %s calls from %s to %s", call_site, model, cheaper)
+                self.downgraded += 1
+                return cheaper
+        raise BudgetExceeded(f"The next {call_site} call would exceed the budget "
+                             f"(spent ${self.cost_usd:.4f}, {self.input_tokens + self.output_tokens} tokens)")
+
+    def summary(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'input_tokens': self.input_tokens,
+                'output_tokens': self.output_tokens,
+                'cost_usd': round(self.cost_usd, 4),
+                'downgraded_calls': self.downgraded,
+            }
+
+
+@contextmanager
+def track(import_job=None, budget=None):
+    """Tag the LLM calls in this block with `import_job` and hold them to `budget`"""
+    token = _budget.set(budget)
+    try:
+        with log_context(**({'import_job': import_job} if import_job else {})):
+            yield budget
+    finally:
+        _budget.reset(token)
+
+
+def model_for(call_site, prompt, model):
+    """The model to call: `model`, or a cheaper one under a 'downgrade' budget; raises BudgetExceeded"""
+    budget = _budget.get()
+    return budget.model_for(call_site, prompt, model) if budget else model
+
+
+def record(call_site, model, prompt, response=None, output_text=None, sections=None, cached_prefix=None, latency=None,
+           cache_skipped=None):
+    """
+    Account for one call. `response` is the provider response (the last chunk for a stream),
+    read for its usage metadata; `sections` maps prompt section names to their text.
+    `prompt` is the whole prompt, including a `cached_prefix` the call referenced instead of sending.
+    `latency` is the call's duration in seconds (drain_forecast calibrates from it).
+    `cache_skipped` is why a cacheable prefix was sent whole (PromptCache.skip_reason).
+    """
+    input_tokens, output_tokens, cached_tokens = usage_of(response)
+    estimated = input_tokens is None or output_tokens is None
+    if input_tokens is None:
+        input_tokens = estimate_tokens(prompt_text(prompt))
+    if output_tokens is None:
+        output_tokens = estimate_tokens(output_text if output_text is not None else response_text(response))
+    if cached_tokens is None:
+        cached_tokens = estimate_tokens(cached_prefix) if cached_prefix else 0
+    call_cost = cost(model, input_tokens, output_tokens, cached_tokens)
+    fields = current_context()
+    row = {
+        'created_at': datetime.utcnow(),
+        'call_site': call_site,
+        'model': model,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'cached_tokens': cached_tokens,
+        'cost_usd': call_cost,
+        'estimated': estimated,
+        'campaign_id': fields.get('campaign_id'),
+        'import_job': fields.get('import_job'),
+        'sections': {name: estimate_tokens(text) for name, text in sections.items()} if sections else None,
+        'latency_ms': round(latency * 1000) if latency is not None else None,
+        'cache_skipped': cache_skipped,
+    }
+    budget = _budget.get()
+    if budget is not None:
+        budget.charge(input_tokens, output_tokens, call_cost)
+    logger.debug("%s call on %s: %s input + %s output tokens", call_site, model, input_tokens, output_tokens)
+    with _buffer_lock:
+        _buffer.append(row)
+
+
+def flush():
+    """
+    Write the buffered rows on a connection of their own (inside an app context); returns how many.
+    Call it outside write transactions: on SQLite it would wait for the caller's own lock.
+    """
+    with _buffer_lock:
+        rows = _buffer[:]
+        del _buffer[:]
+    if not rows:
+        return 0
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(insert(LLMUsage.__table__), rows)
+    except Exception as e:
+        logger.error("Could not write %s LLM usage rows: %s", len(rows), e)
+        with _buffer_lock:
+            _buffer[:0] = rows
+        return 0
+    return len(rows)
+
+
+def flush_on_teardown(exc=None):
+    # Registered before Flask-SQLAlchemy's teardown so it runs after the session is closed
+    flush()
+
+
+GROUPS = {
+    'call_site': LLMUsage.call_site,
+    'model': LLMUsage.model,
+    'import_job': LLMUsage.import_job,
+    'campaign_id': LLMUsage.campaign_id,
+    'day': func.date(LLMUsage.created_at),
+}
+
+
+def _filtered(query, since=None, until=None, import_job=None, campaign_id=None, call_site=None):
+    if since:
+        query = query.filter(LLMUsage.created_at >= since)
+    if until:
+        query = query.filter(LLMUsage.created_at < until)
+    if import_job:
+        query = query.filter(LLMUsage.import_job == import_job)
+    if campaign_id:
+        query = query.filter(LLMUsage.campaign_id == campaign_id)
+    if call_site:
+        query = query.filter(LLMUsage.call_site == call_site)
+    return query
+
+
+def totals(group_by=('call_site',), **filters):
+    """Calls, tokens and cost per group (any of GROUPS), most expensive first"""
+    for name in group_by:
+        if name not in GROUPS:
+            raise ValueError(f"Unknown group: {name}")
+    keys = [GROUPS[name].label(name) for name in group_by]
+    cost_sum = func.sum(LLMUsage.cost_usd)
+    query = _filtered(db.session.query(
+        *keys,
+        func.count(LLMUsage.id).label('calls'),
+        func.sum(LLMUsage.input_tokens).label('input_tokens'),
+        func.sum(LLMUsage.output_tokens).label('output_tokens'),
+        func.sum(LLMUsage.cached_tokens).label('cached_tokens'),
+        func.count(LLMUsage.cache_skipped).label('cache_skipped_calls'),
+        cost_sum.label('cost_usd'),
+    ), **filters)
+    rows = query.group_by(*keys).order_by(cost_sum.desc(), func.sum(LLMUsage.input_tokens).desc()).all()
+    return [{**row._asdict(), 'cost_usd': round(row.cost_usd or 0, 4)} for row in rows]
+
+
+def section_totals(**filters):
+    """Estimated input tokens per prompt section and call site, largest first, with each section's share"""
+    sums = {}
+    query = _filtered(db.session.query(LLMUsage.call_site, LLMUsage.sections), **filters)
+    for call_site, sections in query.yield_per(5000):
+        for name, tokens in (sections or {}).items():
+            entry = sums.setdefault((call_site, name), [0, 0])
+            entry[0] += 1
+            entry[1] += tokens
+    per_site = {}
+    for (call_site, _), (_, tokens) in sums.items():
+        per_site[call_site] = per_site.get(call_site, 0) + tokens
+    report = [
+        {'call_site': call_site, 'section': name, 'calls': calls, 'tokens': tokens,
+         'avg_tokens': round(tokens / calls), 'share': round(tokens / per_site[call_site], 3) if per_site[call_site] else 0}
+        for (call_site, name), (calls, tokens) in sums.items()
+    ]
+    return sorted(report, key=lambda entry: entry['tokens'], reverse=True)
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description='LLM token usage and estimated cost')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    report_parser = subcommands.add_parser('report', help='Totals per call site, model, import job, campaign or day')
+    report_parser.add_argument('--group-by', default='call_site', help=f"Comma-separated: {', '.join(GROUPS)}")
+    sections_parser = subcommands.add_parser('sections', help='Which prompt sections use the most tokens')
+    sections_parser.add_argument('--call-site')
+    for sub in (report_parser, sections_parser):
+        sub.add_argument('--since', type=datetime.fromisoformat)
+        sub.add_argument('--until', type=datetime.fromisoformat)
+        sub.add_argument('--import-job')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        filters = {'since': args.since, 'until': args.until, 'import_job': args.import_job}
+        if args.command == 'report':
+            rows = totals(tuple(args.group_by.split(',')), **filters)
+        else:
+            rows = section_totals(call_site=args.call_site, **filters)
+        for row in rows:
+            print('  '.join(f"{key}={value}" for key, value in row.items()))
@@ -0,0 +1,11 @@
+"""
+WSGI entry point for production servers, e.g.
+
+    gunicorn -w 4 --threads 8 -b 0.0.0.0:8080 wsgi:application
+
+Sending is done by a separate `python automation_runner.py` process,
+so any number of web workers can be started.
+"""
+from app import create_app
+
+application = create_app()